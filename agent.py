@@ -0,0 +1,199 @@
+"""プローブエージェント
+
+中央のIP Managerに登録し、割り当てられたサービス（コンシステントハッシュで分割された担当分）を
+チェックして結果をまとめて報告する。LANとTailscaleなど、中央のサーバーから届かない
+ネットワークのチェックに使う。
+
+    IPMANAGER_AGENT_TOKEN=secret python agent.py --server http://central:5000 --name lan-1 --networks 192.168.0.0/16
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from utils.circuit import HostCircuitBreaker
+from utils.http_probe import HTTPProbePool
+from utils.network import host_alive, tcp_connect
+from utils.probe_engine import ProbeEngine
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+class ProbeAgent:
+    """担当分のサービスを定期的にチェックし、結果を中央へバッチで送るエージェント"""
+
+    def __init__(self, server, token, name, networks=(), interval=60, batch_size=100, flush_seconds=2.0,
+                 max_workers=32, per_host_limit=4, connect_timeout=3, read_timeout=5):
+        self.server = server.rstrip('/')
+        self.name = name
+        self.networks = list(networks)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.connect_timeout = connect_timeout
+        self.heartbeat_seconds = 15
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+        self.http_pool = HTTPProbePool(connect_timeout=connect_timeout, read_timeout=read_timeout)
+        # 落ちているホストの待ち時間がサービスの数だけ積み重ならないよう、失敗したらホスト単位で確認する
+        self.engine = ProbeEngine(
+            self.probe, max_workers=max_workers, per_host_limit=per_host_limit,
+            host_check=lambda host, ports: host_alive(host, ports, timeout=connect_timeout),
+            breaker=HostCircuitBreaker()
+        )
+        self.services = []
+        self._etag = None
+        self._pending = []              # 送信に失敗した結果（次の送信で再送する）
+        self._stop = threading.Event()
+
+    def _url(self, path):
+        return f'{self.server}/api/agents/{self.name}{path}'
+
+    def probe(self, ip_address, port, probe_type='http'):
+        if probe_type == 'tcp':
+            return tcp_connect(ip_address, port, timeout=self.connect_timeout)
+        return self.http_pool.probe(ip_address, port, scheme='https' if probe_type == 'https' else 'http')
+
+    def heartbeat(self):
+        response = self.session.post(self._url('/heartbeat'), json={
+            'networks': self.networks,
+            'info': {'hostname': socket.gethostname(), 'pid': os.getpid()}
+        }, timeout=10)
+        response.raise_for_status()
+        self.heartbeat_seconds = response.json().get('heartbeat_seconds', self.heartbeat_seconds)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except requests.RequestException as e:
+                log(f"ハートビートに失敗しました: {e}")
+
+    def fetch_assignments(self):
+        """担当の一覧を取得する（変わっていなければ前回の一覧を使う）"""
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = self.session.get(self._url('/assignments'), headers=headers, timeout=30)
+        if response.status_code == 409:
+            # 期限切れで登録が外れていた場合は登録し直す
+            self.heartbeat()
+            response = self.session.get(self._url('/assignments'), timeout=30)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        self._etag = response.headers.get('ETag')
+        self.services = response.json()['services']
+        return True
+
+    def report(self, results):
+        """結果を送る（失敗した分は保持し、次の送信時にまとめて再送する）"""
+        self._pending.extend(results)
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            try:
+                response = self.session.post(self._url('/results'), json={'results': batch}, timeout=30)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                log(f"結果の送信に失敗しました（{len(self._pending)}件を保持）: {e}")
+                # 中央が長時間止まっていても溜め込みすぎない
+                del self._pending[:max(len(self._pending) - self.batch_size * 100, 0)]
+                return
+            del self._pending[:len(batch)]
+
+    def sweep(self):
+        """担当の全サービスをチェックし、batch_size 件か flush_seconds 秒ごとに報告する"""
+        services = [svc for svc in self.services if svc.get('ip_address') and svc.get('port')]
+        targets = [(svc['ip_address'], svc['port'], svc.get('probe_type') or 'http') for svc in services]
+        batch = []
+        flushed = time.monotonic()
+        for index, (reachable, latency) in self.engine.iter_results(targets):
+            batch.append({
+                'uid': services[index]['uid'],
+                'status': 'reachable' if reachable else 'unreachable',
+                'latency': latency,
+                'checked_at': time.time()
+            })
+            if len(batch) >= self.batch_size or time.monotonic() - flushed >= self.flush_seconds:
+                self.report(batch)
+                batch = []
+                flushed = time.monotonic()
+            if self._stop.is_set():
+                break
+        if batch:
+            self.report(batch)
+        return len(services)
+
+    def run(self):
+        while True:
+            try:
+                self.heartbeat()
+                break
+            except requests.RequestException as e:
+                log(f"登録に失敗しました。再試行します: {e}")
+                if self._stop.wait(self.heartbeat_seconds):
+                    return
+        log(f"エージェント {self.name} を登録しました（{self.server}）")
+        threading.Thread(target=self._heartbeat_loop, name='agent-heartbeat', daemon=True).start()
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    if self.fetch_assignments():
+                        log(f"担当サービス: {len(self.services)}件")
+                    count = self.sweep()
+                    log(f"{count}件のチェックが完了しました（{time.monotonic() - started:.1f}秒）")
+                except requests.RequestException as e:
+                    log(f"中央サーバーとの通信に失敗しました: {e}")
+                self._stop.wait(max(self.interval - (time.monotonic() - started), 1))
+        finally:
+            self.leave()
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def leave(self):
+        """離脱を通知し、担当を他のメンバーへ振り直させる"""
+        try:
+            self.session.delete(self._url(''), timeout=5)
+            log(f"エージェント {self.name} の登録を解除しました")
+        except requests.RequestException:
+            pass
+        self.http_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP Manager のプローブエージェント')
+    parser.add_argument('--server', default=os.environ.get('IPMANAGER_SERVER', 'http://127.0.0.1:5000'))
+    parser.add_argument('--token', default=os.environ.get('IPMANAGER_AGENT_TOKEN'))
+    parser.add_argument('--name', default=os.environ.get('IPMANAGER_AGENT_NAME') or socket.gethostname())
+    parser.add_argument('--networks', default=os.environ.get('IPMANAGER_AGENT_NETWORKS', ''),
+                        help='チェックできるネットワーク（カンマ区切りのCIDR。省略時は全て）')
+    parser.add_argument('--interval', type=float, default=60, help='チェックの間隔（秒）')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--flush-seconds', type=float, default=2.0)
+    parser.add_argument('--max-workers', type=int, default=32)
+    parser.add_argument('--per-host-limit', type=int, default=4)
+    args = parser.parse_args()
+    if not args.token:
+        parser.error('--token または IPMANAGER_AGENT_TOKEN が必要です')
+
+    agent = ProbeAgent(
+        args.server, args.token, args.name,
+        networks=[n.strip() for n in args.networks.split(',') if n.strip()],
+        interval=args.interval, batch_size=args.batch_size, flush_seconds=args.flush_seconds,
+        max_workers=args.max_workers, per_host_limit=args.per_host_limit
+    )
+    signal.signal(signal.SIGTERM, agent.stop)
+    signal.signal(signal.SIGINT, agent.stop)
+    agent.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,196 @@
 import os
+import io
+import atexit
+import re
+import csv
 import json
+import hashlib
+import hmac
+import queue
 import ipaddress
+import math
 import subprocess
+import tempfile
+import sys
 import threading
 import time
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from flask import Flask, Response, abort, render_template, request, redirect, session, url_for, flash, jsonify, stream_with_context
 from datetime import datetime
-import requests 
+
+from utils.agents import AgentRegistry, can_reach, parse_networks
+from utils.broadcast import ChangeBroadcaster
+from utils.checkqueue import CheckQueue, InstanceLock, spawn_checker, stop_checker
+from utils.circuit import HostCircuitBreaker
+from utils.discovery import DiscoveryJobs, PortScanner, suggest_service
+from utils.hashring import HashRing
+from utils.history import LatencyHistory, sparkline_path
+from utils.http_cache import ConditionalResponseCache
+from utils.http_probe import HTTPProbePool
+from utils.ip_index import IPIndex
+from utils.metrics import OPENMETRICS_CONTENT_TYPE, PROMETHEUS_CONTENT_TYPE, MetricsRegistry
+from utils.network import host_alive, tcp_connect
+from utils.pagination import decode_cursor, encode_cursor, paginate
+from utils.probe_engine import ProbeEngine
+from utils.probe_scheduler import ProbeScheduler
+from utils.profiling import RequestProfiler, SamplingProfiler
+from utils.search_index import SearchIndex
+from utils.singleflight import SingleFlight
+from utils.store import DataStore, JSONFileBackend, SQLiteBackend
 
 app = Flask(__name__)
 # ★★★ ここを必ず変更してください ★★★
 app.secret_key = 'your_secret_key_here' 
 
-DATA_FILE = os.path.join(os.path.dirname(__file__), 'data.json')
+DATA_FILE = os.environ.get('IPMANAGER_DATA_FILE') or os.path.join(os.path.dirname(__file__), 'data.json')
+SQLITE_FILE = os.environ.get('IPMANAGER_SQLITE_FILE') or os.path.join(os.path.dirname(__file__), 'data.db')
+STORAGE_BACKEND = os.environ.get('IPMANAGER_STORAGE_BACKEND', 'json')  # 'json' または 'sqlite'
+HISTORY_FILE = os.environ.get('IPMANAGER_HISTORY_FILE') or DATA_FILE + '.history.db'  # レイテンシ履歴（SQLite。全プロセスで共有）
+# /metrics 用に各プロセスが値を書き出すディレクトリ（データファイルごとに分ける）
+METRICS_DIR = os.environ.get('IPMANAGER_METRICS_DIR') or os.path.join(
+    tempfile.gettempdir(),
+    'ipmanager-metrics-' + hashlib.sha1(os.path.abspath(DATA_FILE).encode('utf-8')).hexdigest()[:8]
+)
+# プローブエージェント（別の拠点から担当分のサービスをチェックするプロセス）
+AGENT_TOKEN = os.environ.get('IPMANAGER_AGENT_TOKEN')  # 未設定ならエージェントAPIは無効
+AGENTS_FILE = os.environ.get('IPMANAGER_AGENTS_FILE') or DATA_FILE + '.agents'
+AGENT_SHARD_BY = os.environ.get('IPMANAGER_AGENT_SHARD_BY', 'uid')  # 'uid'（サービス単位）または 'group'（IPグループ単位）
+# このサーバー自身がチェックを担当するネットワーク（カンマ区切りのCIDR。空なら全て、'none' なら担当しない）
+LOCAL_PROBE_NETWORKS = os.environ.get('IPMANAGER_LOCAL_NETWORKS', '')
+AGENT_HEARTBEAT_SECONDS = 15
+AGENT_TTL_SECONDS = 60      # この秒数ハートビートのないエージェントは離脱とみなし、担当を振り直す
+AGENT_MAX_BATCH = 1000      # 1回の結果報告で受け付ける件数
+# チェッカー（自動チェックと「今すぐチェック」の依頼を処理する唯一のプロセス）
+CHECKER_LOCK_FILE = os.environ.get('IPMANAGER_CHECKER_LOCK') or DATA_FILE + '.checker.lock'
+CHECK_QUEUE_DIR = os.environ.get('IPMANAGER_CHECK_QUEUE') or DATA_FILE + '.checkq'
+CHECKER_MODE = os.environ.get('IPMANAGER_CHECKER', 'process')  # 'process'（Webサーバーがchecker.pyを子プロセスとして起動）または 'external'（別のサービスとして起動）
+CHECKER_POLL_SECONDS = 0.5      # チェッカーが依頼キューを確認する間隔（秒）
+CHECKER_STANDBY_SECONDS = 5     # 待機中のチェッカーがロックの取得を試みる間隔（秒）
+CHECK_RECORD_BATCH = 50         # 全件チェックの結果をこの件数か1秒ごとにジャーナルへ書き出す
+CHECK_WAIT_SECONDS = 10         # 単一サービスのチェックを依頼した時に結果を待つ最長時間（秒）
+CHECK_FRESHNESS_SECONDS = float(os.environ.get('IPMANAGER_CHECK_TTL', '30'))  # この秒数以内に確認済みの結果は再チェックせずに返す（0で無効）
 AUTO_CHECK_INTERVAL_SECONDS = 600
+SCHEDULER_MIN_INTERVAL_SECONDS = 60     # 状態が変化した直後の再チェック間隔（秒）
+SCHEDULER_MAX_INTERVAL_SECONDS = 3600   # ダウンが続くサービスのバックオフ上限（秒）
+SCHEDULER_JITTER = 0.1                  # チェック間隔に加える揺らぎ（±10%）
+SCHEDULER_FAVORITE_FACTOR = 0.5         # お気に入りのチェック間隔の倍率
+HISTORY_CAPACITY = 120      # サービスごとに保持する直近のサンプル数
+SPARKLINE_SAMPLES = 30      # 一覧に表示するスパークラインのサンプル数
+PROBE_MAX_WORKERS = 32      # 同時に実行するプローブの最大数
+PROBE_PER_HOST_LIMIT = 4    # 同一ホストへの同時プローブ数の上限
+HTTP_PROBE_METHOD = 'HEAD'  # 'HEAD' または 'GET'（GETはヘッダー受信後にボディを読まずに切断）
+HTTP_CONNECT_TIMEOUT = 3    # 接続タイムアウト（秒）
+HTTP_READ_TIMEOUT = 5       # 応答待ちタイムアウト（秒）
+HOST_CIRCUIT_COOLDOWN_SECONDS = 30      # 落ちていたホストを再確認するまでの間隔（秒）
+HOST_CIRCUIT_MAX_COOLDOWN_SECONDS = 600 # 落ちたままのホストの再確認間隔の上限（秒）
+PROBE_TYPES = ('http', 'https', 'tcp')  # tcp: TCP接続のみ確認（SSH・DB・MQTTなどHTTP以外のサービス向け）
+SORT_FIELDS = ('service_name', 'id', 'ip_address', 'port', 'status')
+PAGE_SIZE = 100             # 一覧・JSON APIの1ページあたりの件数
+MAX_PAGE_SIZE = 1000        # limit パラメータで指定できる上限
+RESPONSE_CACHE_ENTRIES = 32 # ETagごとに保持する圧縮済みレスポンスの数
+CHANGES_POLL_SECONDS = 30   # SSEが使えないブラウザで /changes を取りに行く間隔（秒）
+EVENTS_POLL_SECONDS = 1.0   # 他プロセス（自動チェック）の変更を検知する間隔（秒）
+EVENTS_KEEPALIVE_SECONDS = 15   # SSE接続を維持するためのコメント送信間隔（秒）
+EVENTS_MAX_SECONDS = 300    # 1本のSSE接続の最長時間（ワーカースレッドを占有し続けないよう再接続させる）
+# ワーカーごとのSSE接続数の上限（既定はGunicornのスレッド数の半分。残りのスレッドを他のリクエストに残す）
+EVENTS_MAX_CONNECTIONS = int(
+    os.environ.get('IPMANAGER_EVENTS_MAX_CONNECTIONS') or max(1, int(os.environ.get('IPMANAGER_THREADS', '32')) // 2)
+)
+IMPORT_MAX_ROWS = 100000    # 一括登録で一度に受け付ける最大行数
+EXPORT_CHUNK_ROWS = 500     # エクスポートで1回に送り出す行数
+DISCOVERY_TIMEOUT = 1.0        # 検出時の接続タイムアウト（秒）
+DISCOVERY_CONCURRENCY = 512    # 検出時に同時に待つ接続の数
+DISCOVERY_PER_HOST_LIMIT = 16  # 検出時の同一ホストへの同時接続数の上限
+DISCOVERY_RATE = 2000          # 検出時に1秒間に開始する接続の上限
+DISCOVERY_MAX_HOSTS = 1024     # 1回の検出で対象にできるホスト数（/22 相当）
+# 検出の対象にできるネットワーク（カンマ区切りのCIDR）。既定はプライベートとCGNAT（Tailscale）の範囲だけで、
+# 誰でも開ける画面から任意のグローバルアドレスをスキャンできないようにする
+DISCOVERY_NETWORKS = os.environ.get('IPMANAGER_DISCOVERY_NETWORKS', '10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,100.64.0.0/10')
+# 検出ジョブの状態を書き出すディレクトリ（どのワーカーからもジョブの状態を返せるように）
+DISCOVERY_DIR = os.environ.get('IPMANAGER_DISCOVERY_DIR') or DATA_FILE + '.discovery'
+EXPORT_FIELDS = ('id', 'service_name', 'ip_address', 'port', 'probe_type', 'favorite', 'status', 'latency', 'last_checked', 'ip_type')
 APP_VERSION = "3.5.0" # グループ表示・動的チェック機能追加
 
+# リクエスト単位の処理時間の計測（IPMANAGER_PROFILING=1 で有効。Server-Timing ヘッダーと遅いリクエストのログ）
+PROFILING_ENABLED = os.environ.get('IPMANAGER_PROFILING', '') in ('1', 'true', 'yes')
+SLOW_REQUEST_MS = float(os.environ.get('IPMANAGER_SLOW_REQUEST_MS', '500'))
+SLOW_REQUEST_LOG = os.environ.get('IPMANAGER_SLOW_LOG')  # 未指定なら標準エラー出力
+PROFILE_DIR = os.environ.get('IPMANAGER_PROFILE_DIR') or tempfile.gettempdir()  # サンプリング結果の保存先
+
+profiler = RequestProfiler(enabled=PROFILING_ENABLED, slow_threshold_ms=SLOW_REQUEST_MS, slow_log=SLOW_REQUEST_LOG)
+profiler.init_app(app)
+sampling_profiler = SamplingProfiler()
+
+# ==============================================================================
+# メトリクス（/metrics で Prometheus / OpenMetrics 形式で出力）
+# ==============================================================================
+metrics = MetricsRegistry(METRICS_DIR)
+probe_results = metrics.counter(
+    'ipmanager_probe_results', 'プローブの結果（ok, http_status, timeout, connection_error, error）',
+    ('probe_type', 'result')
+)
+probe_latency = metrics.histogram(
+    'ipmanager_probe_latency_seconds', '到達可能だったプローブのレイテンシ', ('ip_type', 'probe_type')
+)
+sweep_duration = metrics.histogram(
+    'ipmanager_sweep_duration_seconds', 'チェック1回分（全件チェック・スケジュール実行）の所要時間', ('kind',),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+)
+sweeps_in_progress = metrics.gauge('ipmanager_sweeps_in_progress', '実行中のチェックの数', ('kind',))
+sweep_overlaps = metrics.counter(
+    'ipmanager_sweep_overlaps', '同じプロセスで別のチェックが実行中に開始されたチェックの数', ('kind',)
+)
+store_seconds = metrics.histogram(
+    'ipmanager_store_operation_seconds', 'データストアの処理時間（load, save, append, reload, replay）',
+    ('operation', 'backend')
+)
+
+probe_short_circuits = metrics.counter(
+    'ipmanager_probe_short_circuits', 'ホストが落ちているためプローブせずに到達不可としたサービスの数（host_down, circuit_open）',
+    ('reason',)
+)
+host_circuits_open = metrics.gauge('ipmanager_host_circuits_open', '落ちているとして回路が開いているホストの数', mode='max')
+check_requests_total = metrics.counter(
+    'ipmanager_check_requests', '画面・APIからのチェック要求の扱い（probed, queued, cached, coalesced, remote）', ('scope', 'result')
+)
+agent_results_total = metrics.counter(
+    'ipmanager_agent_results', 'プローブエージェントから報告されたチェック結果（accepted, rejected）', ('agent', 'result')
+)
+events_rejected_total = metrics.counter(
+    'ipmanager_events_rejected', '同時接続数の上限を超えたため断った変更通知（/events）の接続'
+)
+
+_sweep_lock = threading.Lock()
+_sweeps_running = 0
+
+@contextmanager
+def track_sweep(kind):
+    """チェック1回分の所要時間と重なりを記録する"""
+    global _sweeps_running
+    with _sweep_lock:
+        if _sweeps_running:
+            sweep_overlaps.inc(kind=kind)
+        _sweeps_running += 1
+    sweeps_in_progress.inc(kind=kind)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sweep_duration.observe(time.perf_counter() - start, kind=kind)
+        sweeps_in_progress.dec(kind=kind)
+        with _sweep_lock:
+            _sweeps_running -= 1
+
 # ==============================================================================
 # データ読み込み・保存関数
 # ==============================================================================
-def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {'services': [], 'last_updated': None, 'version': APP_VERSION, 'port_history': []}
-    
-    with open(DATA_FILE, 'r') as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            return {'services': [], 'last_updated': None, 'version': APP_VERSION, 'port_history': []}
+def _empty_data():
+    return {'services': [], 'last_updated': None, 'version': APP_VERSION, 'port_history': []}
 
+def _migrate_data(data):
+    """読み込んだデータの構造保証とマイグレーション（読み込み時に一度だけ実行）"""
     data.setdefault('services', [])
     data.setdefault('version', APP_VERSION)
     data.setdefault('port_history', []) # 新しいポート履歴
@@ -44,14 +206,56 @@ def load_data():
             svc['http_latency'] = svc.pop('ping_latency') 
         svc.setdefault('http_latency', None)
         svc.setdefault('last_checked', None)
-        svc.setdefault('ip_type', 'unknown')
+        svc['ip_type'] = get_ip_type(svc['ip_address'])
         svc.setdefault('favorite', False)
+        if svc.get('probe_type') not in PROBE_TYPES:
+            svc['probe_type'] = 'http'
 
     # ポート履歴をセットで管理し、重複を防ぐ
     data['port_history'] = sorted(list(set(data['port_history'])))
         
     return data
 
+def _create_storage_backend():
+    if STORAGE_BACKEND == 'sqlite':
+        is_new = not os.path.exists(SQLITE_FILE)
+        backend = SQLiteBackend(SQLITE_FILE)
+        # 初回はdata.jsonの内容を引き継ぐ
+        if is_new and os.path.exists(DATA_FILE):
+            legacy = JSONFileBackend(DATA_FILE).load()
+            if legacy is not None:
+                backend.save(legacy)
+        return backend
+    return JSONFileBackend(DATA_FILE)
+
+# 差分同期（/changes）のため、レコードごとのuidと変更番号を記録する
+data_store = DataStore(
+    _create_storage_backend(), migrate=_migrate_data, default=_empty_data, track_changes=True,
+    observer=lambda operation, seconds: store_seconds.observe(seconds, operation=operation, backend=STORAGE_BACKEND)
+)
+
+def _service_json(svc):
+    s = svc.copy()
+    s['latency'] = s.pop('http_latency')
+    return s
+
+def _changes_payload(changes):
+    return {
+        'seq': changes['seq'],
+        'full': changes['full'],
+        'services': [_service_json(svc) for svc in changes['records']],
+        'deleted': changes['deleted'],
+        'last_updated': data_store.snapshot().get('last_updated', 'N/A')
+    }
+
+# 開いている一覧画面へ変更を配信する（ワーカーごとに1本の監視スレッド）
+change_broadcaster = ChangeBroadcaster(data_store, transform=_changes_payload, poll_interval=EVENTS_POLL_SECONDS)
+
+def load_data():
+    """変更用にデータの作業コピーを返す（読み取りのみなら data_store.snapshot() を使う）"""
+    with profiler.phase('load'):
+        return data_store.load()
+
 def save_data(data):
     # IDの振り直し
     for i, svc in enumerate(data['services']):
@@ -64,8 +268,43 @@ def save_data(data):
     ports = {s['port'] for s in data['services'] if s.get('port') is not None}
     data['port_history'] = sorted(list(ports))
     
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    before = {_history_key(svc) for svc in data_store.snapshot()['services']}
+    with profiler.phase('save'):
+        data_store.save(data)
+    # この保存で削除されたサービスの履歴だけを捨てる
+    latency_history.forget(before - {_history_key(svc) for svc in data['services']})
+    change_broadcaster.notify()
+
+def _status_update(svc):
+    """サービスのチェック結果をジャーナル用の更新レコードにする"""
+    return {
+        'id': svc['id'],
+        'match': {key: svc.get(key) for key in ('service_name', 'ip_address', 'port', 'probe_type')},
+        'fields': {key: svc[key] for key in ('status', 'http_latency', 'last_checked', 'ip_type')},
+        'dataset': {'last_updated': svc['last_checked']},
+        'ts': time.time()
+    }
+
+def _history_key(svc):
+    return f"{svc.get('ip_address')}:{svc.get('port')}"
+
+# レイテンシ履歴（data.jsonとは別のSQLiteに保存し、全ワーカーで同じ履歴を参照する）
+latency_history = LatencyHistory(HISTORY_FILE, HISTORY_CAPACITY)
+
+def record_updates(updates):
+    """状態更新をジャーナルに追記し、レイテンシ履歴にも記録する（チェックを行ったプロセスだけが記録する）"""
+    data_store.record_updates(updates)
+    latency_history.record_many(
+        (_history_key(update['match']), update['ts'],
+         update['fields'].get('http_latency') if update['fields'].get('status') == 'reachable' else None)
+        for update in updates
+        if update['fields'].get('status') != 'unknown'
+    )
+
+def record_status(services):
+    """チェック結果をジャーナルに追記する（data.json全体は書き直さない）"""
+    record_updates([_status_update(svc) for svc in services])
+    change_broadcaster.notify()
 
 # ==============================================================================
 # HTTP疎通チェック関数とIP識別関数
@@ -78,6 +317,10 @@ def is_valid_ipv4(ip_str):
     except ipaddress.AddressValueError:
         return False
 
+TAILSCALE_NETWORK = ipaddress.ip_network('100.64.0.0/10')
+
+# IP文字列ごとの判定結果はキャッシュし、同じIPを何度もパースしない
+@lru_cache(maxsize=65536)
 def is_private_ip(ip_str):
     """プライベートIPアドレス (192.168/16, 10/8, 172.16/12) を識別"""
     try:
@@ -86,15 +329,17 @@ def is_private_ip(ip_str):
     except ValueError:
         return False
 
+@lru_cache(maxsize=65536)
 def is_tailscale_ip(ip_str):
     """Tailscale IPアドレス (100.64.0.0/10, Carrier-Grade NAT) を識別"""
     try:
         ip_obj = ipaddress.ip_address(ip_str)
         # 100.64.0.0 - 100.127.255.255
-        return ip_obj in ipaddress.ip_network('100.64.0.0/10')
+        return ip_obj in TAILSCALE_NETWORK
     except ValueError:
         return False
 
+@lru_cache(maxsize=65536)
 def get_ip_type(ip_str):
     """IPアドレスのタイプを返す"""
     if is_tailscale_ip(ip_str):
@@ -104,6 +349,7 @@ def get_ip_type(ip_str):
     else:
         return 'public'
 
+@lru_cache(maxsize=65536)
 def get_ip_rank(ip_str):
     """ソート用のIPアドレスのランク付け (ローカルIP優先: 192.168.x.x > その他private > Tailscale > public)"""
     if ip_str.startswith('192.168.'):
@@ -114,6 +360,7 @@ def get_ip_rank(ip_str):
         return 3
     return 4
 
+@lru_cache(maxsize=65536)
 def get_ip_group(ip_str):
     """IPアドレスのグループ名を取得（サブネット単位）"""
     if not is_valid_ipv4(ip_str):
@@ -131,29 +378,58 @@ def get_ip_group(ip_str):
     else:
         return "Public"
 
+def group_sort_key(group_name):
+    """グループの表示順（ローカル優先）"""
+    if group_name.startswith('192.168.'):
+        return (0, group_name)
+    elif group_name.startswith('10.'):
+        return (1, group_name)
+    elif group_name.startswith('Tailscale'):
+        return (2, group_name)
+    elif group_name == 'Public':
+        return (3, group_name)
+    return (4, group_name)
+
+def _ip_index_key(svc):
+    return (svc.get('ip_address') or '0.0.0.0', str(svc.get('port')), svc.get('service_name'), svc.get('probe_type'))
+
+# IPアドレスの整数インデックスとサブネットグループ（データの変更時に差分だけ更新）
+ip_index = IPIndex(_ip_index_key, get_ip_group, group_sort_key)
+
+def get_ip_index():
+    """現在のデータに同期済みのIPインデックスを返す"""
+    data = data_store.snapshot()
+    ip_index.sync(data, data['services'])
+    return ip_index
+
+# 検索ボックス用の索引（名前は部分一致、IPアドレスは部分一致、ポートは完全一致）
+search_index = SearchIndex(
+    text_func=lambda svc: [svc['service_name']] if svc['service_name'] else [],
+    address_func=lambda svc: [svc['ip_address']] if svc['ip_address'] else [],
+    exact_func=lambda svc: [str(svc['port'])] if svc['port'] is not None else []
+)
+
+def _services_by_ids(services, ids):
+    """ID（1からの連番）からサービスを引く"""
+    result = []
+    for service_id in ids:
+        if 0 < service_id <= len(services) and services[service_id - 1]['id'] == service_id:
+            result.append(services[service_id - 1])
+        else:
+            svc = next((s for s in services if s['id'] == service_id), None)
+            if svc is not None:
+                result.append(svc)
+    return result
+
 def group_services_by_ip(services):
     """サービスをIPグループ別に分類"""
-    groups = {}
+    groups = {name: [] for name in get_ip_index().group_names()}
     for svc in services:
         group_name = get_ip_group(svc.get('ip_address', '0.0.0.0'))
-        if group_name not in groups:
-            groups[group_name] = []
-        groups[group_name].append(svc)
-
-    # グループをソート（ローカル優先）
-    def group_sort_key(group_name):
-        if group_name.startswith('192.168.'):
-            return (0, group_name)
-        elif group_name.startswith('10.'):
-            return (1, group_name)
-        elif group_name.startswith('Tailscale'):
-            return (2, group_name)
-        elif group_name == 'Public':
-            return (3, group_name)
-        return (4, group_name)
-
-    sorted_groups = sorted(groups.items(), key=lambda x: group_sort_key(x[0]))
-    return sorted_groups
+        groups.setdefault(group_name, []).append(svc)
+
+    # グループの並び順はインデックス側で維持している（ローカル優先）
+    return [(name, group) for name, group in groups.items() if group]
 
 def get_status_rank(status):
     """ソート用のステータスのランク付け (reachable > unreachable > unknown)"""
@@ -163,26 +439,136 @@ def get_status_rank(status):
         return 2
     return 3
 
-def check_http_service(ip_address, port):
-    """指定されたIPとポートへのHTTP(s) GETリクエストを試行"""
-    url = f"http://{ip_address}:{port}"
-    timeout = 5 
+def service_sort_key(svc, sort_by):
+    """一覧の並び順のキー（お気に入りは常に最優先）"""
+    # お気に入りは常に最優先（0=お気に入り、1=通常）
+    fav = 0 if svc.get('favorite') else 1
+
+    if sort_by == 'id':
+        return (fav, svc.get('id', 0))
+    elif sort_by == 'ip_address':
+        return (fav, svc.get('ip_address', '0.0.0.0'))
+    elif sort_by == 'port':
+        return (fav, svc.get('port') if svc.get('port') is not None else float('inf'))
+    elif sort_by == 'status':
+        latency = svc.get('http_latency')
+        return (
+            fav,
+            get_status_rank(svc.get('status', 'unknown')),
+            latency if latency is not None else float('inf')
+        )
+
+    return (
+        fav,
+        (svc.get('service_name') or '').lower(),
+        get_ip_rank(svc.get('ip_address') or '0.0.0.0'),
+        svc.get('ip_address') or '0.0.0.0'
+    )
+
+def _page_key(svc, sort_by):
+    # 同じ並び順キーのサービスも一意に順序付けて、カーソルの位置がぶれないようにする
+    tiebreak = tuple('' if value is None else value for value in _ip_index_key(svc))
+    return (service_sort_key(svc, sort_by), tiebreak, svc['id'])
+
+# 絞り込み条件ごとの並べ替え結果（スナップショットが変わるまで使い回す）
+_ordering_cache = OrderedDict()
+_ordering_lock = threading.Lock()
+_ORDERING_CACHE_SIZE = 16
+
+def query_services(data, version, search_query='', network=None, sort_by='service_name'):
+    """検索・CIDRで絞り込んだサービスを並び順キーの昇順で (サービス, キー) のリストとして返す"""
+    cache_key = (search_query, str(network) if network else '', sort_by)
+    with _ordering_lock:
+        cached = _ordering_cache.get(cache_key)
+        # ジャーナルの差分適用ではデータのオブジェクトは変わらないので、バージョンで判定する
+        if cached is not None and cached[0] == version:
+            _ordering_cache.move_to_end(cache_key)
+            return cached[1], cached[2]
+
+    with profiler.phase('filter'):
+        services = data['services']
+        if search_query:
+            search_index.sync(data, data['services'])
+            services = _services_by_ids(data['services'], search_index.search(search_query))
+        if network is not None:
+            # CIDRによる絞り込み（整数インデックスの二分探索で範囲を取り出す）
+            ip_index.sync(data, data['services'])
+            in_range = ip_index.query_cidr(network)
+            if search_query:
+                in_range = set(in_range)
+                services = [s for s in services if s['id'] in in_range]
+            else:
+                services = _services_by_ids(data['services'], in_range)
+
+    with profiler.phase('sort'):
+        ordered = sorted(((_page_key(s, sort_by), s) for s in services), key=lambda pair: pair[0])
+        keys = [key for key, _ in ordered]
+        services = [svc for _, svc in ordered]
+
+    with _ordering_lock:
+        _ordering_cache[cache_key] = (version, services, keys)
+        _ordering_cache.move_to_end(cache_key)
+        while len(_ordering_cache) > _ORDERING_CACHE_SIZE:
+            _ordering_cache.popitem(last=False)
+    return services, keys
+
+def _listing_args():
+    """一覧系のクエリパラメータ（検索・CIDR・並び順・件数）を読み取る"""
+    search_query = request.args.get('search', '').strip()
+    cidr = request.args.get('cidr', '').strip()
+    network = None
+    if cidr:
+        try:
+            network = ipaddress.IPv4Network(cidr, strict=False)
+        except ValueError:
+            network = None
+            cidr = None
+    sort_by = request.args.get('sort_by', 'service_name')
+    if sort_by not in SORT_FIELDS:
+        sort_by = 'service_name'
+    sort_order = 'desc' if request.args.get('sort_order') == 'desc' else 'asc'
     try:
-        response = requests.get(url, timeout=timeout, allow_redirects=True)
-        
-        if 200 <= response.status_code < 300:
-            latency_ms = response.elapsed.total_seconds() * 1000
-            return True, latency_ms
-        else:
-            return False, None
-            
-    except requests.exceptions.Timeout:
-        return False, None
-    except requests.exceptions.RequestException:
-        return False, None
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    return search_query, cidr, network, sort_by, sort_order, limit
+
+def page_services(data, version, search_query, network, sort_by, sort_order, cursor=None, limit=PAGE_SIZE):
+    """カーソルの次の1ページ分のサービスと次ページのカーソルを返す（カーソルが不正ならValueError）"""
+    services, keys = query_services(data, version, search_query, network, sort_by)
+    after = decode_cursor(cursor, sort_by, sort_order, like=keys[0] if keys else None) if cursor else None
+    page, next_key = paginate(services, keys, descending=(sort_order == 'desc'), after=after, limit=limit)
+    next_cursor = encode_cursor(sort_by, sort_order, next_key) if next_key is not None else None
+    return page, next_cursor, len(services)
+
+# host:port ごとにKeep-Alive接続を使い回すプローブ用セッションプール
+http_probe_pool = HTTPProbePool(
+    method=HTTP_PROBE_METHOD,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    pool_maxsize=PROBE_PER_HOST_LIMIT,
+    observer=lambda scheme, result: probe_results.inc(probe_type=scheme, result=result)
+)
+
+def check_http_service(ip_address, port, scheme='http'):
+    """指定されたIPとポートへHTTP(s)リクエストを試行（ボディは読まない）"""
+    try:
+        return http_probe_pool.probe(ip_address, port, scheme=scheme)
     except Exception:
+        probe_results.inc(probe_type=scheme, result='error')
         return False, None
 
+def check_service(ip_address, port, probe_type='http'):
+    """サービスのプローブ種別に応じて疎通チェックを行う"""
+    if probe_type == 'tcp':
+        reachable, latency = tcp_connect(ip_address, port, timeout=HTTP_CONNECT_TIMEOUT)
+        probe_results.inc(probe_type='tcp', result='ok' if reachable else 'connection_error')
+    else:
+        reachable, latency = check_http_service(ip_address, port, scheme='https' if probe_type == 'https' else 'http')
+    if reachable and latency is not None:
+        probe_latency.observe(latency / 1000, ip_type=get_ip_type(ip_address), probe_type=probe_type)
+    return reachable, latency
+
 # ★★★ 欠落していた関数を再追加 ★★★
 def get_signal_strength(latency_ms):
     """HTTP応答時間に基づいて信号強度を評価"""
@@ -199,52 +585,326 @@ def get_signal_strength(latency_ms):
     else:
         return 0
 
+# 全サービスチェックで共有するプローブエンジン
+# プローブが失敗したホストだけ死活を確認し、落ちているホストのサービスはまとめて到達不可にする
+host_breaker = HostCircuitBreaker(
+    cooldown=HOST_CIRCUIT_COOLDOWN_SECONDS,
+    max_cooldown=HOST_CIRCUIT_MAX_COOLDOWN_SECONDS,
+    on_change=lambda count: host_circuits_open.set(count)
+)
+probe_engine = ProbeEngine(
+    check_service,
+    max_workers=PROBE_MAX_WORKERS,
+    per_host_limit=PROBE_PER_HOST_LIMIT,
+    host_check=lambda host, ports: host_alive(host, ports, timeout=HTTP_CONNECT_TIMEOUT),
+    breaker=host_breaker,
+    observer=lambda reason, count: probe_short_circuits.inc(count, reason=reason)
+)
+
 # ==============================================================================
 # 状態確認ロジック
 # ==============================================================================
-def check_all_devices_status():
-    data = load_data()
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] HTTP状態確認を開始します。")
-    updated = False
-
-    for svc in data['services']:
-        original_status = svc.get('status')
-        original_latency = svc.get('http_latency')
-        
-        ip_address = svc.get('ip_address')
-        port = svc.get('port')
+def _probe_target(svc):
+    """サービスのプローブ対象 (ip, port, プローブ種別) を返す。チェック不可の場合はNone"""
+    ip_address = svc.get('ip_address')
+    port = svc.get('port')
+    if ip_address and port and is_valid_ipv4(ip_address):
+        return (ip_address, port, svc.get('probe_type', 'http'))
+    return None
 
-        svc['ip_type'] = get_ip_type(ip_address)
+def iter_probe_services(services, force=False):
+    """サービス群を並列にチェックし、完了した順に更新済みのサービスを返す（force=True なら落ちていたホストも確認する）"""
+    with track_sweep('full'):
+        yield from _iter_probe_services(services, force)
 
-        if not ip_address or not port:
+def _iter_probe_services(services, force=False):
+    targets = []
+    probed = []
+    for svc in services:
+        target = _probe_target(svc)
+        if target is None:
             svc['status'] = 'unknown'
             svc['http_latency'] = None
-        elif is_valid_ipv4(ip_address):
-            reachable, latency = check_http_service(ip_address, port)
-            svc['status'] = 'reachable' if reachable else 'unreachable'
-            svc['http_latency'] = latency
+            svc['ip_type'] = get_ip_type(svc.get('ip_address'))
+            svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            yield svc
         else:
-            svc['status'] = 'unknown'
-            svc['http_latency'] = None
-        
+            targets.append(target)
+            probed.append(svc)
+
+    for index, (reachable, latency) in probe_engine.iter_results(targets, bypass_breaker=force):
+        svc = probed[index]
+        svc['status'] = 'reachable' if reachable else 'unreachable'
+        svc['http_latency'] = latency
+        svc['ip_type'] = get_ip_type(svc.get('ip_address'))
         svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        yield svc
 
-        if original_status != svc['status'] or original_latency != svc['http_latency']:
-            updated = True
+def _status_payload(svc):
+    """チェック結果としてクライアントに返すサービスの状態"""
+    return {
+        'id': svc['id'],
+        'status': svc['status'],
+        'latency': svc['http_latency'],
+        'ip_type': svc['ip_type'],
+        'last_checked': svc['last_checked']
+    }
 
-    if updated:
-        save_data(data)
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] HTTP状態確認が完了しました。")
+@lru_cache(maxsize=4096)
+def _parse_checked_at(last_checked):
+    try:
+        return datetime.strptime(last_checked, '%Y-%m-%d %H:%M:%S').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def _checked_at(svc):
+    """最終チェック時刻（UNIX時刻。未チェックならNone）"""
+    return _parse_checked_at(svc.get('last_checked'))
+
+def is_fresh(svc, now=None):
+    """CHECK_FRESHNESS_SECONDS 以内に確認済みで、再チェックせずに結果を返せるか"""
+    checked_at = _checked_at(svc)
+    if checked_at is None or svc.get('status') in (None, 'unknown'):
+        return False
+    return (now or time.time()) - checked_at < CHECK_FRESHNESS_SECONDS
 
-def auto_checker_loop():
-    while True:
+# ==============================================================================
+# プローブエージェントへの担当の割り当て（コンシステントハッシュ）
+# ==============================================================================
+LOCAL_AGENT = 'local'   # このサーバー自身の自動チェックを表すメンバー名
+
+agent_registry = AgentRegistry(AGENTS_FILE, ttl=AGENT_TTL_SECONDS)
+_local_networks = None if LOCAL_PROBE_NETWORKS.strip().lower() == 'none' else parse_networks(
+    part.strip() for part in LOCAL_PROBE_NETWORKS.split(',')
+)
+_assignment_lock = threading.Lock()
+_assignment_memo = {'membership': None, 'owners': {}}
+
+def _shard_key(svc):
+    if AGENT_SHARD_BY == 'group':
+        return get_ip_group(svc.get('ip_address') or '')
+    return svc['uid']
+
+def _members():
+    """担当を持つメンバー（生存中のエージェントとこのサーバー）と、それぞれのチェック可能なネットワーク"""
+    members = {}
+    for name, agent in agent_registry.live().items():
         try:
-            with app.app_context():
-                check_all_devices_status()
-        except Exception as e:
-            import sys
-            print(f"自動状態確認スレッドでエラーが発生しました: {e}", file=sys.stderr)
-        time.sleep(AUTO_CHECK_INTERVAL_SECONDS)
+            members[name] = parse_networks(agent.get('networks', []))
+        except ValueError:
+            continue
+    if _local_networks is not None:
+        members[LOCAL_AGENT] = _local_networks
+    return members
+
+def service_assignments():
+    """チェック対象のサービスを {メンバー名: [サービス, ...]} に振り分ける
+
+    サービス（またはIPグループ）をキーにリング上で最初の、そのIPに届くメンバーが担当する。
+    メンバーが増減しても担当が変わるのは一部のサービスだけになる。
+    """
+    services = data_store.snapshot()['services']
+    members = _members()
+    membership = tuple(sorted((name, tuple(str(n) for n in networks)) for name, networks in members.items()))
+    with _assignment_lock:
+        if _assignment_memo['membership'] != membership or len(_assignment_memo['owners']) > 2 * len(services) + 100:
+            # メンバーが変わった時だけリングを作り直す（サービスごとの担当はメモして使い回す）
+            _assignment_memo.update(membership=membership, owners={}, ring=HashRing(members))
+        owners = _assignment_memo['owners']
+        ring = _assignment_memo['ring']
+        assignments = {name: [] for name in members}
+        for svc in services:
+            if _probe_target(svc) is None:
+                continue
+            memo_key = (svc['uid'], svc['ip_address'], _shard_key(svc))
+            owner = owners.get(memo_key, '')
+            if owner == '':
+                owner = owners[memo_key] = ring.node_for(
+                    memo_key[2], accept=lambda name: can_reach(members[name], svc['ip_address'])
+                )
+            if owner is not None:
+                assignments[owner].append(svc)
+    return assignments
+
+def local_probe_services():
+    """このサーバーの自動チェックが担当するサービス（エージェントがいなければ全て）"""
+    if _local_networks == () and not agent_registry.live():
+        return data_store.snapshot()['services']
+    return service_assignments().get(LOCAL_AGENT, [])
+
+def split_by_owner(services):
+    """サービスを (このサーバーがチェックするもの, エージェントの担当か誰も届かないもの) に分ける
+
+    エージェントの先にしかないサービスをここでチェックすると、到達不可で結果を上書きしてしまう。
+    プローブ対象のないサービスはチェックしても 'unknown' になるだけなので、このサーバーで扱う。
+    """
+    if _local_networks == () and not agent_registry.live():
+        return list(services), []
+    local = {svc['uid'] for svc in service_assignments().get(LOCAL_AGENT, [])}
+    mine, others = [], []
+    for svc in services:
+        (mine if svc['uid'] in local or _probe_target(svc) is None else others).append(svc)
+    return mine, others
+
+_scheduled = {'key': None, 'services_by_target': {}}
+
+def _scheduled_services():
+    """自動チェックの対象を {プローブ対象: [サービス, ...]} で返す
+
+    データか担当（生存中のエージェント）が変わった時だけ作り直し、変わったかどうかも返す。
+    """
+    _, version = data_store.versioned_snapshot()
+    membership = tuple(sorted(
+        (name, tuple(agent.get('networks', []))) for name, agent in agent_registry.live().items()
+    ))
+    key = (version, membership)
+    if key == _scheduled['key']:
+        return _scheduled['services_by_target'], False
+    services_by_target = {}
+    for svc in local_probe_services():
+        target = _probe_target(svc)
+        if target is not None:
+            services_by_target.setdefault(target, []).append(svc)
+    _scheduled.update(key=key, services_by_target=services_by_target)
+    return services_by_target, True
+
+def run_scheduled_checks(scheduler):
+    """チェック時刻を過ぎたサービスだけをチェックし、結果をスケジューラーに反映する"""
+    services_by_target, changed = _scheduled_services()
+    if changed:
+        scheduler.sync({
+            target: any(svc.get('favorite') for svc in services)
+            for target, services in services_by_target.items()
+        })
+    targets = scheduler.pop_due(limit=PROBE_MAX_WORKERS)
+    if not targets:
+        return
+
+    try:
+        with track_sweep('scheduled'):
+            results = probe_engine.run(targets)
+
+        checked = []
+        for target, (reachable, latency) in zip(targets, results):
+            status = 'reachable' if reachable else 'unreachable'
+            for svc in services_by_target.get(target, []):
+                svc = dict(svc)
+                svc['status'] = status
+                svc['http_latency'] = latency
+                svc['ip_type'] = get_ip_type(svc['ip_address'])
+                svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                checked.append(svc)
+        record_status(checked)
+        for target, (reachable, _) in zip(targets, results):
+            scheduler.report(target, 'reachable' if reachable else 'unreachable')
+    finally:
+        # 失敗して報告できなかったキーも、取り出したままにせず後で再チェックする
+        scheduler.defer(targets)
+
+# ==============================================================================
+# チェッカー（Webワーカーとは別に、1つだけ動くチェックの実行役）
+# ==============================================================================
+# Webワーカーは結果を読むだけで、「今すぐチェック」はキューに入れてチェッカーに任せる。
+# チェッカーが動いていない時（開発時など）だけ、これまで通りリクエストの中でチェックする。
+checker_lock = InstanceLock(CHECKER_LOCK_FILE)
+check_queue = CheckQueue(CHECK_QUEUE_DIR)
+_checker_state = {'checked_at': 0.0, 'running': False}
+
+def checker_running():
+    """チェッカーが動いているか（ロックの確認は1秒ごと）"""
+    now = time.monotonic()
+    if now - _checker_state['checked_at'] >= 1.0:
+        _checker_state.update(checked_at=now, running=checker_lock.is_held())
+    return _checker_state['running']
+
+def _log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+def _sweep_and_record(services, stop=None, force=False):
+    """サービス群をチェックし、結果を少しずつジャーナルへ書き出す（開いている画面に途中経過が届く）"""
+    batch = []
+    flushed = time.monotonic()
+    count = 0
+    for svc in iter_probe_services([dict(svc) for svc in services], force):
+        batch.append(svc)
+        count += 1
+        if len(batch) >= CHECK_RECORD_BATCH or time.monotonic() - flushed >= 1.0:
+            record_status(batch)
+            batch = []
+            flushed = time.monotonic()
+        if stop is not None and stop.is_set():
+            break
+    if batch:
+        record_status(batch)
+    return count
+
+def process_check_requests(requests, stop=None):
+    """キューから取り出した依頼を処理する
+
+    全件の依頼は1回のチェックにまとめ、依頼の時点で新しい結果があるサービスは（force でなければ）飛ばす。
+    サービス単位の依頼は、依頼の後に別のチェックで確認済みになっていれば飛ばす。
+    """
+    if not requests:
+        return
+    sweeps = [req for req in requests if req.get('kind') == 'all']
+    wanted = {}
+    for req in requests:
+        if req.get('kind') == 'service':
+            wanted[req.get('uid')] = max(wanted.get(req.get('uid'), 0), req['requested_at'])
+    force = any(req.get('force') for req in sweeps)
+    # 強制の依頼があれば、回路が開いている（落ちていた）ホストも確認し直す
+    recheck = any(req.get('force') for req in requests)
+    requested_at = max((req['requested_at'] for req in sweeps), default=None)
+
+    targets = []
+    # エージェントが担当するサービスは、依頼があってもこのサーバーではチェックしない
+    for svc in split_by_owner(data_store.snapshot()['services'])[0]:
+        requested = wanted.get(svc['uid'])
+        if requested is not None and (_checked_at(svc) or 0) <= requested:
+            targets.append(svc)
+        elif sweeps and (force or not is_fresh(svc, requested_at)):
+            targets.append(svc)
+
+    if not sweeps or not targets:
+        _sweep_and_record(targets, stop, recheck)
+        return
+    _log("HTTP状態確認を開始します。")
+    count = _sweep_and_record(targets, stop, recheck)
+    _log(f"HTTP状態確認が完了しました（{count}件）。")
+
+def run_checker(stop, standby=False):
+    """チェッカーのメインループ（stop がセットされるまで実行する）
+
+    ロックを取れたプロセスだけが動く。standby=True なら、取れるまで待機して
+    動いているチェッカーが止まった時に引き継ぐ。standby=False ならFalseを返す。
+    """
+    while not checker_lock.acquire():
+        if not standby:
+            return False
+        if stop.wait(CHECKER_STANDBY_SECONDS):
+            return True
+    _log(f"チェッカーを開始しました（PID {os.getpid()}）。")
+    scheduler = ProbeScheduler(
+        AUTO_CHECK_INTERVAL_SECONDS,
+        min_interval=SCHEDULER_MIN_INTERVAL_SECONDS,
+        max_interval=SCHEDULER_MAX_INTERVAL_SECONDS,
+        jitter=SCHEDULER_JITTER,
+        favorite_factor=SCHEDULER_FAVORITE_FACTOR
+    )
+    try:
+        while not stop.is_set():
+            try:
+                with app.app_context():
+                    process_check_requests(check_queue.drain(), stop)
+                    run_scheduled_checks(scheduler)
+            except Exception as e:
+                _log(f"チェッカーでエラーが発生しました: {e}")
+            wait = scheduler.seconds_until_next()
+            stop.wait(CHECKER_POLL_SECONDS if wait is None else min(max(wait, 0.1), CHECKER_POLL_SECONDS))
+    finally:
+        checker_lock.release()
+        _log("チェッカーを停止しました。")
+    return True
 
 
 # ==============================================================================
@@ -263,161 +923,367 @@ def utility_processor():
     # utility_processor内でget_signal_strengthが定義されていることを確認
     return dict(get_signal_strength=get_signal_strength, format_last_checked=format_last_checked, app_version=APP_VERSION)
 
+def sparklines(services):
+    """表示するサービスのスパークラインを履歴の1回の問い合わせで作り、サービスID -> pathで返す"""
+    history = latency_history.samples_many((_history_key(svc) for svc in services), SPARKLINE_SAMPLES)
+    return {svc['id']: sparkline_path(history.get(_history_key(svc), [])) for svc in services}
+
+# データのバージョンが変わるまで、同じURLへの応答は304か圧縮済みの本文を返す
+response_cache = ConditionalResponseCache(max_entries=RESPONSE_CACHE_ENTRIES, salt=APP_VERSION)
+
+def _data_version():
+    return data_store.versioned_snapshot()[1]
+
+def _index_version():
+    # 登録フォームの送信と、表示待ちのフラッシュメッセージがある場合は対象外
+    if request.method != 'GET' or session.get('_flashes'):
+        return None
+    # 一覧にはレイテンシ履歴のスパークラインを埋め込むので、履歴の世代もバージョンに含める
+    return f"{_data_version()}.{latency_history.generation()}"
+
+def _parse_service_fields(service_name, ip_address, port, probe_type):
+    """登録フォーム・一括登録の1件分を検証し、(サービスの項目, エラーメッセージ) を返す"""
+    service_name = str(service_name or '').strip()
+    ip_address = str(ip_address or '').strip()
+    port_str = str(port if port is not None else '').strip()
+    probe_type = str(probe_type or '').strip() or 'http'
+
+    # ポートの自動補完ロジック（空欄の場合は80）
+    if not port_str:
+        port = 80
+    elif not port_str.isdigit() or not (1 <= int(port_str) <= 65535):
+        return None, 'ポートが無効です。1から65535の数字を入力してください。'
+    else:
+        port = int(port_str)
+
+    # ポート補完後の必須チェック
+    if not service_name or not ip_address:
+        return None, 'サービス名、IPアドレスは必須です。ポートが空欄の場合は80が自動設定されます。'
+    if not is_valid_ipv4(ip_address):
+        return None, 'IPアドレスが無効です。有効なIPv4アドレスを入力してください。'
+    if probe_type not in PROBE_TYPES:
+        return None, 'チェック方式が無効です。'
+    return {'service_name': service_name, 'ip_address': ip_address, 'port': port, 'probe_type': probe_type}, None
+
+def _service_identity(svc):
+    """重複判定のキー"""
+    return (svc['service_name'], svc['ip_address'], svc['port'])
+
+def _new_service(fields, favorite=False):
+    return {
+        'id': 0,  # save_data() で振り直す
+        'service_name': fields['service_name'],
+        'ip_address': fields['ip_address'],
+        'port': fields['port'],
+        'status': 'unknown',
+        'http_latency': None,
+        'last_checked': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'ip_type': get_ip_type(fields['ip_address']),
+        'favorite': favorite,
+        'probe_type': fields['probe_type']
+    }
+
 @app.route('/', methods=['GET', 'POST'])
+@response_cache.conditional(_index_version)
 def index():
-    data = load_data()
-    services = data['services']
-
     if request.method == 'POST':
+        data = load_data()
+        services = data['services']
+
         # サービス登録
-        service_name = request.form['service_name'].strip()
-        ip_address = request.form['ip_address'].strip()
-        port_str = request.form.get('port', '').strip()
-        
-        # ポートの自動補完ロジック
-        port = None
-        if not port_str:
-            # ポートが空欄の場合、80を自動設定
-            port = 80 
-            port_str = str(port)
-        else:
-            if not port_str.isdigit() or not (1 <= int(port_str) <= 65535):
-                flash('ポートが無効です。1から65535の数字を入力してください。', 'error')
-                return redirect(url_for('index'))
-            port = int(port_str)
-        
-        # ポート補完後の必須チェック
-        if not service_name or not ip_address: 
-            flash('サービス名、IPアドレスは必須です。ポートが空欄の場合は80が自動設定されます。', 'error')
-            return redirect(url_for('index'))
-        
-        if not is_valid_ipv4(ip_address):
-            flash('IPアドレスが無効です。有効なIPv4アドレスを入力してください。', 'error')
+        fields, error = _parse_service_fields(
+            request.form['service_name'], request.form['ip_address'],
+            request.form.get('port', ''), request.form.get('probe_type', 'http')
+        )
+        if error:
+            flash(error, 'error')
             return redirect(url_for('index'))
 
-        if any(s['ip_address'] == ip_address and s['port'] == port and s['service_name'] == service_name for s in services):
+        if any(_service_identity(s) == _service_identity(fields) for s in services):
             flash('このサービスはすでに登録されています。', 'warning')
             return redirect(url_for('index'))
 
-        new_id = len(services) + 1 
-        
-        services.append({
-            'id': new_id,
-            'service_name': service_name,
-            'ip_address': ip_address,
-            'port': port,
-            'status': 'unknown',
-            'http_latency': None,
-            'last_checked': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'ip_type': get_ip_type(ip_address),
-            'favorite': False
-        })
+        services.append(_new_service(fields))
         save_data(data)
         flash('サービスが登録されました。', 'success')
         return redirect(url_for('index'))
 
-    # GET リクエスト時の処理
-    search_query = request.args.get('search', '').strip()
+    # GET リクエスト時の処理（共有スナップショットは変更しない）
+    with profiler.phase('load'):
+        data, version = data_store.versioned_snapshot()
+    search_query, cidr, network, sort_by, sort_order, limit = _listing_args()
     if search_query:
-        services = [
-            s for s in services
-            if (s['service_name'] and search_query.lower() in s['service_name'].lower()) or
-               (s['ip_address'] and search_query in s['ip_address']) or
-               (s['port'] is not None and search_query == str(s['port']))
-        ]
         flash(f"「{search_query}」で検索しました。", 'info')
-
-    # ソートロジック
-    sort_by = request.args.get('sort_by', 'service_name') 
-    sort_order = request.args.get('sort_order', 'asc')
-
-    def get_sort_key(svc):
-        # お気に入りは常に最優先（0=お気に入り、1=通常）
-        fav = 0 if svc.get('favorite') else 1
-
-        if sort_by == 'service_name':
-            return (
-                fav,
-                svc.get('service_name', '').lower(),
-                get_ip_rank(svc.get('ip_address', '0.0.0.0')),
-                svc.get('ip_address', '0.0.0.0')
-            )
-        elif sort_by == 'id':
-            return (fav, svc.get('id', 0))
-        elif sort_by == 'ip_address':
-            return (fav, svc.get('ip_address', '0.0.0.0'))
-        elif sort_by == 'port':
-            return (fav, svc.get('port') if svc.get('port') is not None else float('inf'))
-        elif sort_by == 'status':
-            latency = svc.get('http_latency')
-            return (
-                fav,
-                get_status_rank(svc.get('status', 'unknown')),
-                latency if latency is not None else float('inf')
-            )
-
-        return (
-            fav,
-            svc.get('service_name', '').lower(),
-            get_ip_rank(svc.get('ip_address', '0.0.0.0')),
-            svc.get('ip_address', '0.0.0.0')
-        )
-
-    services.sort(key=get_sort_key, reverse=(sort_order == 'desc'))
-    
-    for svc in services:
-        svc['ip_type'] = get_ip_type(svc['ip_address'])
+    if cidr is None:
+        flash('CIDRが無効です。例: 10.0.0.0/8', 'error')
+        cidr = ''
 
     last_updated = data.get('last_updated', 'N/A')
     port_history = data.get('port_history', [])
 
-    # グループ表示モード
+    # グループ表示モード（グループごとの集計が必要なので全件を表示する）
     view_mode = request.args.get('view', 'list')  # 'list' or 'group'
-    grouped_services = group_services_by_ip(services) if view_mode == 'group' else None
-
-    return render_template(
-        'index.html',
-        services=services,
-        grouped_services=grouped_services,
-        view_mode=view_mode,
-        sort_by=sort_by,
-        sort_order=sort_order,
-        search_query=search_query,
-        last_updated=last_updated,
-        port_history=port_history
-    )
+    next_cursor = None
+    if view_mode == 'group':
+        services, _ = query_services(data, version, search_query, network, sort_by)
+        if sort_order == 'desc':
+            services = services[::-1]
+        total = len(services)
+        with profiler.phase('group'):
+            grouped_services = group_services_by_ip(services)
+    else:
+        # 一覧は先頭の1ページだけを描画し、続きはスクロールに合わせて読み込む
+        services, next_cursor, total = page_services(data, version, search_query, network, sort_by, sort_order, limit=limit)
+        grouped_services = None
+
+    with profiler.phase('render'):
+        return render_template(
+            'index.html',
+            services=services,
+            grouped_services=grouped_services,
+            view_mode=view_mode,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            search_query=search_query,
+            cidr=cidr,
+            next_cursor=next_cursor,
+            total=total,
+            sparklines=sparklines(services),
+            change_seq=data.get('change_seq', 0),
+            changes_poll_seconds=CHANGES_POLL_SECONDS,
+            max_page_size=MAX_PAGE_SIZE,
+            probe_types=PROBE_TYPES,
+            last_updated=last_updated,
+            port_history=port_history
+        )
+
+@app.route('/service_rows')
+def service_rows():
+    """一覧の続きのページを行のHTMLで返す（スクロール時の遅延読み込み用）"""
+    search_query, cidr, network, sort_by, sort_order, limit = _listing_args()
+    try:
+        services, next_cursor, _ = page_services(
+            *data_store.versioned_snapshot(), search_query, network, sort_by, sort_order,
+            cursor=request.args.get('cursor'), limit=limit
+        )
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    html = render_template('_service_rows.html', services=services, sparklines=sparklines(services), probe_types=PROBE_TYPES)
+    return jsonify({'html': html, 'next_cursor': next_cursor})
 
 @app.route('/manual_check')
 def manual_check():
-    check_all_devices_status()
+    force = _parse_bool(request.args.get('force'))
+    if checker_running():
+        check_requests_total.inc(scope='all', result='queued')
+        check_queue.put('all', force=force)
+        flash('全サービスのHTTP疎通チェックを依頼しました。結果は順次テーブルに反映されます。', 'info')
+        return redirect(url_for('index'))
+    _check_all_now(force)
     flash('全サービスのHTTP疎通チェックを手動で実行しました。テーブルが更新されます。', 'info')
     return redirect(url_for('index'))
 
 @app.route('/json_data')
+@response_cache.conditional(_data_version)
 def json_data():
-    data = load_data()
-    services_data = []
-    for svc in data['services']:
-        s = svc.copy()
-        s['latency'] = s.pop('http_latency')
-        services_data.append(s)
+    """サービス一覧のJSON（cursor または limit を指定するとページ単位で返す）"""
+    with profiler.phase('load'):
+        data, version = data_store.versioned_snapshot()
+    paged = 'cursor' in request.args or 'limit' in request.args
+    if paged:
+        search_query, cidr, network, sort_by, sort_order, limit = _listing_args()
+        if cidr is None:
+            return jsonify({'error': 'Invalid CIDR'}), 400
+        try:
+            services, next_cursor, total = page_services(
+                data, version, search_query, network, sort_by, sort_order,
+                cursor=request.args.get('cursor'), limit=limit
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    else:
+        services = data['services']
+
+    services_data = [_service_json(svc) for svc in services]
 
     serializable_data = {
         'version': data.get('version', APP_VERSION),
         'last_updated': data.get('last_updated', 'N/A'),
         'services': services_data,
-        'port_history': data.get('port_history', [])
+        'port_history': data.get('port_history', []),
+        'seq': data.get('change_seq', 0)
     }
-    
-    return jsonify(serializable_data)
+    if paged:
+        serializable_data['total'] = total
+        serializable_data['next_cursor'] = next_cursor
+
+    with profiler.phase('serialize'):
+        return jsonify(serializable_data)
+
+
+@app.route('/changes')
+@response_cache.conditional(_data_version)
+def changes():
+    """変更番号 since 以降に追加・変更・削除されたサービスだけを返す（差分同期用）"""
+    since = request.args.get('since', type=int)
+    return jsonify(_changes_payload(data_store.changes_since(since)))
+
+
+def _sse_message(payload):
+    if payload['full']:
+        # 全件の再取得が必要な場合は本文を送らず、ページの読み直しを促す
+        payload = dict(payload, services=[], deleted=[])
+    return f"id: {payload['seq']}\nevent: changes\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# /events は接続ごとにワーカースレッドを占有するので、上限を超えた分は断って /changes のポーリングに回す
+_event_streams = threading.BoundedSemaphore(EVENTS_MAX_CONNECTIONS)
+
+@app.route('/events')
+def events():
+    """サービスの変更をServer-Sent Eventsで配信する（再接続時は Last-Event-ID から差分を送る）
+
+    同時接続数が EVENTS_MAX_CONNECTIONS を超える場合は503を返す（画面は /changes のポーリングに切り替える）。
+    """
+    if not _event_streams.acquire(blocking=False):
+        events_rejected_total.inc()
+        return Response(
+            f'retry: {CHANGES_POLL_SECONDS * 1000}\n\n',
+            status=503,
+            mimetype='text/event-stream',
+            headers={'Retry-After': str(CHANGES_POLL_SECONDS), 'Cache-Control': 'no-cache'}
+        )
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    subscriber = change_broadcaster.subscribe()
+
+    def generate():
+        try:
+            # 購読を始めてから差分を取るので、その間の変更も取りこぼさない
+            if since is not None:
+                payload = _changes_payload(data_store.changes_since(since))
+                if payload['full'] or payload['seq'] != since:
+                    yield _sse_message(payload)
+            deadline = time.monotonic() + EVENTS_MAX_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    payload = subscriber.get(timeout=min(EVENTS_KEEPALIVE_SECONDS, remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if payload is None:
+                    # 配信に追いつけなかったので切断し、クライアントの再接続で差分を取り直させる
+                    return
+                yield _sse_message(payload)
+        finally:
+            change_broadcaster.unsubscribe(subscriber)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # 送信を始める前に切断されるとジェネレータの finally は実行されないので、応答の終了時にも購読と枠を返す
+    def close():
+        change_broadcaster.unsubscribe(subscriber)
+        _event_streams.release()
+    response.call_on_close(close)
+    return response
+
+
+@app.route('/history/<int:service_id>')
+def service_history(service_id):
+    """サービスのレイテンシ履歴（直近サンプルと1分・1時間・1日単位の集計）"""
+    svc = next((s for s in data_store.snapshot()['services'] if s['id'] == service_id), None)
+    if svc is None:
+        return jsonify({'error': 'Service not found'}), 404
+    return jsonify({'id': service_id, **latency_history.summary(_history_key(svc), time.time())})
+
+@metrics.collector
+def _service_metrics():
+    """サービスごとの死活（1=到達可能, 0=到達不可。未チェックは出力しない）とステータス別の件数"""
+    services = data_store.snapshot()['services']
+    up = []
+    counts = {'reachable': 0, 'unreachable': 0, 'unknown': 0}
+    for svc in services:
+        status = svc.get('status', 'unknown')
+        counts[status] = counts.get(status, 0) + 1
+        if status in ('reachable', 'unreachable'):
+            labels = {
+                'service': svc.get('service_name'),
+                'ip_address': svc.get('ip_address'),
+                'port': svc.get('port'),
+                'probe_type': svc.get('probe_type'),
+                'ip_type': svc.get('ip_type')
+            }
+            up.append((labels, 1 if status == 'reachable' else 0))
+    yield 'ipmanager_service_up', 'gauge', 'サービスの死活（1=到達可能, 0=到達不可）', up
+    yield 'ipmanager_services', 'gauge', 'ステータス別のサービス数', [({'status': k}, v) for k, v in counts.items()]
+    if agent_registry.live():
+        yield 'ipmanager_agent_services', 'gauge', 'エージェント（local はこのサーバー）ごとの担当サービス数', [
+            ({'agent': name}, len(assigned)) for name, assigned in service_assignments().items()
+        ]
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus / OpenMetrics 形式のメトリクス（全プロセス分を合算）"""
+    openmetrics = 'application/openmetrics-text' in request.headers.get('Accept', '')
+    return Response(
+        metrics.render(openmetrics=openmetrics),
+        content_type=OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE
+    )
+
+
+@app.route('/cache_stats')
+def cache_stats():
+    """データストアのキャッシュ統計（ワーカープロセス単位）"""
+    return jsonify({'pid': os.getpid(), **data_store.stats(), 'responses': response_cache.stats()})
+
+@app.route('/debug/profiler/start', methods=['POST'])
+def profiler_start():
+    """このワーカーでサンプリングプロファイラーを開始する（IPMANAGER_PROFILING=1 の時のみ）"""
+    if not PROFILING_ENABLED:
+        abort(404)
+    started = sampling_profiler.start()
+    return jsonify({'pid': os.getpid(), 'started': started, 'running': sampling_profiler.running})
+
+@app.route('/debug/profiler/stop', methods=['POST'])
+def profiler_stop():
+    """サンプリングを止め、フレームグラフ用の collapsed 形式で返す（PROFILE_DIR にも保存）"""
+    if not PROFILING_ENABLED:
+        abort(404)
+    collapsed = sampling_profiler.stop()
+    path = os.path.join(PROFILE_DIR, f'ipmanager-{os.getpid()}-{int(time.time())}.collapsed')
+    try:
+        with open(path, 'w') as f:
+            f.write(collapsed)
+    except OSError:
+        path = None
+    headers = {'X-Profile-Path': path} if path else {}
+    return Response(collapsed, mimetype='text/plain', headers=headers)
+
+
+def _wants_json():
+    """Ajaxからの呼び出し（JSONでの応答を希望）かどうか"""
+    return request.accept_mimetypes.best == 'application/json'
 
 @app.route('/edit/<int:service_id>', methods=['POST'])
 def edit_service(service_id):
     data = load_data()
     svc = next((s for s in data['services'] if s['id'] == service_id), None)
 
+    def error(message):
+        if _wants_json():
+            return jsonify({'error': message}), 400
+        flash(message, 'error')
+        return redirect(url_for('index'))
+
     if svc is None:
+        if _wants_json():
+            return jsonify({'error': 'Service not found'}), 404
         flash('サービスが見つかりません。', 'error')
         return redirect(url_for('index'))
 
@@ -426,25 +1292,29 @@ def edit_service(service_id):
     port_str = request.form.get('port', '').strip()
 
     if not svc['service_name'] or not svc['ip_address'] or not port_str:
-        flash('サービス名、IPアドレス、ポートはすべて必須です。', 'error')
-        return redirect(url_for('index'))
+        return error('サービス名、IPアドレス、ポートはすべて必須です。')
     
     if not is_valid_ipv4(svc['ip_address']):
-        flash('IPアドレスが無効です。有効なIPv4アドレスを入力してください。', 'error')
-        return redirect(url_for('index'))
+        return error('IPアドレスが無効です。有効なIPv4アドレスを入力してください。')
 
     svc['port'] = None
     if port_str:
         if not port_str.isdigit() or not (1 <= int(port_str) <= 65535):
-            flash('ポートが無効です。1から65535の数字を入力してください。', 'error')
-            return redirect(url_for('index'))
+            return error('ポートが無効です。1から65535の数字を入力してください。')
         svc['port'] = int(port_str)
 
+    probe_type = request.form.get('probe_type', svc.get('probe_type', 'http')).strip() or 'http'
+    if probe_type not in PROBE_TYPES:
+        return error('チェック方式が無効です。')
+    svc['probe_type'] = probe_type
+
     svc['ip_type'] = get_ip_type(svc['ip_address'])
     svc['status'] = 'unknown'
     svc['http_latency'] = None 
 
     save_data(data) 
+    if _wants_json():
+        return jsonify(_service_json(svc))
     flash('サービスが更新されました。', 'success')
     return redirect(url_for('index'))
 
@@ -469,74 +1339,633 @@ def toggle_favorite(service_id):
     save_data(data)
     return jsonify({'id': service_id, 'favorite': svc['favorite']})
 
-@app.route('/check_single/<int:service_id>')
-def check_single_service(service_id):
-    """単一サービスの疎通チェック（Ajax用）"""
+# ==============================================================================
+# 一括登録・エクスポート
+# ==============================================================================
+def _import_format(upload):
+    """format パラメータ・ファイル名・Content-Type から 'csv' か 'json' を決める"""
+    fmt = request.values.get('format', '').lower()
+    if fmt in ('csv', 'json'):
+        return fmt
+    filename = (upload.filename or '') if upload is not None else ''
+    if filename.lower().endswith('.json'):
+        return 'json'
+    if filename.lower().endswith('.csv'):
+        return 'csv'
+    mimetype = upload.mimetype if upload is not None else request.mimetype
+    return 'json' if mimetype == 'application/json' else 'csv'
+
+def _import_rows(stream, fmt):
+    """アップロードされたCSV/JSONから (行番号, 1件分の辞書) を順に返す"""
+    if fmt == 'csv':
+        # CSVは1行ずつ読み、ファイル全体をメモリに載せない
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        for row in reader:
+            yield reader.line_num, row
+        return
+    payload = json.load(stream)
+    rows = payload.get('services') if isinstance(payload, dict) else payload
+    if not isinstance(rows, list):
+        raise ValueError('サービスの配列（または {"services": [...]}）が必要です。')
+    yield from enumerate(rows, 1)
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def import_services(rows, skip_invalid=False, dry_run=False):
+    """複数のサービスを検証して一度の保存で登録する
+
+    エラーのある行が1つでもあれば何も登録しない（skip_invalid の場合は有効な行だけ登録する）。
+    既存のサービスやファイル内の前の行と (サービス名, IP, ポート) が同じ行は重複としてスキップする。
+    """
     data = load_data()
-    svc = next((s for s in data['services'] if s['id'] == service_id), None)
+    seen = {_service_identity(svc) for svc in data['services']}
+    added = []
+    duplicates = []
+    errors = []
+    for count, (line, row) in enumerate(rows, 1):
+        if count > IMPORT_MAX_ROWS:
+            raise ValueError(f'一度に登録できるのは{IMPORT_MAX_ROWS}件までです。')
+        if not isinstance(row, dict):
+            errors.append({'row': line, 'error': 'サービスの項目（オブジェクト）ではありません。'})
+            continue
+        fields, error = _parse_service_fields(
+            row.get('service_name'), row.get('ip_address'), row.get('port'), row.get('probe_type')
+        )
+        if error:
+            errors.append({'row': line, 'error': error})
+            continue
+        key = _service_identity(fields)
+        if key in seen:
+            duplicates.append(line)
+            continue
+        seen.add(key)
+        added.append(_new_service(fields, favorite=_parse_bool(row.get('favorite'))))
+
+    committed = bool(added) and not dry_run and (skip_invalid or not errors)
+    if committed:
+        data['services'].extend(added)
+        save_data(data)
+    return {
+        'committed': committed,
+        'imported': len(added) if committed else 0,
+        'valid': len(added),
+        'duplicates': duplicates,
+        'errors': errors,
+        'total': len(data['services'])
+    }
 
-    if svc is None:
-        return jsonify({'error': 'Service not found'}), 404
+@app.route('/import', methods=['POST'])
+def import_services_endpoint():
+    """CSV/JSONでサービスを一括登録する（フォームのファイル 'file' またはリクエスト本文）"""
+    upload = request.files.get('file')
+    stream = upload.stream if upload is not None else request.stream
+    skip_invalid = _parse_bool(request.values.get('skip_invalid'))
+    dry_run = _parse_bool(request.values.get('dry_run'))
+    # ブラウザのフォームからの送信は結果をフラッシュして一覧へ戻す
+    from_browser = request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html'
 
-    ip_address = svc.get('ip_address')
-    port = svc.get('port')
+    try:
+        result = import_services(_import_rows(stream, _import_format(upload)), skip_invalid, dry_run)
+    except (ValueError, csv.Error) as e:
+        message = f'ファイルを読み込めません: {e}'
+        if not from_browser:
+            return jsonify({'error': message}), 400
+        flash(message, 'error')
+        return redirect(url_for('index'))
 
-    if ip_address and port and is_valid_ipv4(ip_address):
-        reachable, latency = check_http_service(ip_address, port)
-        svc['status'] = 'reachable' if reachable else 'unreachable'
-        svc['http_latency'] = latency
+    rejected = bool(result['errors']) and not result['committed'] and not dry_run
+    if not from_browser:
+        return jsonify(result), 400 if rejected else 200
+
+    if result['committed']:
+        flash(f"{result['imported']}件のサービスが登録されました（重複 {len(result['duplicates'])}件をスキップ）。", 'success')
+    elif rejected:
+        flash(f"{len(result['errors'])}件のエラーがあるため登録しませんでした。", 'error')
     else:
-        svc['status'] = 'unknown'
-        svc['http_latency'] = None
+        flash(f"登録するサービスがありません（有効 {result['valid']}件、重複 {len(result['duplicates'])}件）。", 'info')
+    for error in result['errors'][:5]:
+        flash(f"{error['row']}行目: {error['error']}", 'warning')
+    if len(result['errors']) > 5:
+        flash(f"ほか {len(result['errors']) - 5}件のエラー", 'warning')
+    return redirect(url_for('index'))
 
-    svc['ip_type'] = get_ip_type(ip_address)
-    svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    save_data(data)
+def _export_record(svc):
+    return {field: svc.get('http_latency' if field == 'latency' else field) for field in EXPORT_FIELDS}
+
+def _export_csv(services):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, svc in enumerate(services, 1):
+        record = _export_record(svc)
+        writer.writerow([record[field] for field in EXPORT_FIELDS])
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_json(data, services):
+    header = {'version': data.get('version', APP_VERSION), 'last_updated': data.get('last_updated')}
+    yield json.dumps(header, ensure_ascii=False)[:-1] + ', "services": ['
+    chunk = []
+    for count, svc in enumerate(services):
+        chunk.append(('' if count == 0 else ',') + json.dumps(_export_record(svc), ensure_ascii=False))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk) + ']}\n'
+
+@app.route('/export')
+def export_services():
+    """サービス一覧をCSV/JSONで少しずつ送り出す（search・cidr で絞り込み可能）"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'json'):
+        return jsonify({'error': 'Unsupported format'}), 400
+    data, version = data_store.versioned_snapshot()
+    search_query, cidr, network, _, _, _ = _listing_args()
+    if cidr is None:
+        return jsonify({'error': 'Invalid CIDR'}), 400
+    services = data['services']
+    if search_query or network is not None:
+        matched, _ = query_services(data, version, search_query, network)
+        services = sorted(matched, key=lambda svc: svc['id'])
+
+    filename = f"services-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    body = _export_csv(services) if fmt == 'csv' else _export_json(data, services)
+    return Response(
+        stream_with_context(body),
+        mimetype='text/csv' if fmt == 'csv' else 'application/json',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# ==============================================================================
+# サブネットの検出（未登録の開いているポートを探して一括登録する）
+# ==============================================================================
+discovery_jobs = DiscoveryJobs(PortScanner(
+    timeout=DISCOVERY_TIMEOUT, max_concurrency=DISCOVERY_CONCURRENCY,
+    per_host_limit=DISCOVERY_PER_HOST_LIMIT, rate=DISCOVERY_RATE
+), directory=DISCOVERY_DIR)
+
+_SUBNET_GROUP = re.compile(r'^(\d+\.\d+\.\d+)\.x$')
+_discovery_networks = parse_networks(part.strip() for part in DISCOVERY_NETWORKS.split(','))
+
+def _discovery_allowed(network):
+    """ネットワーク全体が検出を許可された範囲に含まれるか"""
+    return any(network.subnet_of(allowed) for allowed in _discovery_networks)
+
+def _discovery_hosts(services, cidr=None, group=None):
+    """検出対象のホストの一覧を返す（対象が不正・多すぎる・許可された範囲外の場合はValueError）"""
+    if cidr:
+        try:
+            network = ipaddress.IPv4Network(cidr, strict=False)
+        except ValueError:
+            raise ValueError('CIDRが無効です。')
+        if not _discovery_allowed(network):
+            raise ValueError('検出できるのはプライベート・Tailscaleのネットワークだけです。')
+        if network.num_addresses > DISCOVERY_MAX_HOSTS + 2:
+            raise ValueError(f'一度に検出できるのは{DISCOVERY_MAX_HOSTS}ホストまでです。')
+        return [str(host) for host in network.hosts()] or [str(network.network_address)]
+    if group:
+        match = _SUBNET_GROUP.match(group)
+        if match:
+            # "192.168.1.x" のようなサブネット単位のグループは /24 全体を対象にする
+            if not _discovery_allowed(ipaddress.IPv4Network(f'{match.group(1)}.0/24')):
+                raise ValueError('検出できるのはプライベート・Tailscaleのネットワークだけです。')
+            return [f'{match.group(1)}.{i}' for i in range(1, 255)]
+        # Tailscale などは登録済みのホストのうち、許可された範囲のものだけを対象にする
+        hosts = sorted({
+            svc['ip_address'] for svc in services
+            if is_valid_ipv4(svc.get('ip_address') or '') and get_ip_group(svc['ip_address']) == group
+            and _discovery_allowed(ipaddress.IPv4Network(svc['ip_address']))
+        }, key=ipaddress.IPv4Address)
+        if not hosts:
+            raise ValueError('グループにホストがありません。')
+        return hosts[:DISCOVERY_MAX_HOSTS]
+    raise ValueError('CIDRまたはグループを指定してください。')
+
+def _discovery_ports(value, data):
+    """ポートの指定（カンマ区切りまたは配列）を読み取る。省略時はポート履歴を使う"""
+    if not value:
+        return list(data['port_history'])
+    items = value if isinstance(value, list) else str(value).split(',')
+    ports = []
+    for item in items:
+        item = str(item).strip()
+        if not item:
+            continue
+        if not item.isdigit() or not (1 <= int(item) <= 65535):
+            raise ValueError('ポートが無効です。1から65535の数字を入力してください。')
+        ports.append(int(item))
+    return sorted(set(ports))
+
+def _discovery_payload(job):
+    """ジョブの状態に、登録済みかどうかと登録時の初期値を付けて返す"""
+    payload = job.to_dict()
+    registered = {(svc['ip_address'], svc['port']) for svc in data_store.snapshot()['services']}
+    for found in payload['found']:
+        found['registered'] = (found['ip_address'], found['port']) in registered
+        found['service_name'], found['probe_type'] = suggest_service(found['ip_address'], found['port'])
+    return payload
+
+@app.route('/discovery/groups')
+def discovery_groups():
+    """検出の対象に選べるグループと、既定のポート（ポート履歴）"""
+    return jsonify({'groups': get_ip_index().group_names(), 'ports': data_store.snapshot()['port_history']})
+
+@app.route('/discovery', methods=['POST'])
+def start_discovery():
+    """CIDRまたはグループ内の全ホスト × ポートへの接続を試す検出ジョブを開始する"""
+    params = request.get_json(silent=True) or request.form
+    data = data_store.snapshot()
+    try:
+        cidr = str(params.get('cidr') or '').strip()
+        group = str(params.get('group') or '').strip()
+        hosts = _discovery_hosts(data['services'], cidr, group)
+        ports = _discovery_ports(params.get('ports'), data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not ports:
+        return jsonify({'error': 'ポートを指定してください（ポート履歴が空です）。'}), 400
+
+    job = discovery_jobs.start(hosts, ports, label=cidr or group)
+    if job is None:
+        return jsonify({'error': '実行中の検出が多すぎます。終わるまで待ってください。'}), 429
+    return jsonify(_discovery_payload(job)), 202
+
+@app.route('/discovery/<job_id>')
+def discovery_status(job_id):
+    job = discovery_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(_discovery_payload(job))
+
+@app.route('/discovery/<job_id>/cancel', methods=['POST'])
+def cancel_discovery(job_id):
+    job = discovery_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.cancel()
+    return jsonify({'id': job_id, 'cancelled': True})
+
+@app.route('/discovery/<job_id>/register', methods=['POST'])
+def register_discovered(job_id):
+    """検出したポートを一括登録する（services の指定がなければ未登録のものをすべて）"""
+    job = discovery_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    payload = _discovery_payload(job)
+    candidates = {(f['ip_address'], f['port']): f for f in payload['found'] if not f['registered']}
+
+    requested = (request.get_json(silent=True) or {}).get('services')
+    rows = []
+    for row in (requested if isinstance(requested, list) else candidates.values()):
+        if not isinstance(row, dict):
+            continue
+        try:
+            found = candidates.get((row.get('ip_address'), int(row.get('port'))))
+        except (TypeError, ValueError):
+            found = None
+        # 検出結果に含まれない（または登録済みの）ものは登録しない
+        if found is None:
+            continue
+        rows.append({
+            'service_name': row.get('service_name') or found['service_name'],
+            'ip_address': found['ip_address'],
+            'port': found['port'],
+            'probe_type': row.get('probe_type') or found['probe_type']
+        })
+    return jsonify(import_services(enumerate(rows, 1), skip_invalid=True))
 
+# ==============================================================================
+# プローブエージェント用API（Authorization: Bearer <IPMANAGER_AGENT_TOKEN>）
+# ==============================================================================
+_AGENT_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+def agent_api(view):
+    """トークンを確認し、エージェント名を検証するデコレーター"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not AGENT_TOKEN:
+            return jsonify({'error': 'Agent API is disabled'}), 404
+        supplied = request.headers.get('Authorization', '').encode('utf-8')
+        if not hmac.compare_digest(supplied, f'Bearer {AGENT_TOKEN}'.encode('utf-8')):
+            return jsonify({'error': 'Unauthorized'}), 401
+        name = kwargs.get('name')
+        if name is not None and (not _AGENT_NAME.match(name) or name == LOCAL_AGENT):
+            return jsonify({'error': 'Invalid agent name'}), 400
+        return view(*args, **kwargs)
+    return wrapper
+
+def _assignment_json(svc):
+    return {key: svc.get(key) for key in ('uid', 'service_name', 'ip_address', 'port', 'probe_type')}
+
+@app.route('/api/agents')
+@agent_api
+def list_agents():
+    """生存中のエージェントと担当しているサービス数"""
+    assignments = service_assignments()
+    agents = agent_registry.live()
+    local = {'networks': [str(network) for network in _local_networks or ()]}
+    members = [{'name': name, **agents.get(name, local), 'services': len(services)} for name, services in assignments.items()]
+    return jsonify({'shard_by': AGENT_SHARD_BY, 'agents': members})
+
+@app.route('/api/agents/<name>/heartbeat', methods=['POST'])
+@agent_api
+def agent_heartbeat(name):
+    """エージェントの登録と生存の通知（networks: チェックできるネットワークのCIDRの一覧）"""
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    networks = payload.get('networks') or []
+    try:
+        if not isinstance(networks, list):
+            raise TypeError(networks)
+        parse_networks(networks)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid networks'}), 400
+    agent = agent_registry.heartbeat(name, networks, payload.get('info'))
     return jsonify({
-        'id': svc['id'],
-        'status': svc['status'],
-        'latency': svc['http_latency'],
-        'ip_type': svc['ip_type'],
-        'last_checked': svc['last_checked']
+        **agent,
+        'heartbeat_seconds': AGENT_HEARTBEAT_SECONDS,
+        'ttl': AGENT_TTL_SECONDS,
+        'shard_by': AGENT_SHARD_BY
     })
 
-@app.route('/check_all_async')
-def check_all_async():
-    """全サービス疎通チェック（Ajax用・結果を返す）"""
-    data = load_data()
-    results = []
+@app.route('/api/agents/<name>', methods=['DELETE'])
+@agent_api
+def agent_leave(name):
+    """エージェントの離脱（担当は残りのメンバーに振り直される）"""
+    return jsonify({'name': name, 'removed': agent_registry.remove(name)})
+
+@app.route('/api/agents/<name>/assignments')
+@agent_api
+def agent_assignments(name):
+    """エージェントが担当するサービスの一覧（ETagが変わらなければ304）"""
+    if name not in agent_registry.live():
+        return jsonify({'error': 'Agent is not registered'}), 409
+    services = [_assignment_json(svc) for svc in service_assignments().get(name, [])]
+    raw = json.dumps(services, sort_keys=True, ensure_ascii=False)
+    etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'agent': name, 'services': services})
+    response.set_etag(etag)
+    return response
+
+def _is_number(value):
+    """JSONの数値として受け付けられるか（true/false や NaN・無限大は除く）"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+@app.route('/api/agents/<name>/results', methods=['POST'])
+@agent_api
+def agent_results(name):
+    """エージェントのチェック結果をまとめて受け取り、ジャーナルに追記する
+
+    results: [{uid, status: 'reachable' | 'unreachable', latency: ms, checked_at: UNIX時刻}, ...]
+    現在そのエージェントが担当していないサービスの結果は受け付けない（担当の振り直し中など）。
+    """
+    if name not in agent_registry.live():
+        return jsonify({'error': 'Agent is not registered'}), 409
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object'}), 400
+    results = payload.get('results')
+    if not isinstance(results, list) or len(results) > AGENT_MAX_BATCH:
+        return jsonify({'error': f'results must be a list of up to {AGENT_MAX_BATCH} items'}), 400
+
+    assigned = {svc['uid']: svc for svc in service_assignments().get(name, [])}
+    now = time.time()
+    updates = []
+    rejected = 0
+    for result in results:
+        # 1件の不正な要素でバッチ全体を失敗させない（失敗するとエージェントが同じバッチを送り続ける）
+        if not isinstance(result, dict) or not isinstance(result.get('uid'), str):
+            rejected += 1
+            continue
+        svc = assigned.get(result['uid'])
+        status = result.get('status')
+        latency = result.get('latency')
+        if svc is None or status not in ('reachable', 'unreachable') or not (latency is None or _is_number(latency) and latency >= 0):
+            rejected += 1
+            continue
+        checked_at = result.get('checked_at')
+        if not _is_number(checked_at) or not (now - AGENT_TTL_SECONDS * 10 < checked_at <= now):
+            checked_at = now
+        svc = dict(svc)
+        svc['status'] = status
+        svc['http_latency'] = latency if status == 'reachable' else None
+        svc['ip_type'] = get_ip_type(svc['ip_address'])
+        svc['last_checked'] = datetime.fromtimestamp(checked_at).strftime('%Y-%m-%d %H:%M:%S')
+        update = _status_update(svc)
+        update['ts'] = checked_at
+        updates.append(update)
+
+    if updates:
+        record_updates(updates)
+        change_broadcaster.notify()
+        agent_results_total.inc(len(updates), agent=name, result='accepted')
+    if rejected:
+        agent_results_total.inc(rejected, agent=name, result='rejected')
+    return jsonify({'accepted': len(updates), 'rejected': rejected})
+
+def _wait_for_check(svc, timeout=CHECK_WAIT_SECONDS):
+    """チェッカーに依頼したサービスの結果がジャーナルに届くのを待つ（届かなければNone）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        current = next((s for s in data_store.snapshot()['services'] if s['uid'] == svc['uid']), None)
+        if current is None:
+            return None
+        if current.get('seq', 0) > svc.get('seq', 0):
+            return current
+    return None
+
+# 同じサービス（または全件）のチェックが実行中なら、新たにプローブせずその結果を共有する
+check_flight = SingleFlight()
+
+def _check_service_now(svc, force=False):
+    """1件をチェックして (応答, ステータスコード) を返す（チェッカーが動いていれば依頼して結果を待つ）"""
+    if checker_running():
+        check_requests_total.inc(scope='service', result='queued')
+        check_queue.put('service', uid=svc['uid'], force=force)
+        checked = _wait_for_check(svc)
+        if checked is None:
+            # 結果は後から変更の配信（/events）で届く
+            return {'id': svc['id'], 'queued': True}, 202
+        return _status_payload(checked), 200
+
+    check_requests_total.inc(scope='service', result='probed')
+    target = _probe_target(svc)
+    if target is not None:
+        # 落ちているホストは回路が開いている間プローブしない（force なら確認し直す）
+        reachable, latency = probe_engine.run([target], bypass_breaker=force)[0]
+        svc['status'] = 'reachable' if reachable else 'unreachable'
+        svc['http_latency'] = latency
+    else:
+        svc['status'] = 'unknown'
+        svc['http_latency'] = None
 
-    for svc in data['services']:
-        ip_address = svc.get('ip_address')
-        port = svc.get('port')
+    svc['ip_type'] = get_ip_type(svc.get('ip_address'))
+    svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    record_status([svc])
+    return _status_payload(svc), 200
 
-        if ip_address and port and is_valid_ipv4(ip_address):
-            reachable, latency = check_http_service(ip_address, port)
-            svc['status'] = 'reachable' if reachable else 'unreachable'
-            svc['http_latency'] = latency
-        else:
-            svc['status'] = 'unknown'
-            svc['http_latency'] = None
+@app.route('/check_single/<int:service_id>')
+def check_single_service(service_id):
+    """単一サービスの疎通チェック（Ajax用・force=1 で直近の結果があっても再チェックする）"""
+    force = _parse_bool(request.args.get('force'))
+    svc = next((s for s in data_store.snapshot()['services'] if s['id'] == service_id), None)
 
-        svc['ip_type'] = get_ip_type(ip_address)
-        svc['last_checked'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if svc is None:
+        return jsonify({'error': 'Service not found'}), 404
 
-        results.append({
-            'id': svc['id'],
-            'status': svc['status'],
-            'latency': svc['http_latency'],
-            'ip_type': svc['ip_type'],
-            'last_checked': svc['last_checked']
-        })
+    if not split_by_owner([svc])[0]:
+        # エージェントの担当なら、エージェントが報告した最後の結果を返す
+        check_requests_total.inc(scope='service', result='remote')
+        return jsonify(dict(_status_payload(svc), remote=True))
+
+    if not force and is_fresh(svc):
+        check_requests_total.inc(scope='service', result='cached')
+        return jsonify(dict(_status_payload(svc), cached=True))
+
+    (payload, status_code), shared = check_flight.do(('service', svc['uid']), lambda: _check_service_now(dict(svc), force))
+    if shared:
+        check_requests_total.inc(scope='service', result='coalesced')
+    return jsonify(payload), status_code
+
+def _split_fresh(services, force):
+    """直近の結果を使えるサービスと、このサーバーでチェックが必要なサービスに分ける
+
+    エージェントが担当するサービスはチェックせず、報告済みの最後の結果を使う。
+    """
+    local, remote = split_by_owner(services)
+    if force:
+        return remote, local
+    now = time.time()
+    fresh, stale = remote, []
+    for svc in local:
+        (fresh if is_fresh(svc, now) else stale).append(svc)
+    return fresh, stale
+
+def _check_all_now(force=False):
+    """このプロセスで全件をチェックし、結果を返す（同時の呼び出しは1回のチェックにまとめる）"""
+    def sweep():
+        check_requests_total.inc(scope='all', result='probed')
+        fresh, stale = _split_fresh(load_data()['services'], force)
+        checked = list(iter_probe_services(stale, force))
+        record_status(checked)
+        return sorted((_status_payload(svc) for svc in fresh + checked), key=lambda r: r['id'])
+
+    results, shared = check_flight.do('all', sweep)
+    if shared:
+        check_requests_total.inc(scope='all', result='coalesced')
+    return results
 
-    save_data(data)
+@app.route('/check_all_async')
+def check_all_async():
+    """全サービス疎通チェック（Ajax用。force=1 で直近の結果があっても再チェックする）
+
+    チェッカーが動いている場合はチェックを依頼して 202 と {'queued': True} を返し、結果は
+    画面への変更通知（/events）で届く。動いていない場合はこのリクエスト内でチェックして結果を返す。
+    """
+    force = _parse_bool(request.args.get('force'))
+    if checker_running():
+        check_requests_total.inc(scope='all', result='queued')
+        check_queue.put('all', force=force)
+        return jsonify({'queued': True, 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}), 202
+
+    results = _check_all_now(force)
     return jsonify({'results': results, 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
 
-if __name__ == '__main__':
-    with app.app_context():
-        check_all_devices_status()
+def _queued_check_results(services, force=False):
+    """チェッカーに全件チェックを依頼し、届いた結果を完了した順に返すジェネレータ"""
+    subscriber = change_broadcaster.subscribe()
+    try:
+        # 購読を始めてから依頼するので、最初の結果も取りこぼさない
+        requested_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        fresh, stale = _split_fresh(services, force)
+        if stale:
+            check_queue.put('all', force=force)
+        for svc in fresh:
+            yield _status_payload(svc)
+        waiting = {svc['uid'] for svc in stale}
+        deadline = time.monotonic() + EVENTS_MAX_SECONDS
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                payload = subscriber.get(timeout=min(EVENTS_KEEPALIVE_SECONDS, remaining))
+            except queue.Empty:
+                continue
+            if payload is None:
+                return
+            for svc in payload['services']:
+                if svc['uid'] not in waiting or (svc.get('last_checked') or '') < requested_at:
+                    continue
+                waiting.discard(svc['uid'])
+                yield {'id': svc['id'], 'status': svc['status'], 'latency': svc['latency'],
+                       'ip_type': svc['ip_type'], 'last_checked': svc['last_checked']}
+    finally:
+        change_broadcaster.unsubscribe(subscriber)
+
+def _inline_check_results(services, force=False):
+    """このプロセスで全件をチェックし、結果を完了した順に返すジェネレータ"""
+    fresh, stale = _split_fresh(services, force)
+    for svc in fresh:
+        yield _status_payload(svc)
+    batch = []
+    flushed = time.monotonic()
+    try:
+        for svc in iter_probe_services(stale, force):
+            batch.append(svc)
+            yield _status_payload(svc)
+            # 途中経過も書き出し、同時に開いている画面からのチェックが直近の結果を使えるようにする
+            if len(batch) >= CHECK_RECORD_BATCH or time.monotonic() - flushed >= 1.0:
+                record_status(batch)
+                batch = []
+                flushed = time.monotonic()
+    finally:
+        # クライアントが途中で切断しても、完了済みの結果は保存する
+        record_status(batch)
+
+@app.route('/check_all_stream')
+def check_all_stream():
+    """全サービス疎通チェック（Ajax用・完了した順に結果をNDJSONで逐次返す。force=1 で全件を再チェックする）"""
+    force = _parse_bool(request.args.get('force'))
+    if checker_running():
+        check_requests_total.inc(scope='all', result='queued')
+        services = data_store.snapshot()['services']
+        results = _queued_check_results(services, force)
+    else:
+        check_requests_total.inc(scope='all', result='probed')
+        services = load_data()['services']
+        results = _inline_check_results(services, force)
+    total = len(services)
+
+    def generate():
+        yield json.dumps({'type': 'start', 'total': total}) + '\n'
+        for result in results:
+            yield json.dumps({'type': 'result', **result}) + '\n'
+        yield json.dumps({'type': 'done', 'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-    checker_thread = threading.Thread(target=auto_checker_loop, daemon=True)
-    checker_thread.start()
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+if __name__ == '__main__':
+    # チェッカーは別プロセスで動かす（リローダーの監視用プロセスで1回だけ起動し、終了時に止める）
+    if CHECKER_MODE != 'external' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        check_queue.put('all')  # 起動時に一度全件をチェックする
+        checker_process = spawn_checker(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checker.py'))
+        atexit.register(stop_checker, checker_process)
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,61 @@
+"""2つのベンチマーク結果（bench.run の出力）を比較する
+
+    python -m bench.compare base.json head.json --threshold 0.1 --fail-on-regression
+"""
+import argparse
+import json
+import sys
+
+
+def _key(result):
+    return (result['name'], result['services'], json.dumps(result['params'], sort_keys=True, ensure_ascii=False))
+
+
+def _load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report['meta'], {_key(result): result for result in report['results']}
+
+
+def compare(base, head, threshold):
+    """(キー, 基準の中央値, 比較対象の中央値, 比率, 判定) の一覧を返す"""
+    rows = []
+    for key in sorted(set(base) | set(head)):
+        before, after = base.get(key), head.get(key)
+        if before is None or after is None:
+            rows.append((key, before and before['median'], after and after['median'], None, 'new' if before is None else 'removed'))
+            continue
+        ratio = after['median'] / before['median'] if before['median'] else None
+        verdict = ''
+        if ratio is not None and ratio > 1 + threshold:
+            verdict = 'slower'
+        elif ratio is not None and ratio < 1 - threshold:
+            verdict = 'faster'
+        rows.append((key, before['median'], after['median'], ratio, verdict))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク結果を比較する')
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.1, help='差とみなす比率（0.1 = ±10%%）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='遅くなった項目があれば終了コード1')
+    args = parser.parse_args()
+
+    base_meta, base = _load(args.base)
+    head_meta, head = _load(args.head)
+    print(f"base: {base_meta.get('commit')}  head: {head_meta.get('commit')}")
+    rows = compare(base, head, args.threshold)
+    for (name, services, params), before, after, ratio, verdict in rows:
+        ratio_text = f'{ratio:6.2f}x' if ratio is not None else '      -'
+        before_text = f'{before:10.2f}' if before is not None else '         -'
+        after_text = f'{after:10.2f}' if after is not None else '         -'
+        print(f"{name:14} {services:>7} {before_text} {after_text} {ratio_text} {verdict:8} {params}")
+
+    if args.fail_on_regression and any(row[4] == 'slower' for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""ベンチマーク用の合成インベントリ（data.json）の生成
+
+    python -m bench.inventory 10000 -o /tmp/data-10k.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+
+# (割合, サブネットを選ぶ関数) 家庭・小規模オフィスのLANとTailscaleを中心にした構成
+SUBNETS = (
+    (0.40, lambda rng: f"192.168.{rng.randrange(0, 24)}"),
+    (0.25, lambda rng: f"10.{rng.randrange(0, 16)}.{rng.randrange(0, 256)}"),
+    (0.08, lambda rng: f"172.{rng.randrange(16, 32)}.{rng.randrange(0, 8)}"),
+    (0.20, lambda rng: f"100.{rng.randrange(64, 128)}.{rng.randrange(0, 256)}"),
+    (0.07, lambda rng: f"{rng.choice((8, 34, 52, 104, 151, 203))}.{rng.randrange(0, 256)}.{rng.randrange(0, 256)}"),
+)
+
+# (ポート, サービス名, プローブ種別)
+SERVICES = (
+    (80, 'web', 'http'),
+    (443, 'web', 'https'),
+    (8080, 'app', 'http'),
+    (8443, 'admin', 'https'),
+    (3000, 'grafana', 'http'),
+    (9090, 'prometheus', 'http'),
+    (8123, 'home-assistant', 'http'),
+    (32400, 'plex', 'http'),
+    (5000, 'nas', 'http'),
+    (9000, 'portainer', 'http'),
+    (22, 'ssh', 'tcp'),
+    (5432, 'postgres', 'tcp'),
+    (3306, 'mysql', 'tcp'),
+    (6379, 'redis', 'tcp'),
+    (1883, 'mqtt', 'tcp'),
+)
+
+HOST_ROLES = ('nas', 'pi', 'router', 'server', 'desktop', 'vm', 'camera', 'printer', 'ap', 'k8s')
+
+
+def _pick_subnet(rng):
+    value = rng.random()
+    for share, subnet in SUBNETS:
+        if value < share:
+            return subnet(rng)
+        value -= share
+    return SUBNETS[-1][1](rng)
+
+
+def _status_fields(rng, now):
+    value = rng.random()
+    if value < 0.7:
+        status, latency = 'reachable', round(rng.lognormvariate(3.5, 0.8), 2)
+    elif value < 0.9:
+        status, latency = 'unreachable', None
+    else:
+        return {'status': 'unknown', 'http_latency': None, 'last_checked': None}
+    checked = now - timedelta(seconds=rng.randrange(0, 3600))
+    return {'status': status, 'http_latency': latency, 'last_checked': checked.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def generate_services(count, seed=0):
+    """count件のサービスを返す（ホストごとに1〜6個のサービス、IP:ポートは重複しない）"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    services = []
+    used_hosts = set()
+    while len(services) < count:
+        ip_address = f"{_pick_subnet(rng)}.{rng.randrange(1, 255)}"
+        if ip_address in used_hosts:
+            continue
+        used_hosts.add(ip_address)
+        host_name = f"{rng.choice(HOST_ROLES)}-{len(used_hosts)}"
+        for port, name, probe_type in rng.sample(SERVICES, rng.randint(1, 6)):
+            if len(services) >= count:
+                break
+            services.append({
+                'id': len(services) + 1,
+                'service_name': f"{host_name} {name}",
+                'ip_address': ip_address,
+                'port': port,
+                'probe_type': probe_type,
+                'favorite': rng.random() < 0.02,
+                **_status_fields(rng, now)
+            })
+    return services
+
+
+def stub_services(endpoints, seed=0):
+    """スタブサーバーの (ホスト, ポート, 振る舞い, プローブ種別) の一覧からスイープ用のサービスを作る"""
+    rng = random.Random(seed)
+    return [
+        {
+            'id': i + 1,
+            'service_name': f"stub-{behaviour}-{i + 1}",
+            'ip_address': host,
+            'port': port,
+            'probe_type': probe_type,
+            'favorite': rng.random() < 0.02,
+            'status': 'unknown',
+            'http_latency': None,
+            'last_checked': None
+        }
+        for i, (host, port, behaviour, probe_type) in enumerate(endpoints)
+    ]
+
+
+def make_data(services):
+    return {
+        'services': services,
+        'last_updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'version': 'bench',
+        'port_history': sorted({svc['port'] for svc in services})
+    }
+
+
+def write_inventory(path, services):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(make_data(services), f, ensure_ascii=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成インベントリ（data.json）を生成する')
+    parser.add_argument('count', type=int, help='サービス数')
+    parser.add_argument('-o', '--output', default='data.json')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_inventory(args.output, generate_services(args.count, args.seed))
+    print(f"{args.count} services -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
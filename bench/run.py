@@ -0,0 +1,250 @@
+"""ベンチマークの実行（結果はJSONで出力し、bench.compare でコミット間を比較する）
+
+    python -m bench.run --sizes 1000,10000,100000 -o results.json
+    python -m bench.compare base.json results.json
+
+サイズごとに合成インベントリを一時ディレクトリに作り、app を別プロセスで読み込んで計測する
+（app は読み込み時に環境変数からデータファイルを決めるため）。スイープはこのプロセスで起動した
+ループバック上のスタブサーバーに対して行う。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from bench.inventory import generate_services, stub_services, write_inventory
+from bench.stubs import StubFarm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = 'ok=0.85,flaky=0.1,blackhole=0.02,refused=0.03'
+
+
+def measure(func, repeat, max_seconds=None):
+    """func を repeat 回実行して所要時間（ms）の統計を返す（max_seconds を超えたら打ち切る）"""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+        if max_seconds is not None and time.perf_counter() - started > max_seconds:
+            break
+    return _stats(samples)
+
+
+def _stats(samples):
+    return {
+        'unit': 'ms',
+        'median': round(statistics.median(samples), 3),
+        'min': round(min(samples), 3),
+        'max': round(max(samples), 3),
+        'samples': [round(s, 3) for s in samples]
+    }
+
+
+def _result(name, services, params, stats, **extra):
+    return {'name': name, 'services': services, 'params': params, **stats, **extra}
+
+
+# ==============================================================================
+# 子プロセス側（app を読み込んで計測する）
+# ==============================================================================
+def _app_benchmarks(ipm, services, repeat, max_seconds):
+    results = []
+
+    def call(view, url):
+        # レスポンスキャッシュ（ETag）を通さずにビュー本体を実行する
+        with ipm.app.test_request_context(url):
+            return ipm.app.make_response(view.__wrapped__())
+
+    # 最初の1回はファイルの読み込みとマイグレーションを含む
+    results.append(_result('initial_load', services, {}, measure(ipm.data_store.versioned_snapshot, 1)))
+    results.append(_result('snapshot', services, {}, measure(ipm.data_store.versioned_snapshot, repeat)))
+
+    cases = [
+        (view, sort_by, sort_order, '')
+        for view in ('list', 'group')
+        for sort_by in ipm.SORT_FIELDS
+        for sort_order in ('asc', 'desc')
+    ]
+    cases += [('list', 'service_name', 'asc', 'search=web'), ('list', 'service_name', 'asc', 'cidr=192.168.0.0/16')]
+    for view, sort_by, sort_order, query in cases:
+        url = f'/?view={view}&sort_by={sort_by}&sort_order={sort_order}' + (f'&{query}' if query else '')
+        params = {'view': view, 'sort_by': sort_by, 'sort_order': sort_order, 'filter': query}
+
+        def cold():
+            ipm._ordering_cache.clear()
+            call(ipm.index, url)
+        results.append(_result('index_render', services, dict(params, cache='cold'), measure(cold, repeat, max_seconds)))
+        results.append(_result(
+            'index_render', services, dict(params, cache='warm'),
+            measure(lambda: call(ipm.index, url), repeat, max_seconds)
+        ))
+
+    client = ipm.app.test_client()
+    client.get('/')
+    stats = measure(lambda: client.get('/', headers={'Accept-Encoding': 'gzip'}), repeat)
+    results.append(_result('index_http', services, {'cache': 'response'}, stats))
+
+    for url in ('/json_data', '/json_data?limit=100'):
+        size = len(call(ipm.json_data, url).get_data())
+        stats = measure(lambda: call(ipm.json_data, url), repeat, max_seconds)
+        results.append(_result('json_data', services, {'url': url}, stats, bytes=size))
+
+    stats = measure(ipm.load_data, repeat, max_seconds)
+    results.append(_result('load_data', services, {}, stats))
+
+    data = ipm.load_data()
+    stats = measure(lambda: ipm.save_data(data), repeat, max_seconds)
+    results.append(_result('save_data', services, {'backend': ipm.STORAGE_BACKEND}, stats))
+    return results
+
+
+def _sweep_benchmarks(ipm, services, repeat):
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ipm.record_status(list(ipm.iter_probe_services(ipm.load_data()['services'])))
+        elapsed = (time.perf_counter() - start) * 1000
+        counts = {}
+        for svc in ipm.data_store.snapshot()['services']:
+            counts[svc['status']] = counts.get(svc['status'], 0) + 1
+        results.append((elapsed, counts))
+    stats = _stats([elapsed for elapsed, _ in results])
+    params = {'max_workers': ipm.PROBE_MAX_WORKERS, 'per_host_limit': ipm.PROBE_PER_HOST_LIMIT}
+    return [_result('sweep', services, params, stats, statuses=results[-1][1])]
+
+
+def run_child(args):
+    import app as ipm
+    if args.child == 'sweep':
+        results = _sweep_benchmarks(ipm, args.services, args.repeat)
+    else:
+        results = _app_benchmarks(ipm, args.services, args.repeat, args.max_seconds)
+    with open(args.result_file, 'w') as f:
+        json.dump(results, f)
+
+
+# ==============================================================================
+# 親プロセス側
+# ==============================================================================
+def _spawn(kind, workdir, services, args, extra_env=None):
+    result_file = os.path.join(workdir, f'{kind}-{services}.result.json')
+    env = dict(
+        os.environ,
+        IPMANAGER_DATA_FILE=os.path.join(workdir, 'data.json'),
+        IPMANAGER_SQLITE_FILE=os.path.join(workdir, 'data.db'),
+        IPMANAGER_STORAGE_BACKEND=args.backend,
+        IPMANAGER_METRICS_DIR=os.path.join(workdir, 'metrics'),
+        **(extra_env or {})
+    )
+    command = [
+        sys.executable, '-m', 'bench.run', '--child', kind, '--services', str(services),
+        '--repeat', str(args.sweep_repeat if kind == 'sweep' else args.repeat),
+        '--max-seconds', str(args.max_seconds), '--result-file', result_file
+    ]
+    subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+    with open(result_file) as f:
+        return json.load(f)
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, share = part.partition('=')
+        mix[name.strip()] = float(share)
+    return mix
+
+
+def _git(*command):
+    try:
+        return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _meta(args):
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': args.backend,
+        'repeat': args.repeat,
+        'seed': args.seed
+    }
+
+
+def run(args):
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix='ipmanager-bench-') as workdir:
+            start = time.perf_counter()
+            write_inventory(os.path.join(workdir, 'data.json'), generate_services(size, args.seed))
+            print(f"[bench] {size} services: inventory {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            results += _spawn('app', workdir, size, args)
+            print(f"[bench] {size} services: done {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    if args.sweep_services:
+        with tempfile.TemporaryDirectory(prefix='ipmanager-bench-') as workdir:
+            farm = StubFarm(args.stub_hosts, args.stub_latency_ms, args.stub_jitter_ms, args.stub_error_rate, args.seed)
+            with farm:
+                endpoints = farm.endpoints(args.sweep_services, _parse_mix(args.mix))
+                write_inventory(os.path.join(workdir, 'data.json'), stub_services(endpoints, args.seed))
+                start = time.perf_counter()
+                sweep = _spawn('sweep', workdir, args.sweep_services, args)
+            for result in sweep:
+                result['params'].update(
+                    mix=args.mix, stub_hosts=len(farm.hosts), stub_latency_ms=args.stub_latency_ms,
+                    stub_error_rate=args.stub_error_rate
+                )
+            results += sweep
+            print(f"[bench] sweep of {args.sweep_services} services: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    report = {'meta': _meta(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP Manager のベンチマーク')
+    parser.add_argument('--sizes', type=lambda s: [int(v) for v in s.split(',')], default=[1000, 10000, 100000],
+                        help='インベントリのサービス数（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=5, help='各計測の繰り返し回数')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='1項目あたりの計測時間の上限（秒）')
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sweep-services', type=int, default=500, help='スイープ対象のサービス数（0でスイープを省略）')
+    parser.add_argument('--sweep-repeat', type=int, default=2)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='スタブの振る舞いの割合（例: ok=0.9,blackhole=0.1）')
+    parser.add_argument('--stub-hosts', type=int, default=8)
+    parser.add_argument('--stub-latency-ms', type=float, default=10)
+    parser.add_argument('--stub-jitter-ms', type=float, default=5)
+    parser.add_argument('--stub-error-rate', type=float, default=0.3, help='flaky スタブのエラー率')
+    parser.add_argument('-o', '--output', help='結果の出力先（省略時は標準出力）')
+    # 内部用: 子プロセスとして計測する
+    parser.add_argument('--child', choices=('app', 'sweep'), help=argparse.SUPPRESS)
+    parser.add_argument('--services', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
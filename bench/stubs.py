@@ -0,0 +1,183 @@
+"""ループバック上のスタブHTTP/TCPサーバー（スイープのベンチマーク用）
+
+振る舞い:
+    ok        latency_ms（±jitter_ms）待ってから 200 を返す
+    flaky     ok と同じだが、error_rate の割合で 500 応答または接続リセットになる
+    blackhole 接続は受け付けるが何も返さない（プローブは読み込みタイムアウトまで待つ）
+    refused   何も待ち受けていないポート（即座に接続拒否）
+
+HTTPのKeep-Aliveに対応し、TCPプローブ（接続して閉じるだけ）にもそのまま使える。
+
+    python -m bench.stubs --hosts 4 --latency-ms 20
+"""
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+
+BEHAVIOURS = ('ok', 'flaky', 'blackhole', 'refused')
+
+
+class StubServer:
+    """1つのポートで待ち受け、接続ごとにスレッドで応答するスタブ"""
+
+    def __init__(self, host='127.0.0.1', port=0, behaviour='ok', latency_ms=10, jitter_ms=0, error_rate=0.0, seed=None):
+        if behaviour not in BEHAVIOURS:
+            raise ValueError(f'unknown behaviour: {behaviour}')
+        self.host = host
+        self.behaviour = behaviour
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate if behaviour == 'flaky' else 0.0
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self.port = self._sock.getsockname()[1]
+        self._thread = None
+
+    def start(self):
+        if self.behaviour == 'refused':
+            # ポート番号だけ確保して閉じる（以後の接続は拒否される）
+            self._sock.close()
+            return self
+        self._sock.listen(128)
+        self._thread = threading.Thread(target=self._accept_loop, name=f'stub-{self.behaviour}-{self.port}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random(), self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+
+    def _handle(self, conn):
+        with conn:
+            if self.behaviour == 'blackhole':
+                self._closed.wait()
+                return
+            buffer = b''
+            while not self._closed.is_set():
+                try:
+                    chunk = conn.recv(4096)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                buffer += chunk
+                # 1つの接続で続けて送られてくるリクエストを順に処理する
+                while b'\r\n\r\n' in buffer:
+                    _, buffer = buffer.split(b'\r\n\r\n', 1)
+                    if not self._respond(conn):
+                        return
+
+    def _respond(self, conn):
+        draw, jitter = self._random()
+        time.sleep(max(self.latency_ms + jitter, 0) / 1000)
+        if draw < self.error_rate / 2:
+            # RSTで切断する（SO_LINGER 0 で close）
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            return False
+        status = '500 Internal Server Error' if draw < self.error_rate else '200 OK'
+        try:
+            conn.sendall(f'HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: keep-alive\r\n\r\n'.encode('ascii'))
+        except OSError:
+            return False
+        return True
+
+
+def loopback_hosts(count):
+    """ループバックのアドレスを count 個返す（Linuxでは 127.0.1.x が使える。使えない環境では 127.0.0.1 のみ）"""
+    hosts = []
+    for i in range(1, count + 1):
+        host = f'127.0.1.{i}'
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind((host, 0))
+        except OSError:
+            return ['127.0.0.1']
+        hosts.append(host)
+    return hosts
+
+
+class StubFarm:
+    """ホストごとに各振る舞いのスタブを1つずつ起動し、スイープ用の接続先を配る"""
+
+    def __init__(self, hosts=4, latency_ms=10, jitter_ms=5, error_rate=0.3, seed=0):
+        self.hosts = loopback_hosts(hosts)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.seed = seed
+        self.servers = {}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        for i, host in enumerate(self.hosts):
+            for behaviour in BEHAVIOURS:
+                server = StubServer(
+                    host, behaviour=behaviour, latency_ms=self.latency_ms, jitter_ms=self.jitter_ms,
+                    error_rate=self.error_rate, seed=self.seed + i
+                )
+                self.servers[(host, behaviour)] = server.start()
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def endpoints(self, count, mix, tcp_share=0.2):
+        """振る舞いの割合 mix（{'ok': 0.8, ...}）に従って (ホスト, ポート, 振る舞い, プローブ種別) を count 件返す"""
+        rng = random.Random(self.seed)
+        behaviours = list(mix)
+        weights = [mix[b] for b in behaviours]
+        endpoints = []
+        for i in range(count):
+            behaviour = rng.choices(behaviours, weights)[0]
+            host = self.hosts[i % len(self.hosts)]
+            probe_type = 'tcp' if rng.random() < tcp_share else 'http'
+            endpoints.append((host, self.servers[(host, behaviour)].port, behaviour, probe_type))
+        return endpoints
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ループバック上でスタブサーバーを起動する')
+    parser.add_argument('--hosts', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--jitter-ms', type=float, default=5)
+    parser.add_argument('--error-rate', type=float, default=0.3)
+    args = parser.parse_args()
+    with StubFarm(args.hosts, args.latency_ms, args.jitter_ms, args.error_rate) as farm:
+        for (host, behaviour), server in sorted(farm.servers.items()):
+            print(f"{behaviour:10} {host}:{server.port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
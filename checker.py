@@ -0,0 +1,37 @@
+"""チェッカー
+
+自動チェックと、Web画面からの「今すぐチェック」の依頼を処理するプロセス。
+Webサーバーとは別のプロセスなので、チェックの負荷がリクエストの処理に影響しない。
+標準ではGunicorn（gunicorn_config.py）や `python app.py` が子プロセスとして起動する。
+別のサービスとして管理する場合は IPMANAGER_CHECKER=external を指定して自分で起動する。
+同時に動くのは1つだけで、2つ目は起動しない（--wait なら動いている方が止まるまで待機する）。
+
+    IPMANAGER_CHECKER=external gunicorn -c gunicorn_config.py app:app
+    python checker.py
+"""
+import argparse
+import signal
+import sys
+import threading
+
+from app import CHECKER_LOCK_FILE, run_checker
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP Manager のチェッカー')
+    parser.add_argument('--wait', action='store_true',
+                        help='他のチェッカーが動いている場合は終了せず、止まった時に引き継ぐ')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    # SIGTERMでは実行中のチェックの結果を書き出してから終了する
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    if not run_checker(stop, standby=args.wait):
+        print(f"他のチェッカーが動いています（{CHECKER_LOCK_FILE}）", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
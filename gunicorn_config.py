@@ -1,39 +1,39 @@
-import threading
-import time
+import os
 import sys
+import time
 
-from app import app, check_all_devices_status, AUTO_CHECK_INTERVAL_SECONDS
+from utils.checkqueue import spawn_checker, stop_checker
 
-# 自動確認スレッドの制御変数
-_auto_checker_thread = None
-_thread_started = False
-_thread_lock = threading.Lock()
+# チェッカー（checker.py）の子プロセス
+# マスターはワーカーをforkするので、appを読み込んだりチェックのスレッドを動かしたりしない
+_checker_process = None
 
 
-def auto_checker_loop():
-    """自動確認スレッドのメインループ。アプリケーションコンテキスト内で実行。"""
-    while True:
-        try:
-            with app.app_context():
-                check_all_devices_status()
-        except Exception as e:
-            print(f"自動状態確認スレッドでエラーが発生しました: {e}", file=sys.stderr)
-        time.sleep(AUTO_CHECK_INTERVAL_SECONDS)
+def _log(message):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", file=sys.stderr)
 
 
 def on_starting(server):
     """Gunicornサーバーが起動する際に一度だけ実行されるフック。"""
-    global _auto_checker_thread, _thread_started
-    with _thread_lock:
-        if not _thread_started:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Gunicorn on_starting: 自動状態確認スレッドを開始します。", file=sys.stderr)
-            _auto_checker_thread = threading.Thread(target=auto_checker_loop)
-            _auto_checker_thread.daemon = True
-            _auto_checker_thread.start()
-            _thread_started = True
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] 自動状態確認スレッドが起動しました。", file=sys.stderr)
-        else:
-            print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Gunicorn on_starting: 自動状態確認スレッドはすでに起動しています。", file=sys.stderr)
+    global _checker_process
+    if os.environ.get('IPMANAGER_CHECKER', 'process') == 'external':
+        # checker.py を別のサービスとして動かす構成（Webサーバーはチェックを行わない）
+        _log("Gunicorn on_starting: チェッカーは外部プロセス（checker.py）で動かします。")
+        return
+    if _checker_process is None:
+        _checker_process = spawn_checker(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checker.py'))
+        _log(f"Gunicorn on_starting: チェッカーのプロセスを起動しました（PID {_checker_process.pid}）。")
+
+
+def on_exit(server):
+    """Gunicornの終了時にチェッカーも停止する"""
+    stop_checker(_checker_process)
 
 
 timeout = 120
+# 逐次レスポンス（/check_all_stream, /events）が他のリクエストを塞がないようスレッドワーカーを使う
+# /events は開いている画面ごとに1スレッドを使う（最長 EVENTS_MAX_SECONDS で再接続）。
+# 同時に開く画面が多い場合はワーカー数かスレッド数を増やす（/events の上限はスレッド数の半分）
+worker_class = 'gthread'
+workers = int(os.environ.get('IPMANAGER_WORKERS', '1'))
+threads = int(os.environ.get('IPMANAGER_THREADS', '32'))
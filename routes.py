@@ -2,10 +2,19 @@ import ipaddress
 from datetime import datetime
 from flask import render_template, request, redirect, url_for, flash
 
-from models import load_data, save_data
+from models import data_store, load_data, save_data
+from utils.search_index import SearchIndex
 from utils.network import is_valid_ipv4, get_signal_strength
 
 
+# 検索ボックス用の索引（名前・サービス名は部分一致、IPアドレス・ポートも部分一致）
+search_index = SearchIndex(
+    text_func=lambda d: ([d['name']] if d['name'] else []) + [s.get('name', '') for s in d.get('services', [])],
+    address_func=lambda d: [ip for ip in (d['local_ip'], d['tailscale_ip']) if ip] +
+                           [str(s['port']) for s in d.get('services', []) if s.get('port') is not None]
+)
+
+
 def register_routes(app):
     """Flaskアプリケーションにルートを登録する"""
 
@@ -24,20 +33,16 @@ def register_routes(app):
 
     @app.route('/')
     def index():
-        data = load_data()
+        # 共有スナップショットは変更しない
+        data = data_store.snapshot()
         devices = data['devices']
 
         # 検索機能
         search_query = request.args.get('search', '').strip()
         if search_query:
-            devices = [
-                d for d in devices
-                if (d['name'] and search_query.lower() in d['name'].lower()) or
-                   (d['local_ip'] and search_query in d['local_ip']) or
-                   (d['tailscale_ip'] and search_query in d['tailscale_ip']) or
-                   any(search_query in (str(s.get('port', '')) if s.get('port') is not None else '') or
-                       search_query.lower() in s.get('name', '').lower() for s in d.get('services', []))
-            ]
+            search_index.sync(data, devices)
+            matched = set(search_index.search(search_query))
+            devices = [d for d in devices if d['id'] in matched]
             flash(f"「{search_query}」で検索しました。", 'info')
 
         # 並び替え機能
@@ -62,7 +67,7 @@ def register_routes(app):
                 return device.get('last_checked') if device.get('last_checked') else '0000-00-00 00:00:00'
             return device.get('name', '').lower()
 
-        devices.sort(key=get_sort_key, reverse=(sort_order == 'desc'))
+        devices = sorted(devices, key=get_sort_key, reverse=(sort_order == 'desc'))
 
         return render_template('index.html', devices=devices, sort_by=sort_by, sort_order=sort_order, search_query=search_query)
 
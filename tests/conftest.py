@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# app はインポート時に環境変数から設定とファイルの場所を決める。どのテストが先に app を読み込んでも
+# 実際の data.json や利用者の設定を使わないよう、テストの収集前に既定の設定と一時ディレクトリにする
+for name in [name for name in os.environ if name.startswith('IPMANAGER_')]:
+    del os.environ[name]
+os.environ['IPMANAGER_DATA_FILE'] = os.path.join(tempfile.mkdtemp(prefix='ipmanager-test-'), 'data.json')
@@ -0,0 +1,180 @@
+import socket
+
+import pytest
+
+import app as ipmanager
+from utils.agents import parse_networks
+
+TOKEN = 'test-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, closed_port):
+    monkeypatch.setattr(ipmanager, 'AGENT_TOKEN', TOKEN)
+    # このサーバーはループバックだけを、エージェントは 192.0.2.0/24 をチェックする
+    monkeypatch.setattr(ipmanager, '_local_networks', parse_networks(['127.0.0.0/8']))
+    monkeypatch.setattr(ipmanager.agent_registry, 'path', str(tmp_path / 'agents'))
+    monkeypatch.setattr(ipmanager.checker_lock, 'path', str(tmp_path / 'checker.lock'))
+    monkeypatch.setattr(ipmanager, '_checker_state', {'checked_at': 0.0, 'running': False})
+    monkeypatch.setattr(ipmanager, 'CHECK_FRESHNESS_SECONDS', 0)
+
+    data = ipmanager.load_data()
+    data['services'] = [
+        ipmanager._new_service({'service_name': 'lan', 'ip_address': '192.0.2.10', 'port': 80, 'probe_type': 'tcp'}),
+        ipmanager._new_service({'service_name': 'local', 'ip_address': '127.0.0.1', 'port': closed_port, 'probe_type': 'tcp'}),
+    ]
+    ipmanager.save_data(data)
+    return ipmanager.app.test_client()
+
+
+def _uids():
+    return {svc['service_name']: svc['uid'] for svc in ipmanager.data_store.snapshot()['services']}
+
+
+def _service(name):
+    return next(svc for svc in ipmanager.data_store.snapshot()['services'] if svc['service_name'] == name)
+
+
+def _join(client, name='lan-1', networks=('192.0.2.0/24',)):
+    return client.post(f'/api/agents/{name}/heartbeat', json={'networks': list(networks)}, headers=AUTH)
+
+
+def test_token_is_required(client):
+    assert client.get('/api/agents').status_code == 401
+    assert client.get('/api/agents', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/api/agents', headers=AUTH).status_code == 200
+
+
+def test_api_is_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(ipmanager, 'AGENT_TOKEN', None)
+    assert client.get('/api/agents', headers=AUTH).status_code == 404
+
+
+def test_heartbeat_registers_agent_and_assigns_reachable_services(client):
+    response = _join(client)
+    assert response.status_code == 200
+    assert response.json['ttl'] == ipmanager.AGENT_TTL_SECONDS
+
+    members = {member['name']: member['services'] for member in client.get('/api/agents', headers=AUTH).json['agents']}
+    assert members == {'lan-1': 1, ipmanager.LOCAL_AGENT: 1}
+    assigned = client.get('/api/agents/lan-1/assignments', headers=AUTH)
+    assert [svc['service_name'] for svc in assigned.json['services']] == ['lan']
+    # 担当が変わらなければ304
+    again = client.get('/api/agents/lan-1/assignments', headers={**AUTH, 'If-None-Match': assigned.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_heartbeat_rejects_bad_names_and_networks(client):
+    assert _join(client, networks=['not-a-cidr']).status_code == 400
+    assert _join(client, name=ipmanager.LOCAL_AGENT).status_code == 400
+    assert _join(client, name='bad name!').status_code in (400, 404)
+    assert client.post('/api/agents/lan-1/heartbeat', json=['10.0.0.0/8'], headers=AUTH).status_code == 400
+
+
+def test_unregistered_agent_gets_409(client):
+    assert client.get('/api/agents/ghost/assignments', headers=AUTH).status_code == 409
+    response = client.post('/api/agents/ghost/results', json={'results': []}, headers=AUTH)
+    assert response.status_code == 409
+
+
+def test_leave_removes_agent(client):
+    _join(client)
+    assert client.delete('/api/agents/lan-1', headers=AUTH).json['removed']
+    assert client.get('/api/agents/lan-1/assignments', headers=AUTH).status_code == 409
+
+
+def test_results_are_accepted_only_for_assigned_services(client):
+    _join(client)
+    uids = _uids()
+    response = client.post('/api/agents/lan-1/results', json={'results': [
+        {'uid': uids['lan'], 'status': 'reachable', 'latency': 12.5},
+        {'uid': uids['local'], 'status': 'reachable', 'latency': 1.0},
+        {'uid': 'missing', 'status': 'reachable', 'latency': 1.0},
+    ]}, headers=AUTH)
+
+    assert response.json == {'accepted': 1, 'rejected': 2}
+    assert _service('lan')['status'] == 'reachable'
+    assert _service('lan')['http_latency'] == 12.5
+    assert _service('local')['status'] == 'unknown'
+
+
+@pytest.mark.parametrize('body', [
+    ['x'],
+    'text',
+    {'results': 'x'},
+    {'results': {'uid': 'x'}},
+])
+def test_malformed_results_body_is_rejected(client, body):
+    _join(client)
+    response = client.post('/api/agents/lan-1/results', json=body, headers=AUTH)
+    assert response.status_code == 400
+
+
+def test_malformed_result_items_are_rejected_individually(client):
+    _join(client)
+    uid = _uids()['lan']
+    response = client.post('/api/agents/lan-1/results', json={'results': [
+        'x',
+        None,
+        ['uid'],
+        {'uid': ['not', 'hashable'], 'status': 'reachable'},
+        {'uid': 1, 'status': 'reachable'},
+        {'uid': uid, 'status': 'up'},
+        {'uid': uid, 'status': 'reachable', 'latency': True},
+        {'uid': uid, 'status': 'reachable', 'latency': 'fast'},
+        {'uid': uid, 'status': 'reachable', 'latency': -1},
+        {'uid': uid, 'status': 'reachable', 'latency': 5.0, 'checked_at': 'yesterday'},
+    ]}, headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.json == {'accepted': 1, 'rejected': 9}
+    assert _service('lan')['http_latency'] == 5.0
+
+
+def test_nan_latency_is_rejected(client):
+    _join(client)
+    uid = _uids()['lan']
+    response = client.post(
+        '/api/agents/lan-1/results',
+        data=f'{{"results": [{{"uid": "{uid}", "status": "reachable", "latency": NaN}}]}}',
+        content_type='application/json', headers=AUTH
+    )
+    assert response.json == {'accepted': 0, 'rejected': 1}
+
+
+def test_on_demand_checks_keep_agent_results(client):
+    _join(client)
+    uid = _uids()['lan']
+    client.post('/api/agents/lan-1/results', json={'results': [
+        {'uid': uid, 'status': 'reachable', 'latency': 12.5}
+    ]}, headers=AUTH)
+    lan = _service('lan')
+
+    single = client.get(f"/check_single/{lan['id']}?force=1")
+    assert single.json['remote'] is True
+    assert single.json['status'] == 'reachable'
+
+    results = {r['id']: r for r in client.get('/check_all_async?force=1').json['results']}
+    assert results[lan['id']]['status'] == 'reachable'
+    # このサーバーが担当するサービスはその場でチェックする
+    assert results[_service('local')['id']]['status'] == 'unreachable'
+    assert _service('lan')['status'] == 'reachable'
+    assert _service('lan')['last_checked'] == lan['last_checked']
+
+
+def test_queued_checks_skip_agent_services(client):
+    _join(client)
+    ipmanager.process_check_requests([{'kind': 'all', 'force': True, 'requested_at': 0}])
+
+    assert _service('lan')['status'] == 'unknown'
+    assert _service('local')['status'] == 'unreachable'
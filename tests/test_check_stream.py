@@ -0,0 +1,62 @@
+import json
+import socket
+
+import pytest
+
+import app as ipmanager
+
+
+@pytest.fixture
+def closed_ports():
+    ports = []
+    for _ in range(3):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    return ports
+
+
+@pytest.fixture
+def client(monkeypatch, closed_ports):
+    # チェッカーが動いていない時の、リクエストの中でチェックする経路を使う
+    monkeypatch.setattr(ipmanager, 'checker_running', lambda: False)
+    data = ipmanager.load_data()
+    data['services'] = [
+        ipmanager._new_service({'service_name': f'svc{port}', 'ip_address': '127.0.0.1', 'port': port, 'probe_type': 'tcp'})
+        for port in closed_ports
+    ]
+    ipmanager.save_data(data)
+    return ipmanager.app.test_client()
+
+
+def _statuses():
+    return {svc['id']: svc['status'] for svc in ipmanager.data_store.snapshot()['services']}
+
+
+def test_stream_sends_start_results_and_done(client):
+    response = client.get('/check_all_stream?force=1')
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    messages = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert messages[0] == {'type': 'start', 'total': 3}
+    assert messages[-1]['type'] == 'done' and 'timestamp' in messages[-1]
+    results = messages[1:-1]
+    assert [message['type'] for message in results] == ['result'] * 3
+    assert sorted(message['id'] for message in results) == [1, 2, 3]
+    assert all(set(message) == {'type', 'id', 'status', 'latency', 'ip_type', 'last_checked'} for message in results)
+    assert all(message['status'] == 'unreachable' for message in results)
+    assert _statuses() == {1: 'unreachable', 2: 'unreachable', 3: 'unreachable'}
+
+
+def test_results_are_saved_when_client_disconnects(client):
+    response = client.get('/check_all_stream?force=1', buffered=False)
+    stream = iter(response.response)
+    assert json.loads(next(stream))['type'] == 'start'
+    first = json.loads(next(stream))
+
+    # 途中で切断しても、送り出した結果は保存される
+    response.close()
+
+    assert _statuses()[first['id']] == first['status'] == 'unreachable'
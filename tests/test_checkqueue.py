@@ -0,0 +1,74 @@
+import fcntl
+import os
+import threading
+
+import pytest
+
+from utils.checkqueue import CheckQueue, InstanceLock
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / 'checker.lock')
+
+
+def test_put_and_drain_round_trip_in_order(tmp_path):
+    queue = CheckQueue(str(tmp_path / 'queue'))
+    assert queue.drain() == []
+
+    queue.put('all', force=True)
+    queue.put('service', uid='abc')
+    assert len(queue) == 2
+
+    requests = queue.drain()
+    assert [req['kind'] for req in requests] == ['all', 'service']
+    assert requests[0]['force'] is True
+    assert requests[1]['uid'] == 'abc'
+    assert requests[0]['requested_at'] <= requests[1]['requested_at']
+    # 取り出した依頼は消える
+    assert len(queue) == 0
+    assert queue.drain() == []
+
+
+def test_drain_discards_unreadable_requests(tmp_path):
+    directory = tmp_path / 'queue'
+    queue = CheckQueue(str(directory))
+    queue.put('all')
+    (directory / '00000000000000000000-broken.json').write_text('{')
+
+    assert [req['kind'] for req in queue.drain()] == ['all']
+    assert os.listdir(directory) == []
+
+
+def test_lock_is_exclusive_and_visible_to_other_instances(lock_path):
+    checker, web = InstanceLock(lock_path), InstanceLock(lock_path)
+    assert not web.is_held()
+
+    assert checker.acquire()
+    assert checker.acquire()
+    assert not InstanceLock(lock_path, retry_seconds=0.1).acquire()
+    assert web.is_held()
+
+    checker.release()
+    assert not web.is_held()
+    assert InstanceLock(lock_path).acquire()
+
+
+def test_live_pid_in_lock_file_is_not_held(lock_path):
+    # 強制終了したチェッカーのPIDが、チェッカーではない生存中のプロセスに使い回された状態
+    with open(lock_path, 'w') as f:
+        f.write(f'{os.getppid()}\n')
+
+    assert not InstanceLock(lock_path).is_held()
+    assert InstanceLock(lock_path).acquire()
+
+
+def test_acquire_retries_while_is_held_probes(lock_path):
+    probe = open(lock_path, 'a+')
+    fcntl.flock(probe, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    # 確認中の共有ロックは一瞬で外れるので、起動中のチェッカーは終了せずに取り直す
+    threading.Timer(0.2, probe.close).start()
+
+    checker = InstanceLock(lock_path)
+    assert checker.acquire()
+    assert InstanceLock(lock_path).is_held()
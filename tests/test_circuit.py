@@ -0,0 +1,63 @@
+import pytest
+
+from utils import circuit
+from utils.circuit import HostCircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_failure_opens_until_cooldown(clock):
+    breaker = HostCircuitBreaker(cooldown=30)
+    breaker.failure('10.0.0.1')
+
+    assert not breaker.allow('10.0.0.1')
+    assert breaker.allow('10.0.0.2')
+    clock[0] += 30
+    # 半開では1回だけ確認を通す
+    assert breaker.allow('10.0.0.1')
+    assert breaker.state('10.0.0.1') == HostCircuitBreaker.HALF_OPEN
+    assert not breaker.allow('10.0.0.1')
+
+
+def test_success_closes_circuit(clock):
+    breaker = HostCircuitBreaker(cooldown=30)
+    breaker.failure('10.0.0.1')
+    clock[0] += 30
+    breaker.allow('10.0.0.1')
+
+    breaker.success('10.0.0.1')
+
+    assert breaker.state('10.0.0.1') == HostCircuitBreaker.CLOSED
+    assert breaker.allow('10.0.0.1')
+    assert breaker.open_hosts() == 0
+
+
+def test_repeated_failures_double_cooldown_up_to_max(clock):
+    breaker = HostCircuitBreaker(cooldown=30, max_cooldown=100)
+    waits = []
+    for _ in range(4):
+        breaker.failure('10.0.0.1')
+        wait = 0
+        while not breaker.allow('10.0.0.1'):
+            clock[0] += 1
+            wait += 1
+        waits.append(wait)
+
+    assert waits == [30, 60, 100, 100]
+
+
+def test_on_change_reports_open_hosts(clock):
+    reported = []
+    breaker = HostCircuitBreaker(on_change=reported.append)
+
+    breaker.failure('10.0.0.1')
+    breaker.failure('10.0.0.2')
+    breaker.success('10.0.0.1')
+    breaker.success('10.0.0.3')
+
+    assert reported == [1, 2, 1]
@@ -0,0 +1,170 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+import app as ipmanager
+from utils.discovery import DiscoveryJob, DiscoveryJobs, PortScanner, suggest_service
+
+
+@pytest.fixture
+def listeners():
+    socks = []
+    for _ in range(2):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(16)
+        socks.append(sock)
+    yield [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+
+
+@pytest.fixture
+def closed_ports():
+    ports = []
+    for _ in range(3):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        ports.append(sock.getsockname()[1])
+        sock.close()
+    return ports
+
+
+def test_scan_finds_only_listening_ports(listeners, closed_ports):
+    done = []
+    found = list(PortScanner(timeout=1.0).scan(['127.0.0.1'], listeners + closed_ports, progress=done.append))
+
+    assert sorted(port for _, port, _ in found) == sorted(listeners)
+    assert all(host == '127.0.0.1' and latency >= 0 for host, _, latency in found)
+    assert done[-1] == len(listeners) + len(closed_ports)
+
+
+def test_scan_respects_concurrency_limits(listeners, closed_ports):
+    scanner = PortScanner(timeout=1.0, max_concurrency=1, per_host_limit=1, rate=1000)
+    found = list(scanner.scan(['127.0.0.1'], closed_ports + listeners))
+
+    assert sorted(port for _, port, _ in found) == sorted(listeners)
+
+
+def test_scan_stops_when_cancelled(listeners):
+    found = list(PortScanner(timeout=1.0).scan(['127.0.0.1'], listeners, cancelled=lambda: True))
+    assert found == []
+
+
+def test_job_collects_results(listeners, closed_ports):
+    jobs = DiscoveryJobs(PortScanner(timeout=1.0))
+    job = jobs.start(['127.0.0.1'], listeners + closed_ports, label='loopback')
+    deadline = time.monotonic() + 5
+    while job.state == 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    result = jobs.get(job.id).to_dict()
+    assert result['state'] == 'done'
+    assert result['total'] == result['done'] == len(listeners) + len(closed_ports)
+    assert [f['port'] for f in result['found']] == sorted(listeners)
+
+
+def test_suggest_service():
+    assert suggest_service('10.0.0.1', 22) == ('SSH 10.0.0.1', 'tcp')
+    assert suggest_service('10.0.0.1', 8080) == ('Web 10.0.0.1', 'http')
+    assert suggest_service('10.0.0.1', 12345) == ('Port 12345 10.0.0.1', 'tcp')
+
+
+def _wait(jobs, job_id, timeout=5):
+    # 他のインスタンスから見て終了するまで（終了時の状態が書き出されるまで）待つ
+    deadline = time.monotonic() + timeout
+    while jobs.get(job_id).state == 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_job_state_is_shared_through_directory(tmp_path, listeners, closed_ports):
+    # 同じディレクトリを使う2つのインスタンスは、Gunicornの2つのワーカーに相当する
+    worker1 = DiscoveryJobs(PortScanner(timeout=1.0), directory=str(tmp_path))
+    worker2 = DiscoveryJobs(PortScanner(timeout=1.0), directory=str(tmp_path))
+    job = worker1.start(['127.0.0.1'], listeners + closed_ports, label='loopback')
+    _wait(worker2, job.id)
+
+    result = worker2.get(job.id).to_dict()
+    assert result == job.to_dict() | {'elapsed': result['elapsed']}
+    assert result['state'] == 'done'
+    assert worker2.get('0' * 12) is None
+    assert worker2.get('../secret') is None
+
+
+def test_cancel_from_another_instance(tmp_path, monkeypatch):
+    class _SlowScanner:
+        def scan(self, hosts, ports, progress=None, cancelled=None):
+            while not cancelled():
+                time.sleep(0.01)
+            return
+            yield
+
+    monkeypatch.setattr(DiscoveryJob, 'UPDATE_SECONDS', 0.01)
+    worker1 = DiscoveryJobs(_SlowScanner(), directory=str(tmp_path))
+    worker2 = DiscoveryJobs(_SlowScanner(), directory=str(tmp_path))
+    job = worker1.start(['127.0.0.1'], [22])
+    assert worker2.get(job.id).state == 'running'
+
+    worker2.get(job.id).cancel()
+    _wait(worker2, job.id)
+
+    assert job.state == 'cancelled'
+    assert worker2.get(job.id).state == 'cancelled'
+    assert not (tmp_path / f'{job.id}.cancel').exists()
+
+
+def test_running_limit_counts_other_instances(tmp_path):
+    stop = threading.Event()
+
+    class _BlockingScanner:
+        def scan(self, hosts, ports, progress=None, cancelled=None):
+            stop.wait(5)
+            return
+            yield
+
+    worker1 = DiscoveryJobs(_BlockingScanner(), max_running=1, directory=str(tmp_path))
+    worker2 = DiscoveryJobs(_BlockingScanner(), max_running=1, directory=str(tmp_path))
+    job = worker1.start(['127.0.0.1'], [22])
+    try:
+        assert worker2.start(['127.0.0.1'], [22]) is None
+    finally:
+        stop.set()
+    _wait(worker2, job.id)
+    assert worker2.start(['127.0.0.1'], [22]) is not None
+
+
+def test_job_of_exited_process_is_reported_as_error(tmp_path):
+    (tmp_path / 'abcdef012345.json').write_text(json.dumps({
+        'id': 'abcdef012345', 'label': '', 'state': 'running', 'error': None, 'hosts': 1, 'ports': [22],
+        'total': 1, 'done': 0, 'elapsed': 0, 'found': [], 'started_at': 0, 'updated_at': time.time() - 60
+    }))
+
+    result = DiscoveryJobs(PortScanner(), directory=str(tmp_path)).get('abcdef012345').to_dict()
+    assert result['state'] == 'error' and result['error']
+    assert 'updated_at' not in result
+
+
+def test_targets_are_limited_to_private_networks():
+    services = [
+        ipmanager._new_service({'service_name': 'ts', 'ip_address': '100.100.1.1', 'port': 22, 'probe_type': 'tcp'}),
+        ipmanager._new_service({'service_name': 'pub', 'ip_address': '8.8.8.8', 'port': 53, 'probe_type': 'tcp'}),
+    ]
+
+    assert len(ipmanager._discovery_hosts(services, cidr='192.168.1.0/24')) == 254
+    assert ipmanager._discovery_hosts(services, group=ipmanager.get_ip_group('100.100.1.1')) == ['100.100.1.1']
+    for cidr in ('8.8.8.0/24', '0.0.0.0/0', '192.168.0.0/15'):
+        with pytest.raises(ValueError):
+            ipmanager._discovery_hosts(services, cidr=cidr)
+    with pytest.raises(ValueError):
+        ipmanager._discovery_hosts(services, group='8.8.8.x')
+    # 登録済みのグローバルアドレスも対象にしない
+    with pytest.raises(ValueError):
+        ipmanager._discovery_hosts(services, group=ipmanager.get_ip_group('8.8.8.8'))
+
+
+def test_public_cidr_is_rejected_by_api():
+    response = ipmanager.app.test_client().post('/discovery', json={'cidr': '1.1.1.0/24', 'ports': '80'})
+    assert response.status_code == 400
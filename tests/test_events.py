@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+import app as ipmanager
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(ipmanager, '_event_streams', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(ipmanager, 'EVENTS_KEEPALIVE_SECONDS', 0.01)
+    return ipmanager.app.test_client()
+
+
+def test_streams_over_the_cap_get_503_with_retry(client):
+    first = client.get('/events')
+    assert first.status_code == 200
+
+    rejected = client.get('/events')
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == str(ipmanager.CHANGES_POLL_SECONDS)
+    assert rejected.get_data(as_text=True).startswith('retry: ')
+
+    # 閉じた接続の枠は次の接続に使える
+    first.close()
+    second = client.get('/events')
+    assert second.status_code == 200
+    second.close()
+
+
+def test_closing_a_stream_unsubscribes(client):
+    before = len(ipmanager.change_broadcaster._subscribers)
+    response = client.get('/events')
+    assert len(ipmanager.change_broadcaster._subscribers) == before + 1
+
+    response.close()
+    assert len(ipmanager.change_broadcaster._subscribers) == before
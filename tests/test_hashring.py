@@ -0,0 +1,37 @@
+from utils.hashring import HashRing
+
+KEYS = [f'10.0.{i // 256}.{i % 256}:80' for i in range(2000)]
+
+
+def test_empty_ring_has_no_node():
+    assert HashRing().node_for('10.0.0.1:80') is None
+
+
+def test_assignment_is_deterministic_and_spread():
+    ring, other = HashRing(['a', 'b', 'c']), HashRing(['c', 'a', 'b'])
+
+    owners = [ring.node_for(key) for key in KEYS]
+
+    assert owners == [other.node_for(key) for key in KEYS]
+    for node in 'abc':
+        assert owners.count(node) > len(KEYS) / 6
+
+
+def test_removing_node_only_moves_its_keys():
+    ring = HashRing(['a', 'b', 'c'])
+    before = {key: ring.node_for(key) for key in KEYS}
+
+    ring.remove('b')
+
+    for key, owner in before.items():
+        if owner != 'b':
+            assert ring.node_for(key) == owner
+        else:
+            assert ring.node_for(key) in ('a', 'c')
+
+
+def test_accept_skips_rejected_nodes():
+    ring = HashRing(['a', 'b', 'c'])
+
+    assert all(ring.node_for(key, accept=lambda node: node != 'a') != 'a' for key in KEYS[:200])
+    assert ring.node_for(KEYS[0], accept=lambda node: False) is None
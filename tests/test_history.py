@@ -0,0 +1,88 @@
+import pytest
+
+from utils.history import LatencyHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    return LatencyHistory(str(tmp_path / 'history.db'), capacity=3)
+
+
+def test_duplicate_samples_are_recorded_once(history):
+    history.record_many([('web', 60.0, 10.0), ('web', 61.0, None)])
+    generation = history.generation()
+
+    # チェッカーが同じ結果を再送しても集計は変わらず、世代も進まない
+    history.record_many([('web', 60.0, 10.0), ('web', 61.0, None)])
+
+    assert history.samples('web') == [(60.0, 10.0), (61.0, None)]
+    assert history.summary('web', now=61.0)['rollups']['1m'][0]['count'] == 2
+    assert history.generation() == generation
+
+
+def test_only_capacity_latest_samples_are_kept(history):
+    history.record_many([('web', float(ts), float(ts)) for ts in range(5)])
+    history.record('db', 0.0, 1.0)
+
+    assert history.samples('web') == [(2.0, 2.0), (3.0, 3.0), (4.0, 4.0)]
+    assert history.samples('db') == [(0.0, 1.0)]
+    assert history.samples_many(['web', 'db', 'gone'], limit=2) == {
+        'web': [(3.0, 3.0), (4.0, 4.0)],
+        'db': [(0.0, 1.0)],
+    }
+
+
+def test_rollups_track_min_avg_max_and_loss(history):
+    history.record_many([
+        ('web', 120.0, 10.0),
+        ('web', 130.0, 30.0),
+        ('web', 140.0, None),
+        ('web', 150.0, 20.0),
+        ('web', 180.0, None),
+    ])
+
+    rollups = history.summary('web', now=180.0)['rollups']
+    assert rollups['1m'] == [
+        {'start': 120.0, 'count': 4, 'min': 10.0, 'avg': 20.0, 'max': 30.0, 'loss': 0.25},
+        {'start': 180.0, 'count': 1, 'min': None, 'avg': None, 'max': None, 'loss': 1.0},
+    ]
+    assert rollups['1h'][0]['count'] == 5
+    assert rollups['1h'][0]['loss'] == 0.4
+
+
+def test_rollups_merge_across_batches(history):
+    history.record('web', 120.0, 30.0)
+    history.record('web', 130.0, 10.0)
+
+    bucket = history.summary('web', now=130.0)['rollups']['1m'][0]
+    assert (bucket['min'], bucket['avg'], bucket['max']) == (10.0, 20.0, 30.0)
+
+
+def test_forget_drops_samples_and_rollups(history):
+    history.record_many([('web', 60.0, 10.0), ('db', 60.0, 5.0)])
+    generation = history.generation()
+
+    history.forget(['web'])
+
+    assert history.samples('web') == []
+    assert history.summary('web', now=60.0)['rollups']['1m'] == []
+    assert history.samples('db') == [(60.0, 5.0)]
+    assert history.generation() == generation + 1
+
+
+def test_generation_only_moves_on_real_changes(history):
+    generation = history.generation()
+    history.record_many([])
+    history.forget([])
+    history.forget(['unknown'])
+    assert history.generation() == generation
+
+    history.record('web', 60.0, 10.0)
+    assert history.generation() == generation + 1
+
+
+def test_history_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'history.db')
+    LatencyHistory(path).record('web', 60.0, 10.0)
+
+    assert LatencyHistory(path).samples('web') == [(60.0, 10.0)]
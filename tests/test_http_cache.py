@@ -0,0 +1,109 @@
+import gzip
+
+import pytest
+from flask import Flask, jsonify
+
+from utils.http_cache import ConditionalResponseCache
+
+
+@pytest.fixture
+def state():
+    return {'version': 'v1', 'calls': 0}
+
+
+@pytest.fixture
+def cache():
+    return ConditionalResponseCache(max_entries=2, min_size=100, salt='test')
+
+
+@pytest.fixture
+def client(state, cache):
+    app = Flask(__name__)
+
+    @app.route('/data')
+    @cache.conditional(lambda: state['version'])
+    def data():
+        state['calls'] += 1
+        response = jsonify({'items': ['x' * 10] * 50})
+        response.headers['X-Total'] = '50'
+        return response
+
+    @app.route('/small')
+    @cache.conditional(lambda: state['version'])
+    def small():
+        return jsonify({'ok': True})
+
+    @app.route('/uncached')
+    @cache.conditional(lambda: None)
+    def uncached():
+        state['calls'] += 1
+        return 'fresh'
+
+    return app.test_client()
+
+
+def test_matching_etag_returns_304_without_calling_view(client, state, cache):
+    first = client.get('/data')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    second = client.get('/data', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.get_data() == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert state['calls'] == 1
+    assert cache.stats()['not_modified'] == 1
+
+
+def test_new_version_changes_etag(client, state):
+    etag = client.get('/data').headers['ETag']
+    state['version'] = 'v2'
+
+    response = client.get('/data', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert state['calls'] == 2
+
+
+def test_gzip_body_is_cached_and_reused(client, state, cache):
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()).startswith(b'{')
+
+    again = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+    assert again.get_data() == response.get_data()
+    # ビューが付けたヘッダーもキャッシュから再送する
+    assert again.headers['X-Total'] == '50'
+    assert state['calls'] == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_encodings_get_separate_etags(client):
+    plain = client.get('/data')
+    gzipped = client.get('/data', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['ETag'] != gzipped.headers['ETag']
+    response = client.get('/data', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+    assert response.status_code == 200
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.json == {'ok': True}
+
+
+def test_views_without_version_bypass_the_cache(client, state, cache):
+    assert client.get('/uncached').get_data() == b'fresh'
+    assert client.get('/uncached').get_data() == b'fresh'
+    assert 'ETag' not in client.get('/uncached').headers
+    assert state['calls'] == 3
+    assert cache.stats()['entries'] == 0
+
+
+def test_oldest_entries_are_evicted(client, cache):
+    for query in ('a', 'b', 'c'):
+        client.get(f'/data?q={query}')
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,152 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.http_probe import HTTPProbePool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _record(self):
+        self.server.requests.append((self.command, self.path, self.client_address[1]))
+
+    def do_HEAD(self):
+        self._record()
+        status = self.server.head_status
+        if status is None:
+            # 応答しないサーバー
+            time.sleep(1.0)
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._record()
+        self.send_response(self.server.get_status)
+        self.send_header('Content-Length', str(1024 * 1024))
+        self.end_headers()
+        self.wfile.flush()
+        # ボディは遅れて送る（読もうとするとタイムアウトする）
+        time.sleep(1.0)
+        try:
+            self.wfile.write(b'x' * 1024 * 1024)
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.head_status = 200
+    httpd.get_status = 200
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def observed():
+    return []
+
+
+@pytest.fixture
+def pool(observed):
+    pool = HTTPProbePool(connect_timeout=1, read_timeout=0.5, observer=lambda scheme, result: observed.append(result))
+    yield pool
+    pool.close()
+
+
+def _port(server):
+    return server.server_address[1]
+
+
+def test_head_success(server, pool, observed):
+    reachable, latency = pool.probe('127.0.0.1', _port(server))
+
+    assert reachable and latency >= 0
+    assert [method for method, _, _ in server.requests] == ['HEAD']
+    assert observed == ['ok']
+
+
+@pytest.mark.parametrize('status', [405, 501])
+def test_head_not_allowed_falls_back_to_streamed_get(server, pool, observed, status):
+    server.head_status = status
+
+    started = time.perf_counter()
+    reachable, _ = pool.probe('127.0.0.1', _port(server))
+
+    assert reachable
+    assert [method for method, _, _ in server.requests] == ['HEAD', 'GET']
+    # ボディを待たずに（読み込みのタイムアウトより前に）返る
+    assert time.perf_counter() - started < 0.5
+    assert observed == ['ok']
+
+
+def test_get_method_never_reads_body(server, observed):
+    pool = HTTPProbePool(method='GET', connect_timeout=1, read_timeout=0.5,
+                         observer=lambda scheme, result: observed.append(result))
+    try:
+        started = time.perf_counter()
+        assert pool.probe('127.0.0.1', _port(server))[0]
+        assert time.perf_counter() - started < 0.5
+    finally:
+        pool.close()
+
+
+def test_non_2xx_is_unreachable(server, pool, observed):
+    server.head_status = 503
+
+    assert pool.probe('127.0.0.1', _port(server)) == (False, None)
+    assert observed == ['http_status']
+
+
+def test_session_and_connection_are_reused_per_host_port(server, pool):
+    port = _port(server)
+    for _ in range(3):
+        assert pool.probe('127.0.0.1', port)[0]
+
+    assert list(pool._sessions) == [f'127.0.0.1:{port}']
+    # Keep-Aliveで同じ接続（クライアント側のポート）を使い回す
+    assert len({client_port for _, _, client_port in server.requests}) == 1
+
+
+def test_each_host_port_gets_its_own_session(server, pool):
+    other = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    other.daemon_threads = True
+    other.requests, other.head_status = [], 200
+    threading.Thread(target=other.serve_forever, args=(0.05,), daemon=True).start()
+    try:
+        pool.probe('127.0.0.1', _port(server))
+        pool.probe('127.0.0.1', _port(other))
+        assert sorted(pool._sessions) == sorted([f'127.0.0.1:{_port(server)}', f'127.0.0.1:{_port(other)}'])
+    finally:
+        other.shutdown()
+        other.server_close()
+
+
+def test_timeout_is_unreachable(server, pool, observed):
+    server.head_status = None
+
+    assert pool.probe('127.0.0.1', _port(server)) == (False, None)
+    assert observed == ['timeout']
+
+
+def test_connection_error_is_unreachable(pool, observed):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    assert pool.probe('127.0.0.1', port) == (False, None)
+    assert observed == ['connection_error']
@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+
+import pytest
+
+import app as ipmanager
+
+JSON = {'Accept': 'application/json'}
+
+
+@pytest.fixture
+def client():
+    data = ipmanager.load_data()
+    data['services'] = [
+        ipmanager._new_service({'service_name': 'web', 'ip_address': '10.0.0.1', 'port': 80, 'probe_type': 'http'}),
+    ]
+    ipmanager.save_data(data)
+    return ipmanager.app.test_client()
+
+
+def _names():
+    return [svc['service_name'] for svc in ipmanager.data_store.snapshot()['services']]
+
+
+def _post_csv(client, text, **params):
+    return client.post('/import', query_string=params, headers=JSON, data={
+        'file': (io.BytesIO(text.encode('utf-8')), 'services.csv')
+    }, content_type='multipart/form-data')
+
+
+def test_csv_import_adds_rows_in_one_save_and_skips_duplicates(client):
+    response = _post_csv(client, (
+        'service_name,ip_address,port,probe_type,favorite\n'
+        'ssh,10.0.0.2,22,tcp,true\n'
+        'web,10.0.0.1,80,http,\n'
+        'ssh,10.0.0.2,22,tcp,\n'
+        'db,10.0.0.3,,tcp,\n'
+    ))
+
+    assert response.status_code == 200
+    result = response.json
+    assert result['committed'] and result['imported'] == 2
+    assert result['duplicates'] == [3, 4]
+    assert _names() == ['web', 'ssh', 'db']
+    services = ipmanager.data_store.snapshot()['services']
+    assert services[1]['favorite'] is True
+    assert services[2]['port'] == 80
+
+
+def test_invalid_rows_reject_the_whole_import(client):
+    response = _post_csv(client, (
+        'service_name,ip_address,port\n'
+        'ok,10.0.0.2,22\n'
+        'bad,10.0.0.300,22\n'
+    ))
+
+    assert response.status_code == 400
+    assert response.json['errors'][0]['row'] == 3
+    assert _names() == ['web']
+
+    skipped = _post_csv(client, 'service_name,ip_address,port\nok,10.0.0.2,22\nbad,10.0.0.300,22\n', skip_invalid=1)
+    assert skipped.json['imported'] == 1
+    assert _names() == ['web', 'ok']
+
+
+def test_dry_run_does_not_save(client):
+    response = client.post('/import?dry_run=1', headers=JSON, json=[
+        {'service_name': 'ssh', 'ip_address': '10.0.0.2', 'port': 22, 'probe_type': 'tcp'}
+    ])
+
+    assert response.json['valid'] == 1 and not response.json['committed']
+    assert _names() == ['web']
+
+
+def test_json_import_rejects_non_objects(client):
+    response = client.post('/import', headers=JSON, json=['not a service'])
+    assert response.status_code == 400
+    assert _names() == ['web']
+
+
+def test_csv_export_round_trips_through_import(client):
+    client.post('/import', headers=JSON, json=[
+        {'service_name': 'ssh', 'ip_address': '10.0.0.2', 'port': 22, 'probe_type': 'tcp'},
+        {'service_name': 'lan', 'ip_address': '192.168.1.5', 'port': 8080, 'probe_type': 'http'},
+    ])
+
+    exported = client.get('/export?format=csv')
+    assert exported.headers['Content-Disposition'].startswith('attachment;')
+    rows = list(csv.DictReader(io.StringIO(exported.get_data(as_text=True))))
+    assert [row['service_name'] for row in rows] == ['web', 'ssh', 'lan']
+
+    filtered = json.loads(client.get('/export?format=json&cidr=10.0.0.0/24').get_data())
+    assert [svc['service_name'] for svc in filtered['services']] == ['web', 'ssh']
+
+    # 書き出した内容をそのまま取り込んでも重複としてスキップされる
+    result = _post_csv(client, exported.get_data(as_text=True)).json
+    assert result['imported'] == 0 and result['duplicates'] == [2, 3, 4]
+
+
+def test_unsupported_export_format(client):
+    assert client.get('/export?format=xml').status_code == 400
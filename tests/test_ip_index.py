@@ -0,0 +1,92 @@
+import ipaddress
+
+from utils.ip_index import IPIndex, ip_to_int
+
+
+def _key(rec):
+    return (rec['ip_address'], str(rec['port']), rec['service_name'])
+
+
+def _group(ip_str):
+    if ip_to_int(ip_str) is None:
+        return 'other'
+    return '.'.join(ip_str.split('.')[:3]) + '.x'
+
+
+def _index():
+    return IPIndex(_key, _group, lambda group: (group == 'other', group))
+
+
+def _records(*rows):
+    return [{'id': i + 1, 'ip_address': ip, 'port': port, 'service_name': name}
+            for i, (ip, port, name) in enumerate(rows)]
+
+
+def _query(index, cidr):
+    return index.query_cidr(ipaddress.IPv4Network(cidr))
+
+
+def test_ip_to_int():
+    assert ip_to_int('0.0.0.1') == 1
+    assert ip_to_int('192.168.1.10') == 0xC0A8010A
+    assert ip_to_int('300.1.1.1') is None
+    assert ip_to_int('not-an-ip') is None
+
+
+def test_cidr_query_returns_ids_in_ip_order():
+    index = _index()
+    index.sync(object(), _records(
+        ('192.168.1.20', 80, 'b'),
+        ('192.168.1.3', 22, 'a'),
+        ('192.168.2.1', 80, 'c'),
+        ('10.0.0.1', 80, 'd'),
+        ('invalid', 80, 'e'),
+    ))
+
+    # 文字列順ではなく整数の順（.3 が .20 より前）
+    assert _query(index, '192.168.1.0/24') == [2, 1]
+    assert _query(index, '192.168.0.0/16') == [2, 1, 3]
+    assert _query(index, '10.0.0.1/32') == [4]
+    assert _query(index, '172.16.0.0/12') == []
+    assert _query(index, '0.0.0.0/0') == [4, 2, 1, 3]
+
+
+def test_cidr_query_includes_network_and_broadcast_addresses():
+    index = _index()
+    index.sync(object(), _records(('10.0.0.0', 1, 'net'), ('10.0.0.255', 1, 'bcast'), ('10.0.1.0', 1, 'next')))
+
+    assert _query(index, '10.0.0.0/24') == [1, 2]
+
+
+def test_duplicate_keys_share_an_entry():
+    index = _index()
+    index.sync(object(), _records(('10.0.0.1', 80, 'web'), ('10.0.0.1', 80, 'web')))
+
+    assert _query(index, '10.0.0.0/24') == [1, 2]
+    assert index.group_names() == ['10.0.0.x']
+
+
+def test_sync_applies_only_the_difference():
+    index = _index()
+    records = _records(('192.168.1.1', 80, 'a'), ('10.0.0.1', 80, 'b'), ('10.0.0.2', 80, 'c'))
+    index.sync(object(), records)
+    assert index.group_names() == ['10.0.0.x', '192.168.1.x']
+
+    # 先頭を削除してIDが振り直されても、キーが同じレコードは同じエントリを使う
+    renumbered = _records(('10.0.0.1', 80, 'b'), ('10.0.0.2', 80, 'c'), ('172.16.0.1', 80, 'd'))
+    index.sync(object(), renumbered)
+
+    assert _query(index, '192.168.0.0/16') == []
+    assert _query(index, '10.0.0.0/8') == [1, 2]
+    assert index.group_names() == ['10.0.0.x', '172.16.0.x']
+
+
+def test_same_source_is_not_resynced():
+    index = _index()
+    source = object()
+    records = _records(('10.0.0.1', 80, 'a'))
+    index.sync(source, records)
+    records.append({'id': 2, 'ip_address': '10.0.0.2', 'port': 80, 'service_name': 'b'})
+
+    index.sync(source, records)
+    assert _query(index, '10.0.0.0/24') == [1]
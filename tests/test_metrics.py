@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+
+from utils.metrics import MetricsRegistry
+
+
+def _lines(text):
+    return [line for line in text.splitlines() if not line.startswith('#')]
+
+
+def test_counter_and_gauge_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter('app_requests', 'リクエスト数', ('method',))
+    inflight = registry.gauge('app_inflight', '処理中のリクエスト数')
+    requests.inc(method='GET')
+    requests.inc(2, method='GET')
+    requests.inc(method='POST')
+    inflight.set(3)
+    inflight.dec()
+
+    text = registry.render()
+    assert '# TYPE app_requests_total counter' in text
+    assert _lines(text) == [
+        'app_requests_total{method="GET"} 3',
+        'app_requests_total{method="POST"} 1',
+        'app_inflight 2',
+    ]
+    # OpenMetricsではファミリー名に _total を付けず、# EOF で終わる
+    openmetrics = registry.render(openmetrics=True)
+    assert '# TYPE app_requests counter' in openmetrics
+    assert openmetrics.endswith('# EOF\n')
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('app_latency_seconds', 'レイテンシ', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        latency.observe(value)
+
+    assert _lines(registry.render()) == [
+        'app_latency_seconds_bucket{le="0.1"} 1',
+        'app_latency_seconds_bucket{le="1.0"} 3',
+        'app_latency_seconds_bucket{le="+Inf"} 4',
+        'app_latency_seconds_sum 3.05',
+        'app_latency_seconds_count 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('app_errors', 'エラー', ('message',)).inc(message='a "b"\nc\\d')
+
+    assert _lines(registry.render()) == ['app_errors_total{message="a \\"b\\"\\nc\\\\d"} 1']
+
+
+def test_collectors_are_rendered():
+    registry = MetricsRegistry()
+    registry.collector(lambda: [('app_services', 'gauge', 'サービス数', [({'status': 'up'}, 5)])])
+
+    assert _lines(registry.render()) == ['app_services{status="up"} 5']
+
+
+def test_values_are_merged_across_processes(tmp_path):
+    def registry():
+        registry = MetricsRegistry(str(tmp_path))
+        registry.counter('app_requests', 'リクエスト数')
+        registry.gauge('app_inflight', '処理中のリクエスト数')
+        return registry
+
+    live = registry()
+    # 生存中の別プロセス（親プロセス）と、終了したプロセスの値を置いておく
+    dead_pid = int(subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                  capture_output=True, text=True, check=True).stdout)
+    for pid, requests, inflight in ((os.getppid(), 2, 1), (dead_pid, 5, 4)):
+        (tmp_path / f'{pid}.json').write_text(json.dumps({
+            'app_requests': [[[], requests]], 'app_inflight': [[[], inflight]]
+        }))
+
+    # 終了したプロセスのカウンターは archive.json に繰り入れて残し、ゲージは捨てる
+    assert _lines(live.render()) == ['app_requests_total 7', 'app_inflight 1']
+    assert not (tmp_path / f'{dead_pid}.json').exists()
+    assert _lines(registry().render()) == ['app_requests_total 7', 'app_inflight 1']
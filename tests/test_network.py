@@ -0,0 +1,204 @@
+import os
+import socket
+import struct
+import time
+from collections import deque
+
+import pytest
+
+from utils import network
+from utils.network import host_alive, ping_hosts, tcp_connect
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.fixture
+def high_fds():
+    # 番号が1024以上のディスクリプタを使わせるため、先に低い番号を埋めておく
+    fds = []
+    try:
+        while not fds or fds[-1] < 1100:
+            fds.append(os.open(os.devnull, os.O_RDONLY))
+    except OSError:
+        for fd in fds:
+            os.close(fd)
+        pytest.skip('ディスクリプタの上限が低すぎる')
+    yield
+    for fd in fds:
+        os.close(fd)
+
+
+def test_tcp_connect_to_listening_port(listener):
+    reachable, latency = tcp_connect('127.0.0.1', listener, timeout=1.0)
+    assert reachable
+    assert latency is not None and latency >= 0
+
+
+def test_tcp_connect_refused(closed_port):
+    assert tcp_connect('127.0.0.1', closed_port, timeout=1.0) == (False, None)
+
+
+def test_host_alive_counts_refusal_as_alive(listener, closed_port):
+    assert host_alive('127.0.0.1', [listener], timeout=1.0)
+    # 拒否（RST）が返るのはホストが動いている証拠
+    assert host_alive('127.0.0.1', [closed_port], timeout=1.0)
+
+
+def test_probes_work_with_descriptors_above_1024(high_fds, listener):
+    reachable, _ = tcp_connect('127.0.0.1', listener, timeout=1.0)
+    assert reachable
+    assert host_alive('127.0.0.1', [listener], timeout=1.0)
+
+
+def test_ping_hosts_dedupes_and_handles_empty_input(monkeypatch):
+    assert ping_hosts([]) == {}
+
+    calls = []
+    monkeypatch.setattr(network, '_open_icmp_socket', lambda: (None, False))
+    monkeypatch.setattr(network, '_ping_subprocess', lambda ip: calls.append(ip) or (ip == '10.0.0.1', None))
+
+    results = ping_hosts(['10.0.0.1', '10.0.0.2', '10.0.0.1'])
+    assert results == {'10.0.0.1': (True, None), '10.0.0.2': (False, None)}
+    assert sorted(calls) == ['10.0.0.1', '10.0.0.2']
+
+
+class _FakeICMPSocket:
+    """送信したエコー要求に reply(ip, 種別, 識別子, シーケンス番号) の応答を返すICMPソケットの代わり
+
+    selectorで待てるよう、応答はソケットペアを通して受け取る。
+    """
+
+    def __init__(self, reply, is_raw=False, unreachable=()):
+        self._reader, self._writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._senders = deque()
+        self.reply = reply
+        self.is_raw = is_raw
+        self.unreachable = unreachable
+        self.sent = []
+        self.closed = False
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def sendto(self, packet, address):
+        ip = address[0]
+        if ip in self.unreachable:
+            raise OSError('Network is unreachable')
+        icmp_type, code, checksum, identifier, seq = struct.unpack('!BBHHH', packet[:8])
+        assert icmp_type == network.ICMP_ECHO_REQUEST
+        assert network._icmp_checksum(packet[:2] + b'\0\0' + packet[4:]) == checksum
+        self.sent.append((ip, identifier, seq))
+        for sender, reply_type, reply_id, reply_seq in self.reply(ip, identifier, seq):
+            data = struct.pack('!BBHHH', reply_type, 0, 0, reply_id, reply_seq) + packet[8:]
+            if self.is_raw:
+                # RAWソケットではIPヘッダー（オプションなしの20バイト）が付く
+                data = bytes([0x45]) + bytes(19) + data
+            self._senders.append(sender)
+            self._writer.send(data)
+
+    def recvfrom(self, size):
+        return self._reader.recv(size), (self._senders.popleft(), 0)
+
+    def close(self):
+        self.closed = True
+        self._reader.close()
+        self._writer.close()
+
+
+def _use_socket(monkeypatch, sock):
+    monkeypatch.setattr(network, '_open_icmp_socket', lambda: (sock, sock.is_raw))
+    monkeypatch.setattr(network, '_ping_subprocess', lambda ip: pytest.fail('pingコマンドを使った'))
+
+
+def test_ping_hosts_matches_replies_by_sequence(monkeypatch):
+    # データグラムソケットではカーネルが識別子を書き換えるので、識別子は照合に使わない
+    sock = _FakeICMPSocket(lambda ip, identifier, seq: [] if ip == '10.0.0.2' else [(ip, 0, 0x1234, seq)])
+    _use_socket(monkeypatch, sock)
+
+    started = time.perf_counter()
+    results = ping_hosts(['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.1'], timeout=0.2)
+    elapsed = time.perf_counter() - started
+
+    assert [seq for _, _, seq in sock.sent] == [0, 1, 2]
+    assert results['10.0.0.1'][0] and results['10.0.0.3'][0]
+    assert results['10.0.0.1'][1] >= 0
+    assert results['10.0.0.2'] == (False, None)
+    # 応答のないホストはtimeoutで打ち切る
+    assert 0.2 <= elapsed < 1.0
+    assert sock.closed
+
+
+def test_ping_hosts_returns_as_soon_as_all_replied(monkeypatch):
+    _use_socket(monkeypatch, _FakeICMPSocket(lambda ip, identifier, seq: [(ip, 0, identifier, seq)]))
+
+    started = time.perf_counter()
+    results = ping_hosts(['10.0.0.1', '10.0.0.2'], timeout=5.0)
+
+    assert all(reachable for reachable, _ in results.values())
+    assert time.perf_counter() - started < 1.0
+
+
+def test_ping_hosts_ignores_unrelated_replies(monkeypatch):
+    def reply(ip, identifier, seq):
+        return [
+            (ip, 3, identifier, seq),           # エコー応答以外（到達不能の通知など）
+            (ip, 0, identifier, seq + 100),     # 送っていないシーケンス番号
+            ('10.9.9.9', 0, identifier, seq),   # 別のホストからの応答
+        ]
+
+    _use_socket(monkeypatch, _FakeICMPSocket(reply))
+
+    assert ping_hosts(['10.0.0.1'], timeout=0.1) == {'10.0.0.1': (False, None)}
+
+
+def test_ping_hosts_raw_socket_strips_ip_header_and_checks_identifier(monkeypatch):
+    def reply(ip, identifier, seq):
+        if ip == '10.0.0.2':
+            # 同じホストへPingしている別のプロセス宛ての応答
+            return [(ip, 0, identifier ^ 0xffff, seq)]
+        return [(ip, 0, identifier, seq)]
+
+    sock = _FakeICMPSocket(reply, is_raw=True)
+    _use_socket(monkeypatch, sock)
+
+    results = ping_hosts(['10.0.0.1', '10.0.0.2'], timeout=0.1)
+
+    assert {identifier for _, identifier, _ in sock.sent} == {os.getpid() & 0xffff}
+    assert results['10.0.0.1'][0]
+    assert results['10.0.0.2'] == (False, None)
+
+
+def test_ping_hosts_send_failure_is_unreachable(monkeypatch):
+    _use_socket(monkeypatch, _FakeICMPSocket(lambda ip, identifier, seq: [(ip, 0, identifier, seq)],
+                                             unreachable={'10.0.0.2'}))
+
+    results = ping_hosts(['10.0.0.1', '10.0.0.2'], timeout=5.0)
+
+    assert results['10.0.0.1'][0]
+    assert results['10.0.0.2'] == (False, None)
+
+
+def test_ping_hosts_loopback_with_real_icmp_socket():
+    sock, _ = network._open_icmp_socket()
+    if sock is None:
+        pytest.skip('ICMPソケットを開けない（ping_group_range の設定またはCAP_NET_RAWが必要）')
+    sock.close()
+
+    reachable, latency = ping_hosts(['127.0.0.1'], timeout=1.0)['127.0.0.1']
+    assert reachable and latency >= 0
@@ -0,0 +1,76 @@
+import pytest
+
+from utils.pagination import decode_cursor, encode_cursor, paginate
+
+
+def _pages(items, keys, descending, limit):
+    pages, after = [], None
+    while True:
+        page, after = paginate(items, keys, descending=descending, after=after, limit=limit)
+        pages.append(page)
+        if after is None:
+            return pages
+
+
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('limit', [1, 3, 10, 11])
+def test_pages_cover_every_item_once(descending, limit):
+    keys = [(i // 2, f'svc{i}') for i in range(10)]
+    items = [key[1] for key in keys]
+
+    pages = _pages(items, keys, descending, limit)
+
+    flat = [item for page in pages for item in page]
+    assert flat == (items[::-1] if descending else items)
+    assert all(0 < len(page) <= limit for page in pages)
+
+
+def test_inserted_item_does_not_shift_next_page():
+    keys = [(i,) for i in range(0, 20, 2)]
+    items = [k[0] for k in keys]
+    first, after = paginate(items, keys, after=None, limit=3)
+
+    # 1ページ目の範囲に要素が追加されても、2ページ目は重複も抜けもなく続く
+    keys.insert(1, (1,))
+    items.insert(1, 1)
+    second, _ = paginate(items, keys, after=after, limit=3)
+
+    assert first == [0, 2, 4]
+    assert second == [6, 8, 10]
+
+
+def test_cursor_round_trip_restores_tuple_keys():
+    key = ('10.0.0.1', (80, 'web'))
+    token = encode_cursor('ip_address', 'asc', key)
+
+    assert '=' not in token
+    assert decode_cursor(token, 'ip_address', 'asc') == key
+
+
+def test_cursor_for_other_ordering_is_rejected():
+    token = encode_cursor('ip_address', 'asc', ('10.0.0.1',))
+
+    with pytest.raises(ValueError):
+        decode_cursor(token, 'ip_address', 'desc')
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', 'e30'])
+def test_broken_cursor_is_rejected(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token, 'ip_address', 'asc')
+
+
+@pytest.mark.parametrize('key', [5, 'x', [1, 'a'], {'a': 1}, [[1, 'web'], ['10.0.0.1', '80'], 'id'], None])
+def test_cursor_with_wrong_key_shape_is_rejected(key):
+    like = ((1, 'web', 2, '10.0.0.1'), ('10.0.0.1', '80', 'web', 'http'), 3)
+    token = encode_cursor('service_name', 'asc', key)
+
+    with pytest.raises(ValueError):
+        decode_cursor(token, 'service_name', 'asc', like=like)
+
+
+def test_cursor_number_may_be_int_or_float():
+    like = ((1, float('inf')), ('10.0.0.1', 'None', 'web', 'http'), 3)
+    token = encode_cursor('port', 'asc', ((0, 80), ('10.0.0.2', '80', 'db', 'tcp'), 7))
+
+    assert decode_cursor(token, 'port', 'asc', like=like) == ((0, 80), ('10.0.0.2', '80', 'db', 'tcp'), 7)
@@ -0,0 +1,206 @@
+import threading
+import time
+
+import pytest
+
+from utils import circuit
+from utils.circuit import HostCircuitBreaker
+from utils.probe_engine import ProbeEngine
+
+
+class _Network:
+    """プローブと死活確認の呼び出しを記録するスタブ"""
+
+    def __init__(self, down_hosts=(), down_services=()):
+        self.down_hosts = set(down_hosts)
+        self.down_services = set(down_services)
+        self.probes = []
+        self.checks = []
+        self._lock = threading.Lock()
+
+    def probe(self, host, port):
+        with self._lock:
+            self.probes.append((host, port))
+        if host in self.down_hosts or (host, port) in self.down_services:
+            return False, None
+        return True, 1.0
+
+    def host_check(self, host, ports):
+        with self._lock:
+            self.checks.append(host)
+        return host not in self.down_hosts
+
+
+class _ConcurrencyProbe:
+    """同時に実行中のプローブ数（全体・ホストごと）の最大値を記録するスタブ"""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.inflight = 0
+        self.per_host = {}
+        self.peak = 0
+        self.peak_per_host = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, host, port):
+        with self._lock:
+            self.inflight += 1
+            self.per_host[host] = self.per_host.get(host, 0) + 1
+            self.peak = max(self.peak, self.inflight)
+            self.peak_per_host[host] = max(self.peak_per_host.get(host, 0), self.per_host[host])
+        # ポート番号が小さいほど遅く終わるので、完了順は入力順と異なる
+        time.sleep(self.delay * (1 + 1 / port))
+        with self._lock:
+            self.inflight -= 1
+            self.per_host[host] -= 1
+        return True, float(port)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def _engine(network, breaker=None, observed=None):
+    return ProbeEngine(
+        network.probe, max_workers=8, per_host_limit=2, host_check=network.host_check, breaker=breaker,
+        observer=None if observed is None else lambda reason, count: observed.append((reason, count))
+    )
+
+
+TARGETS = [('10.0.0.1', port) for port in (22, 80, 443, 8080)] + [('10.0.0.2', 80)]
+
+
+def test_live_hosts_are_not_checked_separately():
+    network = _Network()
+
+    results = _engine(network).run(TARGETS)
+
+    assert results == [(True, 1.0)] * len(TARGETS)
+    assert network.checks == []
+    assert sorted(network.probes) == sorted(TARGETS)
+
+
+def test_down_service_on_live_host_checks_host_once():
+    network = _Network(down_services={('10.0.0.1', 22), ('10.0.0.1', 80)})
+
+    results = _engine(network).run(TARGETS)
+
+    assert [reachable for reachable, _ in results] == [False, False, True, True, True]
+    assert network.checks == ['10.0.0.1']
+    assert sorted(network.probes) == sorted(TARGETS)
+
+
+def test_down_host_skips_remaining_services(clock):
+    network = _Network(down_hosts={'10.0.0.1'})
+    breaker, observed = HostCircuitBreaker(cooldown=30), []
+
+    results = _engine(network, breaker, observed).run(TARGETS)
+
+    assert [reachable for reachable, _ in results] == [False, False, False, False, True]
+    assert network.checks == ['10.0.0.1']
+    # 担当の数（per_host_limit）までのプローブだけが行われ、残りは確認の結果で到達不可になる
+    probed = [target for target in network.probes if target[0] == '10.0.0.1']
+    assert len(probed) <= 2
+    assert observed == [('host_down', 4 - len(probed))]
+    assert breaker.state('10.0.0.1') == HostCircuitBreaker.OPEN
+
+
+def test_open_circuit_skips_host_then_checks_it_first(clock):
+    network = _Network(down_hosts={'10.0.0.1'})
+    breaker, observed = HostCircuitBreaker(cooldown=30), []
+    engine = _engine(network, breaker, observed)
+    engine.run(TARGETS)
+    network.probes.clear()
+    network.checks.clear()
+    observed.clear()
+
+    engine.run(TARGETS)
+    assert network.checks == []
+    assert network.probes == [('10.0.0.2', 80)]
+    assert observed == [('circuit_open', 4)]
+
+    # 半開では先に死活を確認し、動いていればプローブして回路を閉じる
+    clock[0] += 30
+    network.down_hosts.clear()
+    network.probes.clear()
+    results = engine.run(TARGETS)
+    assert results == [(True, 1.0)] * len(TARGETS)
+    assert network.checks == ['10.0.0.1']
+    assert breaker.state('10.0.0.1') == HostCircuitBreaker.CLOSED
+
+
+def test_bypass_checks_open_host_before_probing(clock):
+    network = _Network(down_hosts={'10.0.0.1'})
+    breaker = HostCircuitBreaker(cooldown=30)
+    engine = _engine(network, breaker)
+    engine.run(TARGETS)
+    network.probes.clear()
+    network.checks.clear()
+
+    results = engine.run(TARGETS, bypass_breaker=True)
+
+    assert [reachable for reachable, _ in results] == [False, False, False, False, True]
+    assert network.checks == ['10.0.0.1']
+    assert network.probes == [('10.0.0.2', 80)]
+
+
+HOST_CHECKS = pytest.mark.parametrize('host_check', [None, lambda host, ports: True], ids=['plain', 'host_check'])
+
+
+@HOST_CHECKS
+def test_global_concurrency_is_bounded_by_max_workers(host_check):
+    probe = _ConcurrencyProbe()
+    engine = ProbeEngine(probe, max_workers=4, per_host_limit=4, host_check=host_check)
+    targets = [(f'10.0.0.{host}', port) for host in range(1, 9) for port in (80, 443)]
+
+    engine.run(targets)
+
+    assert probe.peak == 4
+
+
+@HOST_CHECKS
+def test_per_host_concurrency_is_bounded(host_check):
+    probe = _ConcurrencyProbe()
+    engine = ProbeEngine(probe, max_workers=16, per_host_limit=2, host_check=host_check)
+    targets = [('10.0.0.1', port) for port in range(1, 11)] + [('10.0.0.2', port) for port in range(1, 4)]
+
+    engine.run(targets)
+
+    assert probe.peak_per_host == {'10.0.0.1': 2, '10.0.0.2': 2}
+    assert probe.peak <= 4
+
+
+@HOST_CHECKS
+def test_run_returns_results_in_input_order(host_check):
+    engine = ProbeEngine(_ConcurrencyProbe(delay=0.005), max_workers=8, per_host_limit=2, host_check=host_check)
+    targets = [(f'10.0.0.{i % 3}', port) for i, port in enumerate(range(1, 13))]
+
+    assert engine.run(targets) == [(True, float(port)) for _, port in targets]
+
+
+def test_probe_errors_are_reported_as_unreachable():
+    def probe(host, port):
+        raise OSError('boom')
+
+    assert ProbeEngine(probe, max_workers=2).run([('10.0.0.1', 80)]) == [(False, None)]
+
+
+def test_interleave_alternates_hosts_and_keeps_per_host_order():
+    targets = [('a', 1), ('a', 2), ('a', 3), ('b', 1), ('c', 1), ('c', 2)]
+
+    ordered = ProbeEngine._interleave(list(enumerate(targets)))
+
+    assert [target for _, target in ordered] == [('a', 1), ('b', 1), ('c', 1), ('a', 2), ('c', 2), ('a', 3)]
+    assert [index for index, _ in ordered] == [0, 3, 4, 1, 5, 2]
+
+
+@HOST_CHECKS
+def test_host_slots_are_dropped_when_idle(host_check):
+    engine = ProbeEngine(_ConcurrencyProbe(delay=0.001), max_workers=4, per_host_limit=2, host_check=host_check)
+
+    engine.run([(f'10.0.{i // 250}.{i % 250}', 80) for i in range(500)])
+
+    assert engine._host_slots == {}
@@ -0,0 +1,115 @@
+from utils.probe_scheduler import ProbeScheduler
+
+
+def _scheduler(**kwargs):
+    kwargs.setdefault('jitter', 0)
+    return ProbeScheduler(base_interval=300, min_interval=60, max_interval=3600, **kwargs)
+
+
+def _started(favorites):
+    """初回のチェックを済ませた時刻 300 のスケジューラーを返す"""
+    scheduler = _scheduler()
+    scheduler.sync(favorites, now=0)
+    assert sorted(scheduler.pop_due(now=300)) == sorted(favorites)
+    return scheduler
+
+
+def test_first_checks_are_spread_over_interval():
+    scheduler = _scheduler()
+    scheduler.sync({f'svc{i}': False for i in range(1000)}, now=0)
+
+    counts = [len(scheduler.pop_due(now=t)) for t in range(30, 301, 30)]
+
+    # 起動直後に一斉にチェックせず、チェック間隔の全体に散らばる
+    assert sum(counts) == 1000
+    assert all(50 < count < 150 for count in counts)
+
+
+def test_keys_added_later_are_spread_too():
+    scheduler = _started({'a': False})
+    scheduler.sync({'a': False, **{f'new{i}': False for i in range(100)}}, now=300)
+
+    assert len(scheduler.pop_due(now=300)) < 10
+    assert len(scheduler.pop_due(now=600)) == 100
+
+
+def test_favorites_are_first_checked_within_their_interval():
+    scheduler = _scheduler()
+    scheduler.sync({'fav': True}, now=0)
+
+    assert scheduler.pop_due(now=150) == ['fav']
+
+
+def test_due_keys_are_popped_once():
+    scheduler = _started({'a': False, 'b': False})
+
+    assert scheduler.pop_due(now=10000) == []
+
+
+def test_report_schedules_next_check():
+    scheduler = _started({'a': False, 'fav': True})
+
+    scheduler.report('a', 'reachable', now=300)
+    scheduler.report('fav', 'reachable', now=300)
+
+    assert scheduler.pop_due(now=449) == []
+    assert scheduler.pop_due(now=450) == ['fav']
+    assert scheduler.pop_due(now=600) == ['a']
+
+
+def test_status_change_rechecks_after_min_interval():
+    scheduler = _started({'a': False})
+    scheduler.report('a', 'reachable', now=300)
+    scheduler.pop_due(now=600)
+
+    scheduler.report('a', 'unreachable', now=600)
+
+    assert scheduler.pop_due(now=660) == ['a']
+
+
+def test_unreachable_backs_off_up_to_max_interval():
+    scheduler = _started({'a': False})
+    now = 300
+    intervals = []
+    for _ in range(8):
+        scheduler.report('a', 'unreachable', now=now)
+        interval = scheduler.seconds_until_next(now=now)
+        intervals.append(interval)
+        now += interval
+        assert scheduler.pop_due(now=now) == ['a']
+
+    assert intervals[:4] == [300, 600, 1200, 2400]
+    assert intervals[-1] == 3600
+
+
+def test_popped_keys_are_not_lost_without_report():
+    scheduler = _scheduler()
+    scheduler.sync({'a': False, 'b': False}, now=0)
+    keys = scheduler.pop_due(now=300)
+    scheduler.report('a', 'reachable', now=300)
+
+    # チェックが例外で中断した場合でも、報告のないキーを入れ直せば再びチェックされる
+    scheduler.defer(keys, now=300)
+
+    assert scheduler.pop_due(now=360) == ['b']
+    assert scheduler.pop_due(now=600) == ['a']
+
+
+def test_sync_drops_removed_keys():
+    scheduler = _scheduler()
+    scheduler.sync({'a': False, 'b': False}, now=0)
+
+    scheduler.sync({'b': False}, now=0)
+
+    assert scheduler.pop_due(now=300) == ['b']
+    scheduler.report('a', 'reachable', now=300)
+    assert scheduler.seconds_until_next(now=300) is None
+
+
+def test_becoming_favorite_brings_check_forward():
+    scheduler = _started({'a': False})
+    scheduler.report('a', 'reachable', now=300)
+
+    scheduler.sync({'a': True}, now=300)
+
+    assert scheduler.pop_due(now=450) == ['a']
@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import app as ipmanager
+from utils.profiling import RequestProfiler, SamplingProfiler
+
+
+def _client(profiler, delay=0.0):
+    app = Flask(__name__)
+    profiler.init_app(app)
+
+    @app.route('/work')
+    def work():
+        with profiler.phase('load'):
+            time.sleep(delay)
+        with profiler.phase('save'):
+            pass
+        # 同じ名前の区間は合算される
+        with profiler.phase('load'):
+            pass
+        return 'ok'
+
+    return app.test_client()
+
+
+def _timings(response):
+    entries = [entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', ')]
+    return {name: float(duration) for name, duration in entries}
+
+
+def test_disabled_profiler_adds_nothing(tmp_path, capsys):
+    log = tmp_path / 'slow.log'
+    profiler = RequestProfiler(enabled=False, slow_threshold_ms=0, slow_log=str(log))
+
+    response = _client(profiler).get('/work')
+
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+    assert not log.exists()
+    assert capsys.readouterr().err == ''
+
+
+def test_phase_outside_request_is_a_no_op():
+    with RequestProfiler(enabled=True).phase('load'):
+        pass
+
+
+def test_server_timing_lists_phases_and_total():
+    profiler = RequestProfiler(enabled=True, slow_threshold_ms=10000)
+
+    timings = _timings(_client(profiler, delay=0.02).get('/work'))
+
+    assert list(timings) == ['load', 'save', 'total']
+    assert timings['load'] >= 20
+    assert timings['total'] >= timings['load'] + timings['save']
+
+
+def test_slow_request_is_logged_above_threshold(tmp_path):
+    log = tmp_path / 'slow.log'
+    profiler = RequestProfiler(enabled=True, slow_threshold_ms=10, slow_log=str(log))
+    client = _client(profiler, delay=0.02)
+
+    client.get('/work?x=1')
+    record = json.loads(log.read_text())
+    assert record['method'] == 'GET' and record['path'] == '/work?x=1' and record['status'] == 200
+    assert record['total_ms'] >= 10 and set(record['phases_ms']) == {'load', 'save'}
+
+    # しきい値未満のリクエストは記録しない
+    _client(profiler, delay=0).get('/work')
+    assert len(log.read_text().splitlines()) == 1
+
+
+def test_slow_request_goes_to_stderr_without_log_file(capsys):
+    profiler = RequestProfiler(enabled=True, slow_threshold_ms=0)
+
+    _client(profiler).get('/work')
+
+    assert capsys.readouterr().err.startswith('[slow request] {')
+
+
+def _busy_marker(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sampler_collects_stacks_and_stops():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_marker, args=(stop,), name='busy-worker')
+    worker.start()
+    sampler = SamplingProfiler(interval=0.001)
+    try:
+        assert sampler.start()
+        assert not sampler.start()
+        assert sampler.running
+        time.sleep(0.05)
+        collapsed = sampler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    assert not sampler.running
+    assert 'sampling-profiler' not in [thread.name for thread in threading.enumerate()]
+    lines = [line.rsplit(' ', 1) for line in collapsed.splitlines()]
+    assert all(count.isdigit() for _, count in lines)
+    assert any(stack.startswith('busy-worker;') and 'test_profiling.py:_busy_marker' in stack for stack, _ in lines)
+    # 止めた後は採取しない
+    assert sampler.collapsed() == collapsed
+    assert sampler.stop() == collapsed
+
+
+def test_sampler_can_restart():
+    sampler = SamplingProfiler(interval=0.001)
+    sampler.start()
+    sampler.stop()
+
+    assert sampler.start()
+    assert sampler.stop() is not None
+    assert not sampler.running
+
+
+@pytest.mark.parametrize('path', ['/debug/profiler/start', '/debug/profiler/stop'])
+def test_debug_endpoints_require_profiling(path):
+    # テストでは IPMANAGER_PROFILING を設定していない
+    assert not ipmanager.PROFILING_ENABLED
+    assert ipmanager.app.test_client().post(path).status_code == 404
+    assert 'Server-Timing' not in ipmanager.app.test_client().get('/changes').headers
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from utils import search_index
+from utils.search_index import SearchIndex
+
+
+def _index():
+    # app.py の検索と同じ項目を索引に入れる
+    return SearchIndex(
+        text_func=lambda svc: [svc['service_name']] if svc['service_name'] else [],
+        address_func=lambda svc: [svc['ip_address']] if svc['ip_address'] else [],
+        exact_func=lambda svc: [str(svc['port'])] if svc['port'] is not None else []
+    )
+
+
+def _scan(services, query):
+    """索引を使わない検索（全件を走査して一致を確かめる）"""
+    return [
+        svc['id'] for svc in services
+        if (svc['service_name'] and query.lower() in svc['service_name'].lower())
+        or (svc['ip_address'] and query in svc['ip_address'])
+        or (svc['port'] is not None and query == str(svc['port']))
+    ]
+
+
+def _services(rng, count):
+    names = ['Web', 'web-api', 'DB', 'Grafana', 'grafana-agent', 'NAS', 'プリンター', '', 'mail']
+    return [
+        {
+            'id': i + 1,
+            'service_name': rng.choice(names) + rng.choice(['', '-1', '-2', ' dev']),
+            'ip_address': rng.choice([f'192.168.{rng.randint(0, 3)}.{rng.randint(1, 30)}', f'10.0.0.{rng.randint(1, 9)}', '']),
+            'port': rng.choice([22, 80, 443, 8080, None]),
+        }
+        for i in range(count)
+    ]
+
+
+QUERIES = ['w', 'WEB', 'eb-a', 'grafana-ag', 'プリ', 'dev', '192.168.1', '.1', '10.0', '80', '8080', '443', 'zzz', '-']
+
+
+@pytest.mark.parametrize('count', [10, 200])
+def test_search_matches_full_scan(count):
+    services = _services(random.Random(count), count)
+    index = _index()
+    index.sync(services, services)
+
+    for query in QUERIES:
+        assert index.search(query) == _scan(services, query), query
+
+
+def test_incremental_sync_matches_full_scan(monkeypatch):
+    rng = random.Random(1)
+    services = _services(rng, 100)
+    index = _index()
+    index.sync(services, services)
+    # 差分更新（接尾辞の個別挿入・削除）の経路を通す
+    monkeypatch.setattr(search_index, 'BULK_THRESHOLD', 1000)
+
+    for _ in range(5):
+        services = [dict(svc) for svc in services]
+        for svc in rng.sample(services, 10):
+            svc['service_name'] = rng.choice(['renamed', 'Web-new', ''])
+            svc['ip_address'] = f'172.16.0.{rng.randint(1, 50)}'
+        del services[rng.randrange(len(services))]
+        services.extend(_services(rng, 3))
+        for number, svc in enumerate(services, 1):
+            svc['id'] = number
+        index.sync(services, services)
+
+        for query in QUERIES + ['renamed', '172.16', 'new']:
+            assert index.search(query) == _scan(services, query), query
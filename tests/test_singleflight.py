@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('svc', work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('svc', work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [('result', False)] + [('result', True)] * 3
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight()
+    counter = iter(range(10))
+
+    assert flight.do('svc', lambda: next(counter)) == (0, False)
+    assert flight.do('svc', lambda: next(counter)) == (1, False)
+
+
+def test_error_is_raised_and_key_released():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError('probe failed')
+
+    with pytest.raises(RuntimeError):
+        flight.do('svc', fail)
+    assert flight.do('svc', lambda: 'ok') == ('ok', False)
@@ -0,0 +1,157 @@
+import json
+
+import pytest
+
+from utils.store import DataStore, JSONFileBackend
+
+
+def _default():
+    return {'services': [
+        {'id': 1, 'service_name': 'web', 'ip_address': '10.0.0.1', 'port': 80, 'status': 'unknown'},
+        {'id': 2, 'service_name': 'db', 'ip_address': '10.0.0.2', 'port': 5432, 'status': 'unknown'},
+    ]}
+
+
+def _store(path, **kwargs):
+    return DataStore(JSONFileBackend(str(path), **kwargs), default=_default, track_changes=True)
+
+
+def _status_update(record_id, status, name):
+    return {'id': record_id, 'match': {'service_name': name}, 'fields': {'status': status}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'data.json'
+    _store(path).save(_default())
+    return path
+
+
+def test_journal_is_replayed_by_other_processes(path):
+    writer, reader = _store(path), _store(path)
+    reader.snapshot()
+
+    writer.record_updates([_status_update(1, 'reachable', 'web')])
+
+    data = reader.snapshot()
+    assert data['services'][0]['status'] == 'reachable'
+    # 2回目以降はスナップショット全体を読み直さず、ジャーナルの差分だけを適用する
+    assert reader.stats()['journal_replays'] == 1
+    assert reader.stats()['reloads'] == 1
+
+
+def test_fresh_load_replays_journal_on_top_of_snapshot(path):
+    _store(path).record_updates([_status_update(2, 'unreachable', 'db')])
+
+    data = _store(path).snapshot()
+    assert [svc['status'] for svc in data['services']] == ['unknown', 'unreachable']
+
+
+def test_update_is_skipped_when_match_no_longer_holds(path):
+    store = _store(path)
+    working = store.load()
+    working['services'][0]['service_name'] = 'renamed'
+    store.save(working)
+
+    store.record_updates([_status_update(1, 'reachable', 'web')])
+
+    assert store.snapshot()['services'][0]['status'] == 'unknown'
+
+
+def test_stale_journal_generation_is_ignored(path):
+    store = _store(path)
+    store.record_updates([_status_update(1, 'reachable', 'web')])
+    journal = path.parent / 'data.json.journal'
+    lines = journal.read_text().splitlines()
+    # スナップショットより古い世代のジャーナル（切り替え前に中断した場合）は再生しない
+    lines[0] = json.dumps({'generation': 0})
+    journal.write_text('\n'.join(lines) + '\n')
+
+    assert _store(path).snapshot()['services'][0]['status'] == 'unknown'
+
+
+def test_compaction_folds_journal_into_snapshot(path):
+    store = _store(path, compact_bytes=1)
+    assert store.backend.append([_status_update(1, 'reachable', 'web')])
+
+    store.compact()
+
+    snapshot = json.loads(path.read_text())
+    assert snapshot['services'][0]['status'] == 'reachable'
+    journal = (path.parent / 'data.json.journal').read_text().splitlines()
+    assert journal == [json.dumps({'generation': snapshot['journal_generation']})]
+    assert _store(path).snapshot()['services'][0]['status'] == 'reachable'
+
+
+def test_appends_after_compaction_are_not_lost(path):
+    store = _store(path)
+    store.record_updates([_status_update(1, 'reachable', 'web')])
+    store.compact()
+    store.record_updates([_status_update(2, 'reachable', 'db')])
+
+    data = _store(path).snapshot()
+    assert [svc['status'] for svc in data['services']] == ['reachable', 'reachable']
+
+
+def test_save_keeps_updates_journaled_after_load(path):
+    store, checker = _store(path), _store(path)
+    working = store.load()
+    working['services'][1]['port'] = 5433
+
+    checker.record_updates([_status_update(1, 'reachable', 'web'), _status_update(2, 'reachable', 'db')])
+    store.save(working)
+
+    data = _store(path).snapshot()
+    assert [svc['status'] for svc in data['services']] == ['reachable', 'reachable']
+    assert data['services'][1]['port'] == 5433
+
+
+def test_save_prefers_fields_changed_in_working_copy(path):
+    store, checker = _store(path), _store(path)
+    working = store.load()
+    working['services'][0]['status'] = 'unknown'
+    working['services'][0]['ip_address'] = '10.0.0.9'
+
+    checker.record_updates([{'id': 1, 'fields': {'ip_address': '10.0.0.8', 'status': 'reachable'}}])
+    store.save(working)
+
+    rec = _store(path).snapshot()['services'][0]
+    assert rec['ip_address'] == '10.0.0.9'
+    assert rec['status'] == 'reachable'
+
+
+def test_changes_since_reports_updates_and_deletions(path):
+    store = _store(path)
+    seq = store.change_seq()
+    working = store.load()
+    deleted = working['services'].pop(1)['uid']
+    working['services'][0]['port'] = 8080
+    store.save(working)
+
+    changes = store.changes_since(seq)
+    assert not changes['full']
+    assert [rec['port'] for rec in changes['records']] == [8080]
+    assert changes['deleted'] == [deleted]
+    assert store.changes_since(None)['full']
+
+
+def test_unchanged_file_is_served_from_cache(path):
+    store = _store(path)
+    first = store.snapshot()
+
+    assert store.snapshot() is first
+    assert store.stats()['hits'] == 1
+    assert store.stats()['misses'] == 1
+
+
+def test_save_by_another_process_invalidates_cache(path):
+    writer, reader = _store(path), _store(path)
+    reader.snapshot()
+
+    working = writer.load()
+    working['services'][1]['service_name'] = 'renamed'
+    writer.save(working)
+
+    assert reader.snapshot()['services'][1]['service_name'] == 'renamed'
+    assert reader.stats()['misses'] == 2
+    assert reader.stats()['reloads'] == 2
@@ -0,0 +1,95 @@
+import fcntl
+import ipaddress
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AgentRegistry:
+    """プローブエージェントの登録と死活（ハートビート）の管理
+
+    Gunicornのワーカー（APIの受け付け）とチェッカーのプロセス（自動チェック）で同じ情報を使うため、
+    登録内容はJSONファイルに保存し、読み込みは更新時刻が変わった時だけ行う。
+    ttl 秒以上ハートビートのないエージェントは離脱したものとして扱う。
+    """
+
+    def __init__(self, path, ttl=60):
+        self.path = path
+        self.ttl = ttl
+        self._cache = None
+        self._cache_mtime = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, agents):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.agents-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(agents, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def heartbeat(self, name, networks=(), info=None):
+        """エージェントを登録（または生存を更新）し、登録内容を返す"""
+        now = time.time()
+        with self._locked():
+            agents = self._read()
+            agent = agents.get(name) or {'name': name, 'joined_at': now}
+            agent.update(networks=list(networks), info=info or {}, last_seen=now)
+            agents[name] = agent
+            # 期限切れのエージェントはここで掃除する
+            agents = {n: a for n, a in agents.items() if now - a['last_seen'] <= self.ttl}
+            self._write(agents)
+        return agent
+
+    def remove(self, name):
+        with self._locked():
+            agents = self._read()
+            if agents.pop(name, None) is None:
+                return False
+            self._write(agents)
+        return True
+
+    def live(self):
+        """生存中のエージェントを {名前: 登録内容} で返す"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._cache_mtime:
+                self._cache = self._read()
+                self._cache_mtime = mtime
+            agents = self._cache
+        now = time.time()
+        return {name: agent for name, agent in agents.items() if now - agent['last_seen'] <= self.ttl}
+
+
+def parse_networks(values):
+    """CIDRの一覧を IPv4Network のタプルにする（不正な値はValueError）"""
+    return tuple(ipaddress.IPv4Network(value, strict=False) for value in values if str(value).strip())
+
+
+def can_reach(networks, ip_address):
+    """networks が空なら全て、そうでなければいずれかのネットワークに含まれるIPだけを担当できる"""
+    if not networks:
+        return True
+    try:
+        address = ipaddress.IPv4Address(ip_address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
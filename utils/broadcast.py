@@ -0,0 +1,85 @@
+import os
+import queue
+import threading
+
+
+class ChangeBroadcaster:
+    """データストアの変更を監視し、購読中の全クライアントへ差分を配信する
+
+    監視スレッドはプロセス（Gunicornのワーカー）ごとに1本だけ動き、変更があれば
+    changes_since() を一度だけ呼んで全購読者のキューに配る。閲覧者が増えても
+    データの読み込みは増えない。他プロセスでの変更は poll_interval ごとに検知し、
+    同じプロセス内の変更は notify() で即座に配信する。
+    """
+
+    def __init__(self, store, transform=None, poll_interval=1.0, queue_size=100):
+        self.store = store
+        self.transform = transform or (lambda changes: changes)
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._seq = None
+
+    def _ensure_started(self):
+        # fork後のワーカーでは親のスレッドが引き継がれないので、プロセスごとに起動する
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._seq = self.store.change_seq()
+        threading.Thread(target=self._run, name='change-broadcaster', daemon=True).start()
+
+    def subscribe(self):
+        """配信を受け取るキューを登録する（キューが溢れた購読者にはNoneが届く）"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._ensure_started()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def notify(self):
+        """このプロセスでデータを変更したことを知らせ、次の確認を待たずに配信させる"""
+        self._wakeup.set()
+
+    def _run(self):
+        version = None
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                _, current = self.store.versioned_snapshot()
+                if current == version:
+                    continue
+                version = current
+                with self._lock:
+                    if not self._subscribers:
+                        # 購読者がいない間は位置だけ進める（新しい購読者は自分で差分を取り直す）
+                        self._seq = self.store.change_seq()
+                        continue
+                changes = self.store.changes_since(self._seq)
+                if changes['seq'] == self._seq and not changes['full']:
+                    continue
+                self._seq = changes['seq']
+                self._publish(self.transform(changes))
+            except Exception:
+                # 読み込みの失敗で配信スレッドを止めない（次の周期で再試行）
+                version = None
+
+    def _publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # 読み出しが追いつかない購読者は切断し、再接続時に差分を取り直させる
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
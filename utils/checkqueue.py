@@ -0,0 +1,142 @@
+import fcntl
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+
+class InstanceLock:
+    """flockによる単一インスタンスのロック（プロセスが終了すれば自動的に外れる）
+
+    他のプロセスからの確認（is_held）は共有ロックを一瞬だけ取って行う。確認と重なった
+    acquire() が失敗しないよう、acquire() は retry_seconds の間取り直す。
+    """
+
+    def __init__(self, path, retry_seconds=1.0):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self._file = None
+        self._pid = None
+
+    def acquire(self):
+        """ロックを取れればTrue（他のプロセスが保持していればFalse）"""
+        if self._owned():
+            return True
+        lock_file = open(self.path, 'a+')
+        deadline = time.monotonic() + self.retry_seconds
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                # is_held() の確認と重なっただけなら、すぐに取れるようになる
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    return False
+                time.sleep(0.05)
+        # 保持しているプロセスが分かるようにPIDを書いておく（表示用。判定には使わない）
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f'{os.getpid()}\n')
+        lock_file.flush()
+        self._file = lock_file
+        self._pid = os.getpid()
+        return True
+
+    def _owned(self):
+        # fork先（Gunicornのワーカー）では親が取ったロックを自分のものとして扱わない
+        return self._file is not None and self._pid == os.getpid()
+
+    def release(self):
+        if not self._owned():
+            return
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def is_held(self):
+        """いずれかのプロセス（自分を含む）がロックを保持しているか
+
+        ファイルに残ったPIDではなくロックの状態で判断するので、強制終了したチェッカーの
+        PIDが別のプロセスに使い回されても保持中と誤認しない。
+        """
+        if self._owned():
+            return True
+        try:
+            with open(self.path, 'a+') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        return False
+
+
+class CheckQueue:
+    """Webワーカーからチェッカーへの「今すぐチェック」の依頼キュー
+
+    依頼は1件ずつディレクトリ内のファイルとして置く（作成は一時ファイルからのリネームで原子的に行う）。
+    チェッカーは drain() で古い順に取り出す。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def put(self, kind, **fields):
+        os.makedirs(self.directory, exist_ok=True)
+        request = {'kind': kind, 'requested_at': time.time(), **fields}
+        name = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json'
+        fd, tmp_path = tempfile.mkstemp(prefix='.check-', dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(request, f)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        return request
+
+    def drain(self):
+        """溜まっている依頼をすべて取り出す（読めないファイルは捨てる）"""
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.endswith('.json'))
+        except FileNotFoundError:
+            return []
+        requests = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    requests.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return requests
+
+    def __len__(self):
+        try:
+            return sum(1 for n in os.listdir(self.directory) if n.endswith('.json'))
+        except FileNotFoundError:
+            return 0
+
+
+def spawn_checker(script, args=('--wait',)):
+    """チェッカー（checker.py）を子プロセスとして起動する
+
+    Gunicornのマスターはワーカーをforkするので、マスターの中でチェックのスレッドを動かさず、
+    別のインタープリターとして起動する。
+    """
+    return subprocess.Popen([sys.executable, script, *args], cwd=os.path.dirname(os.path.abspath(script)))
+
+
+def stop_checker(process, timeout=30):
+    """SIGTERMで停止を求め（実行中の結果を書き出してから終了する）、応じなければ強制終了する"""
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+class HostCircuitBreaker:
+    """ホスト単位のサーキットブレーカー
+
+    ホストが落ちていると分かったら回路を開き、cooldown 秒の間はそのホストのサービスを
+    プローブせずに到達不可とする。時間が来たら1回だけ確認を通し（半開）、成功すれば閉じ、
+    失敗すれば間隔を倍にして（max_cooldown まで）開き直す。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, cooldown=30, max_cooldown=600, on_change=None):
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # 状態が変わるたびに on_change(開いているホスト数) を呼ぶ（メトリクス用）
+        self.on_change = on_change
+        self._hosts = {}    # ホスト -> {'state', 'retry_at', 'cooldown'}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """ホストを確認してよいか（開いている間はFalse。時間が来たら半開として1回だけTrue）"""
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                return True
+            if entry['state'] == self.OPEN and time.monotonic() >= entry['retry_at']:
+                entry['state'] = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self, host):
+        with self._lock:
+            changed = self._hosts.pop(host, None) is not None
+        if changed:
+            self._changed()
+
+    def failure(self, host):
+        with self._lock:
+            entry = self._hosts.get(host)
+            cooldown = self.cooldown if entry is None else min(entry['cooldown'] * 2, self.max_cooldown)
+            self._hosts[host] = {'state': self.OPEN, 'retry_at': time.monotonic() + cooldown, 'cooldown': cooldown}
+        self._changed()
+
+    def state(self, host):
+        with self._lock:
+            entry = self._hosts.get(host)
+            return self.CLOSED if entry is None else entry['state']
+
+    def open_hosts(self):
+        with self._lock:
+            return len(self._hosts)
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.open_hosts())
@@ -0,0 +1,386 @@
+import errno
+import json
+import os
+import re
+import resource
+import selectors
+import socket
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+# よく使われるポートの (サービス名, プローブ種別)。検出結果の登録時の初期値に使う
+WELL_KNOWN_SERVICES = {
+    22: ('SSH', 'tcp'),
+    80: ('HTTP', 'http'),
+    443: ('HTTPS', 'https'),
+    1883: ('MQTT', 'tcp'),
+    3000: ('Grafana', 'http'),
+    3306: ('MySQL', 'tcp'),
+    5000: ('Web', 'http'),
+    5432: ('PostgreSQL', 'tcp'),
+    6379: ('Redis', 'tcp'),
+    8080: ('Web', 'http'),
+    8123: ('Home Assistant', 'http'),
+    8443: ('HTTPS', 'https'),
+    9000: ('Web', 'http'),
+    9090: ('Prometheus', 'http'),
+    32400: ('Plex', 'http'),
+}
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+_JOB_ID = re.compile(r'^[0-9a-f]{12}$')
+
+
+def suggest_service(ip_address, port):
+    """検出したポートの登録用の (サービス名, プローブ種別) を返す"""
+    name, probe_type = WELL_KNOWN_SERVICES.get(port, (f'Port {port}', 'tcp'))
+    return f'{name} {ip_address}', probe_type
+
+
+def _fd_budget(requested):
+    """開けるファイルディスクリプタの上限に収まる同時接続数を返す"""
+    try:
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (OSError, ValueError):
+        return requested
+    if soft == resource.RLIM_INFINITY:
+        return requested
+    # Webサーバーのソケットやデータファイルの分を残す
+    return max(1, min(requested, soft // 2))
+
+
+class PortScanner:
+    """ノンブロッキングconnectを多数同時に進めるTCPポートスキャナー
+
+    1本のスレッドでselectorを使い、max_concurrency 本までの接続を同時に待つ。
+    同一ホストへの同時接続は per_host_limit 本まで、接続の開始は毎秒 rate 回までに抑える。
+    """
+
+    def __init__(self, timeout=1.0, max_concurrency=256, per_host_limit=16, rate=2000):
+        self.timeout = timeout
+        self.max_concurrency = _fd_budget(max_concurrency)
+        self.per_host_limit = per_host_limit
+        self.rate = rate
+
+    @staticmethod
+    def _targets(hosts, ports):
+        # ポートごとに全ホストを回り、同じホストへの接続が連続しないようにする
+        return deque((host, port) for port in ports for host in hosts)
+
+    def scan(self, hosts, ports, progress=None, cancelled=None):
+        """開いているポートの (ホスト, ポート, 接続時間ms) を見つかった順に返すジェネレータ
+
+        progress(完了数) は接続が終わるたびに呼ぶ。cancelled() がTrueを返したら打ち切る。
+        """
+        pending = self._targets(hosts, ports)
+        selector = selectors.DefaultSelector()
+        inflight = OrderedDict()    # ソケット -> (ホスト, ポート, 開始時刻)。開始順に並ぶ
+        per_host = {}
+        tokens = float(min(self.rate, self.max_concurrency))
+        refilled = time.perf_counter()
+        finished = 0
+
+        def complete():
+            nonlocal finished
+            finished += 1
+            if progress is not None:
+                progress(finished)
+
+        def release(sock, host):
+            selector.unregister(sock)
+            del inflight[sock]
+            per_host[host] -= 1
+            complete()
+
+        try:
+            while pending or inflight:
+                if cancelled is not None and cancelled():
+                    return
+
+                now = time.perf_counter()
+                tokens = min(float(self.rate), tokens + (now - refilled) * self.rate)
+                refilled = now
+
+                # 空きがある分だけ接続を開始する（上限に達したホストの分は後回し）
+                deferred = []
+                while pending and len(inflight) < self.max_concurrency and tokens >= 1:
+                    host, port = pending.popleft()
+                    if per_host.get(host, 0) >= self.per_host_limit:
+                        deferred.append((host, port))
+                        if len(deferred) >= self.max_concurrency:
+                            break
+                        continue
+                    try:
+                        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    except OSError:
+                        # ディスクリプタ不足。実行中の接続が終わるのを待つ
+                        deferred.append((host, port))
+                        break
+                    tokens -= 1
+                    sock.setblocking(False)
+                    err = sock.connect_ex((host, port))
+                    if err in _IN_PROGRESS:
+                        inflight[sock] = (host, port, now)
+                        per_host[host] = per_host.get(host, 0) + 1
+                        selector.register(sock, selectors.EVENT_WRITE)
+                        continue
+                    # ループバックなどでは即座に結果が出る
+                    complete()
+                    self._close(sock, connected=err == 0)
+                    if err == 0:
+                        yield host, port, (time.perf_counter() - now) * 1000
+                pending.extendleft(reversed(deferred))
+
+                if not inflight:
+                    if pending:
+                        time.sleep(max((1 - tokens) / self.rate, 0.001))
+                    continue
+
+                # 最も古い接続のタイムアウトと、次の接続を開始できる時刻の早い方まで待つ
+                oldest = next(iter(inflight.values()))[2]
+                wait = max(oldest + self.timeout - time.perf_counter(), 0)
+                if pending and tokens < 1:
+                    wait = min(wait, (1 - tokens) / self.rate)
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj
+                    host, port, started = inflight[sock]
+                    release(sock, host)
+                    # 接続の成否はSO_ERRORで確認する（拒否された場合もwritableになる）
+                    connected = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                    self._close(sock, connected)
+                    if connected:
+                        yield host, port, (time.perf_counter() - started) * 1000
+
+                # 応答のない接続（フィルタされたポート・存在しないホスト）を打ち切る
+                deadline = time.perf_counter() - self.timeout
+                expired = []
+                for sock, (host, _, started) in inflight.items():
+                    if started > deadline:
+                        break
+                    expired.append((sock, host))
+                for sock, host in expired:
+                    release(sock, host)
+                    self._close(sock, connected=False)
+        finally:
+            for sock in list(inflight):
+                selector.unregister(sock)
+                sock.close()
+            selector.close()
+
+    @staticmethod
+    def _close(sock, connected):
+        if connected:
+            # 相手のサービスに中途半端な接続を残さないようRSTで閉じる
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            except OSError:
+                pass
+        sock.close()
+
+
+class DiscoveryJob:
+    """バックグラウンドで実行する1回分の検出
+
+    on_update(job) を指定すると、実行中は最大 UPDATE_SECONDS ごとと終了時に呼ぶ。
+    """
+
+    UPDATE_SECONDS = 0.5
+
+    def __init__(self, hosts, ports, label, on_update=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.hosts = hosts
+        self.ports = ports
+        self.total = len(hosts) * len(ports)
+        self.done = 0
+        self.found = []
+        self.state = 'running'     # 'running', 'done', 'cancelled', 'error'
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._on_update = on_update
+        self._updated = 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self, scanner):
+        try:
+            for host, port, latency in scanner.scan(self.hosts, self.ports, self._progress, self._cancelled):
+                with self._lock:
+                    self.found.append({'ip_address': host, 'port': port, 'latency': round(latency, 2)})
+            state = 'cancelled' if self._cancel.is_set() else 'done'
+        except Exception as e:
+            state, self.error = 'error', str(e)
+        with self._lock:
+            self.state = state
+            self.finished_at = time.time()
+        self._update(final=True)
+
+    def _cancelled(self):
+        # スキャナーはループのたびに呼ぶので、ここで途中経過を知らせる
+        self._update()
+        return self._cancel.is_set()
+
+    def _update(self, final=False):
+        if self._on_update is None:
+            return
+        now = time.monotonic()
+        if not final and now - self._updated < self.UPDATE_SECONDS:
+            return
+        self._updated = now
+        self._on_update(self)
+
+    def _progress(self, done):
+        self.done = done
+
+    def to_dict(self):
+        with self._lock:
+            found = sorted(self.found, key=lambda f: (socket.inet_aton(f['ip_address']), f['port']))
+            finished_at = self.finished_at
+            state = self.state
+        end = finished_at or time.time()
+        return {
+            'id': self.id,
+            'label': self.label,
+            'state': state,
+            'error': self.error,
+            'hosts': len(self.hosts),
+            'ports': self.ports,
+            'total': self.total,
+            'done': self.done,
+            'elapsed': round(end - self.started_at, 2),
+            'found': found
+        }
+
+
+class StoredDiscoveryJob:
+    """別のプロセスが実行している（または実行した）ジョブ。保存された状態を返す"""
+
+    def __init__(self, jobs, state):
+        self._jobs = jobs
+        self._state = state
+        self.id = state['id']
+        self.state = state['state']
+
+    def cancel(self):
+        self._jobs.request_cancel(self.id)
+
+    def to_dict(self):
+        return {key: value for key, value in self._state.items() if key not in ('started_at', 'updated_at')}
+
+
+class DiscoveryJobs:
+    """検出ジョブの起動と結果の保持（直近 keep 件まで）
+
+    directory を指定すると、ジョブの状態をディレクトリ内のファイルに書き出す（一時ファイルからの
+    リネームで原子的に置き換える）。Gunicornの複数のワーカーのどれがリクエストを受けても、
+    他のワーカーで実行中のジョブの状態を返し、中止の依頼（<id>.cancel）を渡せる。
+    """
+
+    STALE_SECONDS = 10     # 実行中のまま、この秒数更新のないジョブは実行していたプロセスが終了したとみなす
+
+    def __init__(self, scanner, max_running=2, keep=10, directory=None):
+        self.scanner = scanner
+        self.max_running = max_running
+        self.keep = keep
+        self.directory = directory
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, hosts, ports, label=''):
+        """ジョブを開始して返す（同時実行数の上限に達している場合はNone）"""
+        with self._lock:
+            if self.directory is not None:
+                stored = self._stored_states()
+                running = sum(state['state'] == 'running' for state in stored)
+            else:
+                stored = []
+                running = sum(job.state == 'running' for job in self._jobs.values())
+            if running >= self.max_running:
+                return None
+            job = DiscoveryJob(hosts, ports, label, on_update=self._save if self.directory is not None else None)
+            self._jobs[job.id] = job
+            # 古い順に、終了したジョブだけを消す
+            finished = [job_id for job_id, j in self._jobs.items() if j.state != 'running']
+            for job_id in finished[:max(len(self._jobs) - self.keep, 0)]:
+                del self._jobs[job_id]
+            finished = [state['id'] for state in stored if state['state'] != 'running']
+            for job_id in finished[:max(len(stored) + 1 - self.keep, 0)]:
+                self._remove(job_id)
+        if self.directory is not None:
+            self._save(job)
+        threading.Thread(target=job.run, args=(self.scanner,), name=f'discovery-{job.id}', daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        """ジョブを返す（このプロセスのジョブがなければ保存された状態から。見つからなければNone）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.directory is None or not _JOB_ID.match(job_id):
+            return job
+        state = self._load(job_id)
+        return StoredDiscoveryJob(self, state) if state is not None else None
+
+    def request_cancel(self, job_id):
+        """実行しているプロセスに中止を依頼する（次の状態の書き出しの時に確認される）"""
+        if self.directory is None or not _JOB_ID.match(job_id):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(job_id, '.cancel'), 'w'):
+            pass
+
+    def _path(self, job_id, suffix='.json'):
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _save(self, job):
+        state = job.to_dict()
+        state['started_at'] = job.started_at
+        state['updated_at'] = time.time()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.discovery-', dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._path(job.id))
+            if os.path.exists(self._path(job.id, '.cancel')):
+                if state['state'] == 'running':
+                    job.cancel()
+                else:
+                    os.unlink(self._path(job.id, '.cancel'))
+        except OSError:
+            # 書き出せなくても検出は続ける（このプロセスからは状態を返せる）
+            pass
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get('state') == 'running' and time.time() - state.get('updated_at', 0) > self.STALE_SECONDS:
+            state['state'] = 'error'
+            state['error'] = '検出を実行していたプロセスが終了しました。'
+        return state
+
+    def _stored_states(self):
+        """保存されたジョブの状態を開始の古い順に返す"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        states = [self._load(name[:-5]) for name in names if name.endswith('.json') and _JOB_ID.match(name[:-5])]
+        return sorted((state for state in states if state is not None), key=lambda state: state.get('started_at', 0))
+
+    def _remove(self, job_id):
+        for suffix in ('.json', '.cancel'):
+            try:
+                os.unlink(self._path(job_id, suffix))
+            except OSError:
+                pass
@@ -0,0 +1,56 @@
+import bisect
+import hashlib
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(str(value).encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """コンシステントハッシュのリング
+
+    ノードごとに replicas 個の仮想ノードを置き、キーのハッシュから時計回りに最初のノードを選ぶ。
+    ノードの増減で担当が変わるのは、そのノードの前後のキーだけになる。
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._points = []   # (ハッシュ値, ノード) を昇順に並べたもの
+        self._hashes = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            bisect.insort(self._points, (_hash(f'{node}#{i}'), node))
+        self._hashes = [point for point, _ in self._points]
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._points = [(point, n) for point, n in self._points if n != node]
+        self._hashes = [point for point, _ in self._points]
+
+    def node_for(self, key, accept=None):
+        """キーを担当するノードを返す（accept(ノード) がFalseのノードは飛ばす。該当なしはNone）"""
+        if not self._points:
+            return None
+        start = bisect.bisect(self._hashes, _hash(key))
+        if accept is None:
+            return self._points[start % len(self._points)][1]
+        tried = set()
+        for offset in range(len(self._points)):
+            node = self._points[(start + offset) % len(self._points)][1]
+            if node in tried:
+                continue
+            if accept(node):
+                return node
+            tried.add(node)
+            if len(tried) == len(self.nodes):
+                break
+        return None
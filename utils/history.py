@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class LatencyHistory:
+    """サービスごとのレイテンシ履歴（SQLiteに保存し、全プロセスで同じ内容を参照する）
+
+    記録するのはチェッカーのプロセスで、表示するのはWebサーバーのワーカーなので、
+    プロセス内のメモリではなく共有のファイルに持つ（再起動しても履歴が残る）。
+
+    直近 capacity 件のサンプルと、1分・1時間・1日単位の集計（min/avg/max/loss）を持つ。
+    サンプルは (キー, 時刻) で一意なので、同じ結果を二重に記録しても集計は変わらない。
+    書き込みのたびに世代番号を進める（ETagなど、履歴を含む表示のキャッシュのキーに使う）。
+    """
+
+    ROLLUPS = (('1m', 60, 60), ('1h', 3600, 48), ('1d', 86400, 30))
+
+    def __init__(self, path, capacity=120):
+        self.path = path
+        self.capacity = capacity
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # fork後のプロセスでは親の接続を使い回さない
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS samples ('
+            'key TEXT NOT NULL, ts REAL NOT NULL, latency REAL, PRIMARY KEY (key, ts)) WITHOUT ROWID'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rollups ('
+            'key TEXT NOT NULL, name TEXT NOT NULL, start REAL NOT NULL, count INTEGER NOT NULL, '
+            'lost INTEGER NOT NULL, sum REAL NOT NULL, min REAL, max REAL, '
+            'PRIMARY KEY (key, name, start)) WITHOUT ROWID'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+
+    @contextmanager
+    def _writing(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        changes = conn.total_changes
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        # 何も変わらなかった場合は世代を進めない（表示のキャッシュを無駄に捨てない）
+        if conn.total_changes != changes:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        conn.execute('COMMIT')
+
+    def record_many(self, samples):
+        """(キー, 時刻, レイテンシ or None) の列をまとめて記録する（到達不可はNone）
+
+        文の数がサンプル数に比例しないよう、集計の更新と古い行の削除はまとめて行う。
+        """
+        samples = list(samples)
+        if not samples:
+            return
+        with self._writing() as conn:
+            existing = set(conn.execute(
+                'SELECT samples.key, samples.ts FROM samples JOIN json_each(?) AS j '
+                "ON samples.key = json_extract(j.value, '$[0]') AND samples.ts = json_extract(j.value, '$[1]')",
+                (json.dumps([[key, ts] for key, ts, _ in samples]),)
+            ))
+            added = {}
+            for key, ts, latency in samples:
+                if (key, ts) not in existing:
+                    added.setdefault((key, ts), latency)
+            if not added:
+                return
+            conn.executemany(
+                'INSERT INTO samples (key, ts, latency) VALUES (?, ?, ?)',
+                ((key, ts, latency) for (key, ts), latency in added.items())
+            )
+
+            buckets = {}
+            for (key, ts), latency in added.items():
+                for name, width, _ in self.ROLLUPS:
+                    bucket = buckets.setdefault((key, name, (ts // width) * width), [0, 0, 0.0, None, None])
+                    bucket[0] += 1
+                    if latency is None:
+                        bucket[1] += 1
+                        continue
+                    bucket[2] += latency
+                    bucket[3] = latency if bucket[3] is None else min(bucket[3], latency)
+                    bucket[4] = latency if bucket[4] is None else max(bucket[4], latency)
+            conn.executemany(
+                'INSERT INTO rollups (key, name, start, count, lost, sum, min, max) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (key, name, start) DO UPDATE SET '
+                'count = count + excluded.count, lost = lost + excluded.lost, sum = sum + excluded.sum, '
+                'min = CASE WHEN min IS NULL THEN excluded.min WHEN excluded.min IS NULL THEN min '
+                'ELSE MIN(min, excluded.min) END, '
+                'max = CASE WHEN max IS NULL THEN excluded.max WHEN excluded.max IS NULL THEN max '
+                'ELSE MAX(max, excluded.max) END',
+                (bucket_key + tuple(values) for bucket_key, values in buckets.items())
+            )
+
+            # 直近 capacity 件より古いサンプルと、保持期間を過ぎた集計を捨てる
+            touched = json.dumps(sorted({key for key, _ in added}))
+            conn.execute(
+                'DELETE FROM samples WHERE key IN (SELECT value FROM json_each(?)) AND ts < ('
+                'SELECT s.ts FROM samples AS s WHERE s.key = samples.key ORDER BY s.ts DESC LIMIT 1 OFFSET ?)',
+                (touched, self.capacity - 1)
+            )
+            newest = max(ts for _, ts in added)
+            conn.execute(
+                'DELETE FROM rollups WHERE key IN (SELECT value FROM json_each(?)) AND ('
+                + ' OR '.join('(name = ? AND start < ?)' for _ in self.ROLLUPS) + ')',
+                (touched, *(value for name, width, slots in self.ROLLUPS
+                            for value in (name, self._oldest(newest, width, slots))))
+            )
+
+    def record(self, key, ts, latency):
+        self.record_many([(key, ts, latency)])
+
+    def forget(self, keys):
+        """削除されたサービスの履歴を捨てる"""
+        keys = json.dumps(sorted(set(keys)))
+        if keys == '[]':
+            return
+        with self._writing() as conn:
+            conn.execute('DELETE FROM samples WHERE key IN (SELECT value FROM json_each(?))', (keys,))
+            conn.execute('DELETE FROM rollups WHERE key IN (SELECT value FROM json_each(?))', (keys,))
+
+    def generation(self):
+        """書き込みのたびに増える世代番号"""
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def samples(self, key, limit=None):
+        """直近のサンプルを古い順に (時刻, レイテンシ or None) で返す"""
+        rows = self._connect().execute(
+            'SELECT ts, latency FROM samples WHERE key = ? ORDER BY ts DESC LIMIT ?',
+            (key, self.capacity if limit is None else limit)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def samples_many(self, keys, limit=None):
+        """複数のキーの直近のサンプルを1回の問い合わせで取得し、キー -> [(時刻, レイテンシ or None)] で返す"""
+        history = {}
+        rows = self._connect().execute(
+            'SELECT key, ts, latency FROM ('
+            'SELECT key, ts, latency, ROW_NUMBER() OVER (PARTITION BY key ORDER BY ts DESC) AS rank '
+            'FROM samples WHERE key IN (SELECT value FROM json_each(?))'
+            ') WHERE rank <= ? ORDER BY key, ts',
+            (json.dumps(sorted(set(keys))), self.capacity if limit is None else limit)
+        )
+        for key, ts, latency in rows:
+            history.setdefault(key, []).append((ts, latency))
+        return history
+
+    @staticmethod
+    def _oldest(now, width, slots):
+        return ((now // width) - slots + 1) * width
+
+    def summary(self, key, now):
+        """直近のサンプルと各粒度の集計を辞書で返す"""
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            samples = self.samples(key)
+            rollups = {}
+            for name, width, slots in self.ROLLUPS:
+                rows = conn.execute(
+                    'SELECT start, count, lost, sum, min, max FROM rollups '
+                    'WHERE key = ? AND name = ? AND start >= ? ORDER BY start',
+                    (key, name, self._oldest(now, width, slots))
+                ).fetchall()
+                rollups[name] = [
+                    {
+                        'start': start,
+                        'count': count,
+                        'min': low if count > lost else None,
+                        'avg': total / (count - lost) if count > lost else None,
+                        'max': high if count > lost else None,
+                        'loss': lost / count
+                    }
+                    for start, count, lost, total, low, high in rows
+                ]
+        finally:
+            conn.execute('COMMIT')
+        return {
+            'samples': [{'ts': ts, 'latency': latency} for ts, latency in samples],
+            'rollups': rollups
+        }
+
+
+def sparkline_path(samples, width=60, height=16):
+    """サンプル列からSVGのpath文字列を作る（到達不可の区間は線を切る）"""
+    if not samples:
+        return ''
+    latencies = [latency for _, latency in samples if latency is not None]
+    top = max(latencies) if latencies else 1.0
+    top = top or 1.0
+    step = width / max(len(samples) - 1, 1)
+    commands = []
+    pen_down = False
+    for i, (_, latency) in enumerate(samples):
+        if latency is None:
+            pen_down = False
+            continue
+        x = i * step
+        y = height - 1 - (latency / top) * (height - 2)
+        commands.append(f"{'L' if pen_down else 'M'}{x:.1f} {y:.1f}")
+        pen_down = True
+    return ' '.join(commands)
@@ -0,0 +1,108 @@
+import functools
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+
+class ConditionalResponseCache:
+    """データのバージョンから強いETagを作り、304応答とgzip圧縮を行うビュー用デコレーター
+
+    バージョン文字列が同じ間は、同じURLに対する圧縮済みの本文をメモリ上で使い回す。
+    If-None-Match が一致する場合はビューを呼ばずに304を返す。
+    ビューが設定したヘッダーは本文と一緒に保存して再送する。after_request で付くヘッダー
+    （Server-Timing など）はキャッシュから返した応答にもその都度付く。
+    """
+
+    # 本文・圧縮・キャッシュ制御に関わるヘッダーはキャッシュから返す時に作り直す
+    _OWN_HEADERS = frozenset(('content-type', 'content-length', 'content-encoding', 'etag', 'cache-control', 'vary'))
+
+    def __init__(self, max_entries=32, min_size=512, compress_level=6, salt=''):
+        self.max_entries = max_entries
+        self.min_size = min_size            # これより小さい本文は圧縮しない
+        self.compress_level = compress_level
+        self.salt = salt                    # アプリのバージョンなど、テンプレートの変更でETagを変えるための値
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'not_modified': 0, 'hits': 0, 'misses': 0}
+
+    def make_etag(self, version, path, encoding):
+        raw = f"{self.salt}|{version}|{path}|{encoding}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:24]
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _finish(response, etag):
+        response.set_etag(etag)
+        # ブラウザにも毎回再検証させる（変更がなければ304で済む）
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def conditional(self, version_func):
+        """version_func() がNoneを返すリクエストはキャッシュせずそのままビューを呼ぶ"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                version = version_func()
+                if version is None:
+                    return view(*args, **kwargs)
+
+                encoding = 'gzip' if request.accept_encodings['gzip'] else 'identity'
+                path = request.full_path
+                etag = self.make_etag(version, path, encoding)
+                if request.if_none_match.contains(etag):
+                    self._count('not_modified')
+                    return self._finish(Response(status=304), etag)
+
+                key = (path, version, encoding)
+                entry = self._get(key)
+                if entry is None:
+                    self._count('misses')
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    content_encoding = None
+                    if encoding == 'gzip' and len(body) >= self.min_size:
+                        body = gzip.compress(body, self.compress_level)
+                        content_encoding = 'gzip'
+                    headers = [(name, value) for name, value in response.headers.items()
+                               if name.lower() not in self._OWN_HEADERS]
+                    entry = (body, response.content_type, content_encoding, headers)
+                    self._put(key, entry)
+                else:
+                    self._count('hits')
+
+                body, content_type, content_encoding, headers = entry
+                response = Response(body, content_type=content_type)
+                for name, value in headers:
+                    response.headers.add(name, value)
+                if content_encoding:
+                    response.headers['Content-Encoding'] = content_encoding
+                return self._finish(response, etag)
+            return wrapper
+        return decorator
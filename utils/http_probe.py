@@ -0,0 +1,84 @@
+import threading
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# LAN内の自己署名証明書を前提に、証明書検証なしのHTTPSプローブで警告を出さない
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class HTTPProbePool:
+    """host:port 単位でKeep-Alive接続を再利用するHTTPプローブ用セッションプール"""
+
+    def __init__(self, method='HEAD', connect_timeout=3, read_timeout=5, pool_maxsize=4, verify_tls=False, observer=None):
+        self.method = method.upper()
+        # 結果の集計用: observer(scheme, 結果) を1回のプローブごとに呼ぶ
+        # 結果は 'ok', 'http_status'（2xx以外）, 'timeout', 'connection_error', 'error' のいずれか
+        self.observer = observer
+        self.verify_tls = verify_tls
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host, port):
+        key = f"{host}:{port}"
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.verify = self.verify_tls
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[key] = session
+            return session
+
+    def _request(self, session, method, url):
+        # stream=True でステータス行とヘッダーの受信時点で読み込みを止める
+        response = session.request(method, url, timeout=self.timeout, allow_redirects=True, stream=True)
+        if method == 'HEAD':
+            # ボディが無いので読み切ればコネクションがプールに戻る
+            response.content
+        else:
+            # GETのボディは読まずに接続ごと破棄する
+            response.close()
+        return response
+
+    def probe(self, host, port, scheme='http'):
+        """ボディを読まずにステータスコードを確認し、(到達可能か, レイテンシms) を返す"""
+        url = f"{scheme}://{host}:{port}"
+        session = self._session(host, port)
+        try:
+            response = self._request(session, self.method, url)
+            # HEADを受け付けないサーバーにはストリーミングGETで再試行
+            if self.method == 'HEAD' and response.status_code in (405, 501):
+                response = self._request(session, 'GET', url)
+        except requests.exceptions.Timeout:
+            self._observe(scheme, 'timeout')
+            return False, None
+        except requests.exceptions.ConnectionError:
+            self._observe(scheme, 'connection_error')
+            return False, None
+        except requests.exceptions.RequestException:
+            self._observe(scheme, 'error')
+            return False, None
+
+        if 200 <= response.status_code < 300:
+            self._observe(scheme, 'ok')
+            return True, response.elapsed.total_seconds() * 1000
+        self._observe(scheme, 'http_status')
+        return False, None
+
+    def _observe(self, scheme, result):
+        if self.observer is not None:
+            self.observer(scheme, result)
+
+    def close(self):
+        """プール中の全セッションを閉じる"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
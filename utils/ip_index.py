@@ -0,0 +1,86 @@
+import bisect
+import ipaddress
+import threading
+
+
+def ip_to_int(ip_str):
+    """IPv4アドレス文字列を整数に変換する（無効な場合はNone）"""
+    try:
+        return int(ipaddress.IPv4Address(ip_str))
+    except (ipaddress.AddressValueError, ValueError):
+        return None
+
+
+class IPIndex:
+    """IPアドレスを整数化したソート済み配列と、サブネットグループを保持するインデックス
+
+    レコードはIPアドレス・ポート・名前などの内容から作るキーで識別するため、
+    削除に伴うIDの振り直しでは索引を作り直さない。
+    """
+
+    def __init__(self, key_func, group_func, group_sort_key):
+        self.key_func = key_func
+        self.group_func = group_func
+        self.group_sort_key = group_sort_key
+        self._entries = []          # (IPの整数値, キー) のソート済みリスト
+        self._ids = {}              # キー -> レコードIDのリスト
+        self._group_counts = {}     # グループ名 -> レコード数
+        self._group_order = []      # グループ名を表示順に並べたリスト
+        self._source = None
+        self._lock = threading.Lock()
+
+    def sync(self, source, records):
+        """レコード群との差分だけを索引に反映する（同じデータなら何もしない）"""
+        with self._lock:
+            if source is self._source:
+                return
+            current = {}
+            for rec in records:
+                current.setdefault(self.key_func(rec), []).append(rec['id'])
+
+            for key in self._ids.keys() - current.keys():
+                self._remove(key)
+            for key in current.keys() - self._ids.keys():
+                self._add(key)
+            self._ids = current
+            self._source = source
+
+    def _add(self, key):
+        ip_int = ip_to_int(key[0])
+        if ip_int is not None:
+            bisect.insort(self._entries, (ip_int, key))
+        group = self.group_func(key[0])
+        if group not in self._group_counts:
+            self._group_counts[group] = 0
+            bisect.insort(self._group_order, (self.group_sort_key(group), group))
+        self._group_counts[group] += 1
+
+    def _remove(self, key):
+        ip_int = ip_to_int(key[0])
+        if ip_int is not None:
+            index = bisect.bisect_left(self._entries, (ip_int, key))
+            if index < len(self._entries) and self._entries[index] == (ip_int, key):
+                del self._entries[index]
+        group = self.group_func(key[0])
+        self._group_counts[group] -= 1
+        if self._group_counts[group] == 0:
+            del self._group_counts[group]
+            self._group_order.remove((self.group_sort_key(group), group))
+
+    def query_cidr(self, network):
+        """CIDRに含まれるレコードIDをIPアドレス順に返す（二分探索で範囲を特定）"""
+        low = int(network.network_address)
+        high = int(network.broadcast_address)
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (low,))
+            end = bisect.bisect_left(self._entries, (high + 1,))
+            return [
+                record_id
+                for _, key in self._entries[start:end]
+                for record_id in self._ids[key]
+            ]
+
+    def group_names(self):
+        """グループ名を表示順に返す"""
+        with self._lock:
+            return [group for _, group in self._group_order]
@@ -0,0 +1,302 @@
+import atexit
+import bisect
+import fcntl
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), list(value) if isinstance(value, list) else value] for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """増加のみのカウンター（サンプル名には _total が付く）"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.mark_dirty()
+
+
+class Gauge(_Metric):
+    """任意の値を取るゲージ（プロセス間では mode に従って合算する: 'sum' または 'max'）"""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, labelnames=(), mode='sum'):
+        super().__init__(registry, name, documentation, labelnames)
+        self.mode = mode
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        self.registry.mark_dirty()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.mark_dirty()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """累積バケットのヒストグラム（値は [各バケットの件数..., 合計, 件数] で保持する）"""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        self.registry.mark_dirty()
+
+
+class MetricsRegistry:
+    """メトリクスの登録と、Prometheus/OpenMetricsのテキスト形式での出力
+
+    チェッカー（自動チェック）とGunicornのワーカー（/metrics の応答）が別プロセスのため、
+    各プロセスは自分の値を directory 内の <pid>.json に定期的に書き出し、
+    出力時に全プロセス分を合算する。終了したプロセスのカウンターとヒストグラムは
+    減らないよう archive.json に繰り入れ、ゲージは捨てる。
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._collectors = []
+        self._dirty = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), mode='sum'):
+        return self._register(Gauge(self, name, documentation, labelnames, mode))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """出力時に呼ばれ、(名前, 種類, 説明, [(ラベル辞書, 値), ...]) を返す関数を登録する"""
+        self._collectors.append(func)
+        return func
+
+    def mark_dirty(self):
+        self._dirty.set()
+        if self.directory is not None and self._pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            # fork後のプロセスでは親の書き出しスレッドが無いので、プロセスごとに起動する
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            self.flush()
+            time.sleep(self.flush_interval)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def flush(self):
+        """このプロセスの値をファイルに書き出す"""
+        if self.directory is None:
+            return
+        self._dirty.clear()
+        payload = {metric.name: metric.dump() for metric in self._metrics}
+        fd, tmp_path = tempfile.mkstemp(prefix='.metrics-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(payload, f, separators=(',', ':'))
+            os.replace(tmp_path, self._path(os.getpid()))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _archive(self, pid):
+        """終了したプロセスの値を archive.json に繰り入れる"""
+        # 先にリネームして、同時に出力している他のワーカーと二重に繰り入れないようにする
+        claimed = os.path.join(self.directory, f'.dead-{pid}-{os.getpid()}')
+        try:
+            os.rename(self._path(pid), claimed)
+        except OSError:
+            return
+        payload = self._read(claimed) or {}
+        os.unlink(claimed)
+
+        archive_path = os.path.join(self.directory, 'archive.json')
+        with open(os.path.join(self.directory, '.archive.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            archive = self._read(archive_path) or {}
+            for metric in self._metrics:
+                if metric.kind == 'gauge':
+                    continue
+                merged = {tuple(key): value for key, value in archive.get(metric.name, [])}
+                for key, value in payload.get(metric.name, []):
+                    merged[tuple(key)] = self._combine(metric, merged.get(tuple(key)), value)
+                archive[metric.name] = [[list(key), value] for key, value in merged.items()]
+            fd, tmp_path = tempfile.mkstemp(prefix='.metrics-', dir=self.directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(archive, f, separators=(',', ':'))
+            os.replace(tmp_path, archive_path)
+
+    def _other_processes(self):
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        results = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename == 'archive.json':
+                continue
+            try:
+                pid = int(filename[:-5])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                self._archive(pid)
+                continue
+            except PermissionError:
+                pass
+            payload = self._read(self._path(pid))
+            if payload is not None:
+                results.append(payload)
+        archive = self._read(os.path.join(self.directory, 'archive.json'))
+        if archive is not None:
+            results.append(archive)
+        return results
+
+    @staticmethod
+    def _combine(metric, current, value):
+        if current is None:
+            return value
+        if metric.kind == 'histogram':
+            return [a + b for a, b in zip(current, value)]
+        if metric.kind == 'gauge' and metric.mode == 'max':
+            return max(current, value)
+        return current + value
+
+    def _merged(self, metric, others):
+        values = {tuple(key): value for key, value in metric.dump()}
+        for payload in others:
+            for key, value in payload.get(metric.name, []):
+                values[tuple(key)] = self._combine(metric, values.get(tuple(key)), value)
+        return sorted(values.items())
+
+    def render(self, openmetrics=False):
+        """全プロセス分を合算したテキスト形式の出力を返す"""
+        others = self._other_processes()
+        lines = []
+        for metric in self._metrics:
+            family = metric.name
+            if metric.kind == 'counter' and not openmetrics:
+                family = metric.name + '_total'
+            lines.append(f'# HELP {family} {metric.documentation}')
+            lines.append(f'# TYPE {family} {metric.kind}')
+            for key, value in self._merged(metric, others):
+                if metric.kind == 'counter':
+                    lines.append(f'{metric.name}_total{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+                elif metric.kind == 'gauge':
+                    lines.append(f'{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}')
+                else:
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (math.inf,), value[:-2] + [value[-1] - sum(value[:-2])]):
+                        cumulative += count
+                        le = '+Inf' if bound == math.inf else repr(float(bound))
+                        labels = _format_labels(metric.labelnames, key, [('le', le)])
+                        lines.append(f'{metric.name}_bucket{labels} {cumulative}')
+                    lines.append(f'{metric.name}_sum{_format_labels(metric.labelnames, key)} {_format_value(value[-2])}')
+                    lines.append(f'{metric.name}_count{_format_labels(metric.labelnames, key)} {value[-1]}')
+
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
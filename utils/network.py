@@ -1,6 +1,15 @@
+import errno
 import ipaddress
+import os
+import selectors
+import socket
+import struct
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
 
 
 def is_valid_ipv4(ip_str):
@@ -12,8 +21,8 @@ def is_valid_ipv4(ip_str):
         return False
 
 
-def ping_host(ip_address):
-    """指定されたIPアドレスにPingを実行し、到達可能性とレイテンシを返す"""
+def _ping_subprocess(ip_address):
+    """pingコマンドで1回Pingを実行する（ICMPソケットが使えない環境向け）"""
     try:
         # '-c 1': 1回だけpingを打つ
         # '-W 1': 1秒でタイムアウト (必要に応じて調整)
@@ -50,6 +59,175 @@ def ping_host(ip_address):
         return False, None
 
 
+def _icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def _open_icmp_socket():
+    """ICMPソケットを開き、(ソケット, RAWソケットかどうか) を返す。使えなければNone"""
+    try:
+        # 非特権ICMPデータグラムソケット（net.ipv4.ping_group_range で許可が必要）
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False
+    except OSError:
+        pass
+    try:
+        # root または CAP_NET_RAW があればRAWソケットを使う
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True
+    except OSError:
+        return None, False
+
+
+def ping_hosts(ip_addresses, timeout=1.0):
+    """複数のIPアドレスへ同時にPingし、{IP: (到達可能か, レイテンシms)} を返す
+
+    プロセス内のICMPソケットでエコー要求をまとめて送信し、
+    応答は識別子とシーケンス番号で照合する。全体の所要時間は最大でtimeout程度。
+    """
+    ip_addresses = list(dict.fromkeys(ip_addresses))
+    results = {ip: (False, None) for ip in ip_addresses}
+    if not ip_addresses:
+        return results
+
+    sock, is_raw = _open_icmp_socket()
+    if sock is None:
+        # ICMPソケットが使えない場合はpingコマンドを並列に実行する
+        with ThreadPoolExecutor(max_workers=min(32, len(ip_addresses))) as executor:
+            return dict(zip(ip_addresses, executor.map(_ping_subprocess, ip_addresses)))
+
+    # データグラムソケットでは識別子はカーネルが書き換えるため、照合はシーケンス番号で行う
+    identifier = os.getpid() & 0xffff
+    pending = {}
+    # select.select は番号が1024以上のディスクリプタを扱えないため selectors を使う
+    selector = selectors.DefaultSelector()
+    try:
+        selector.register(sock, selectors.EVENT_READ)
+        for seq, ip in enumerate(ip_addresses):
+            seq &= 0xffff
+            header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, seq)
+            payload = b'ipmanager-ping'
+            packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, _icmp_checksum(header + payload), identifier, seq) + payload
+            try:
+                sock.sendto(packet, (ip, 0))
+            except OSError:
+                # 経路がない場合などは到達不可として扱う
+                continue
+            pending[seq] = (ip, time.perf_counter())
+
+        deadline = time.perf_counter() + timeout
+        while pending:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            if not selector.select(remaining):
+                break
+            try:
+                data, addr = sock.recvfrom(2048)
+            except OSError:
+                continue
+            received = time.perf_counter()
+
+            if is_raw:
+                # RAWソケットではIPヘッダーが付いてくる
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, reply_id, seq = struct.unpack('!BBHHH', data[:8])
+            if icmp_type != ICMP_ECHO_REPLY or (is_raw and reply_id != identifier):
+                continue
+            entry = pending.get(seq)
+            if entry is None or entry[0] != addr[0]:
+                continue
+            del pending[seq]
+            results[entry[0]] = (True, (received - entry[1]) * 1000)
+    finally:
+        selector.close()
+        sock.close()
+    return results
+
+
+def ping_host(ip_address):
+    """指定されたIPアドレスにPingを実行し、到達可能性とレイテンシを返す"""
+    return ping_hosts([ip_address])[ip_address]
+
+
+def tcp_connect(ip_address, port, timeout=3.0):
+    """ノンブロッキングconnectでTCPハンドシェイクを試行し、(到達可能か, 接続時間ms) を返す"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    selector = selectors.DefaultSelector()
+    try:
+        sock.setblocking(False)
+        start_time = time.perf_counter()
+        err = sock.connect_ex((ip_address, port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return False, None
+        if err != 0:
+            selector.register(sock, selectors.EVENT_WRITE)
+            if not selector.select(timeout):
+                return False, None
+            # 接続の成否はSO_ERRORで確認する（拒否された場合もwritableになる）
+            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                return False, None
+        return True, (time.perf_counter() - start_time) * 1000
+    except OSError:
+        return False, None
+    finally:
+        selector.close()
+        sock.close()
+
+
+# 接続がこれらのエラーで失敗した場合はホスト自体に届かない（拒否はホストが動いている証拠）
+_HOST_DOWN_ERRORS = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.ETIMEDOUT)
+
+
+def host_alive(ip_address, ports, timeout=3.0):
+    """ホストの複数のポートへ同時にTCP接続を試み、ホストが応答するかを返す
+
+    いずれかのポートで接続できるか、接続を拒否（RST）されればホストは動いている。
+    全てのポートが応答なし・経路なしの場合だけFalseを返す。所要時間は最大でtimeout程度。
+    """
+    sockets = {}
+    selector = selectors.DefaultSelector()
+    try:
+        for port in dict.fromkeys(ports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            err = sock.connect_ex((ip_address, port))
+            if err == 0 or err == errno.ECONNREFUSED:
+                sock.close()
+                return True
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                sockets[sock.fileno()] = sock
+                selector.register(sock, selectors.EVENT_WRITE)
+            else:
+                sock.close()
+        deadline = time.perf_counter() + timeout
+        while sockets:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err not in _HOST_DOWN_ERRORS:
+                    return True
+                selector.unregister(sock)
+                del sockets[sock.fileno()]
+                sock.close()
+        return False
+    except OSError:
+        # ディスクリプタ不足など、判断できない場合は動いているものとして通常のプローブに任せる
+        return True
+    finally:
+        selector.close()
+        for sock in sockets.values():
+            sock.close()
+
+
 def get_signal_strength(latency_ms):
     """レイテンシから信号強度（0-4）を計算する"""
     if latency_ms is None:
@@ -0,0 +1,64 @@
+import base64
+import bisect
+import json
+
+
+def _to_tuple(value):
+    # JSONでは配列になるので、並び順のキーと比較できるようにタプルへ戻す
+    if isinstance(value, list):
+        return tuple(_to_tuple(v) for v in value)
+    return value
+
+
+def _same_shape(key, like):
+    # 並び順キーと比較できる値か（入れ子のタプルの長さと、数値・文字列の別が一致するか）
+    if isinstance(like, tuple):
+        return isinstance(key, tuple) and len(key) == len(like) and all(map(_same_shape, key, like))
+    if isinstance(like, str):
+        return isinstance(key, str)
+    if isinstance(like, (int, float)) and not isinstance(like, bool):
+        return isinstance(key, (int, float)) and not isinstance(key, bool)
+    return type(key) is type(like)
+
+
+def encode_cursor(sort_by, sort_order, key):
+    """ページの最後の要素の並び順キーからカーソル文字列を作る"""
+    raw = json.dumps([sort_by, sort_order, key], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort_by, sort_order, like=None):
+    """カーソル文字列を並び順キーに戻す（壊れている・並び順が違う場合はValueError）
+
+    like に現在の並び順キーを1つ渡すと、キーの形と型が一致しない場合もValueErrorにする。
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort_by, cursor_sort_order, key = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+    if (cursor_sort_by, cursor_sort_order) != (sort_by, sort_order):
+        raise ValueError('cursor does not match the current ordering')
+    key = _to_tuple(key)
+    if like is not None and not _same_shape(key, like):
+        raise ValueError('cursor does not match the current ordering')
+    return key
+
+
+def paginate(items, keys, descending=False, after=None, limit=100):
+    """昇順に並んだ items/keys から、キー after の次の limit 件を返す
+
+    降順の場合は昇順の配列を後ろから読む。戻り値は (ページ, 次ページの先頭の直前のキー or None)。
+    キーで位置を決めるため、ページ間で要素が追加・削除されても重複や抜けが起きない。
+    """
+    if descending:
+        end = len(keys) if after is None else bisect.bisect_left(keys, after)
+        start = max(end - limit, 0)
+        page = items[start:end][::-1]
+        next_key = keys[start] if start > 0 and page else None
+    else:
+        start = 0 if after is None else bisect.bisect_right(keys, after)
+        end = min(start + limit, len(keys))
+        page = items[start:end]
+        next_key = keys[end - 1] if end < len(keys) and page else None
+    return page, next_key
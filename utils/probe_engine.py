@@ -0,0 +1,168 @@
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class _HostRun:
+    """1ホスト分のプローブの進行状況（ホストの担当間で共有する）"""
+
+    def __init__(self, host, items):
+        self.host = host
+        self.ports = [target[1] for _, target in items]
+        self.pending = deque(items)
+        self.alive = None       # None: まだ分からない
+        self.lock = threading.Lock()
+
+
+class ProbeEngine:
+    """並列数を制限したプローブ実行エンジン（全体上限・ホスト単位上限）
+
+    host_check(ホスト, ポート一覧) を渡すと、ホストへのプローブが失敗した時に1回だけ死活を確認し、
+    落ちていれば残りのサービスはプローブせずに到達不可とする（停止中のホストの待ち時間は
+    サービスの数によらず一定になる）。プローブに応答があればそれをホストの死活とみなし、
+    動いているホストには確認の接続を増やさない。breaker（HostCircuitBreaker）を渡すと、落ちていた
+    ホストは回路が開いている間、確認もせずに到達不可とし、半開になったら先に死活を確認する。
+    observer(理由, 件数) はプローブせずに到達不可とした時に呼ぶ（理由は 'host_down' か 'circuit_open'）。
+    """
+
+    def __init__(self, probe_func, max_workers=32, per_host_limit=4, host_check=None, breaker=None, observer=None):
+        self.probe_func = probe_func
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.host_check = host_check
+        self.breaker = breaker
+        self.observer = observer
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='probe')
+        # ホスト -> [セマフォ, 保持・待機中のプローブ数]。使われなくなったホストの分は消す
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _run_one(self, target):
+        # target は (ip_address, port, ...) のタプル。先頭要素をホストとして扱う
+        host = target[0]
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = [threading.BoundedSemaphore(self.per_host_limit), 0]
+            slot[1] += 1
+        try:
+            with slot[0]:
+                try:
+                    return self.probe_func(*target)
+                except Exception:
+                    return False, None
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0:
+                    del self._host_slots[host]
+
+    @staticmethod
+    def _interleave(indexed_targets):
+        """同一ホストへのプローブが連続しないようにホスト単位で交互に並べる"""
+        by_host = OrderedDict()
+        for index, target in indexed_targets:
+            by_host.setdefault(target[0], []).append((index, target))
+        queues = list(by_host.values())
+        ordered = []
+        position = 0
+        while queues:
+            for lane in queues:
+                ordered.append(lane[position])
+            position += 1
+            queues = [lane for lane in queues if position < len(lane)]
+        return ordered
+
+    def iter_results(self, targets, bypass_breaker=False):
+        """完了した順に (targetsのインデックス, 結果) を返すジェネレータ
+
+        bypass_breaker=True なら回路が開いているホストも確認してからプローブする。
+        """
+        if self.host_check is None:
+            futures = {}
+            for index, target in self._interleave(list(enumerate(targets))):
+                futures[self._executor.submit(self._run_one, target)] = index
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+            return
+
+        by_host = OrderedDict()
+        for index, target in enumerate(targets):
+            by_host.setdefault(target[0], []).append((index, target))
+        results = queue.Queue()
+        for host, items in by_host.items():
+            if self.breaker is not None and not bypass_breaker and not self.breaker.allow(host):
+                self._observe('circuit_open', len(items))
+                for index, _ in items:
+                    results.put((index, (False, None)))
+                continue
+            # 回路が半開（または強制で開いたまま）のホストは、先に死活を確認してからプローブする
+            check_first = self.breaker is not None and self.breaker.state(host) != self.breaker.CLOSED
+            self._executor.submit(self._run_host, host, items, results, check_first)
+        for _ in range(len(targets)):
+            yield results.get()
+
+    def _run_host(self, host, items, results, check_first=False):
+        """ホストのサービスを並列にプローブする（check_first なら先に死活を確認する）"""
+        run = _HostRun(host, items)
+        if check_first and not self._confirm(run, results):
+            return
+        # ホスト単位の上限の数だけ順番に処理する担当を起動する（上限待ちでワーカーを塞がない）
+        for _ in range(min(self.per_host_limit, len(items))):
+            self._executor.submit(self._run_lane, run, results)
+
+    def _run_lane(self, run, results):
+        while True:
+            try:
+                index, target = run.pending.popleft()
+            except IndexError:
+                return
+            result = self._run_one(target)
+            results.put((index, result))
+            if result[0]:
+                # 応答があればホストは動いている（死活の確認は不要）
+                run.alive = True
+            elif run.alive is None:
+                self._confirm(run, results)
+
+    def _confirm(self, run, results):
+        """ホストの死活を1回だけ確認し、落ちていれば残りのサービスを到達不可とする"""
+        with run.lock:
+            if run.alive is not None:
+                return run.alive
+            try:
+                alive = self.host_check(run.host, run.ports)
+            except Exception:
+                alive = True
+            # 確認の間に他のサービスが応答していれば動いている
+            run.alive = alive = run.alive or alive
+        if self.breaker is not None:
+            if alive:
+                self.breaker.success(run.host)
+            else:
+                self.breaker.failure(run.host)
+        if alive:
+            return True
+        skipped = []
+        while True:
+            try:
+                skipped.append(run.pending.popleft())
+            except IndexError:
+                break
+        if skipped:
+            self._observe('host_down', len(skipped))
+        for index, _ in skipped:
+            results.put((index, (False, None)))
+        return False
+
+    def _observe(self, reason, count):
+        if self.observer is not None:
+            self.observer(reason, count)
+
+    def run(self, targets, bypass_breaker=False):
+        """全プローブを実行し、targetsと同じ順序で結果のリストを返す"""
+        results = [None] * len(targets)
+        for index, result in self.iter_results(targets, bypass_breaker):
+            results[index] = result
+        return results
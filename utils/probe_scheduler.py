@@ -0,0 +1,120 @@
+import heapq
+import random
+import threading
+import time
+
+
+class ProbeScheduler:
+    """サービス単位の次回チェック時刻を優先度付きキューで管理するスケジューラー
+
+    - 通常は base_interval ごとにチェックし、お気に入りは favorite_factor 倍の間隔にする
+    - 状態が変化した直後は min_interval で再チェックして早く確定させる
+    - ダウンが続くサービスは指数バックオフで間隔を広げる（上限 max_interval）
+    - 各間隔に ±jitter の揺らぎを加えて負荷を時間方向に分散させる
+    - 新しく追加されたキーの初回チェックは、チェック間隔の範囲に散らす
+    """
+
+    def __init__(self, base_interval, min_interval=60, max_interval=3600,
+                 jitter=0.1, favorite_factor=0.5, backoff_factor=2):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, base_interval)
+        self.jitter = jitter
+        self.favorite_factor = favorite_factor
+        self.backoff_factor = backoff_factor
+        self._heap = []
+        self._entries = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _push(self, key, due):
+        entry = self._entries[key]
+        self._seq += 1
+        entry['due'] = due
+        entry['seq'] = self._seq
+        heapq.heappush(self._heap, (due, self._seq, key))
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def sync(self, favorites, now=None):
+        """チェック対象を同期する（favorites: キー -> お気に入りかどうか）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in list(self._entries):
+                if key not in favorites:
+                    del self._entries[key]
+            for key, favorite in favorites.items():
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = {'favorite': favorite, 'status': None, 'failures': 0}
+                    # 起動直後や一括登録で同時に追加されたキーが一斉にチェックされないよう、
+                    # 初回のチェック時刻をチェック間隔の範囲に散らす
+                    self._push(key, now + random.uniform(0, self._interval(entry)))
+                elif entry['favorite'] != favorite:
+                    entry['favorite'] = favorite
+                    if favorite:
+                        self._push(key, min(entry['due'], now + self._jittered(self._interval(entry))))
+
+    def defer(self, keys, delay=None, now=None):
+        """pop_due() で取り出したが結果を報告できなかったキーを delay 秒後（既定は min_interval）に入れ直す"""
+        now = time.time() if now is None else now
+        delay = self.min_interval if delay is None else delay
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                # report() 済み（再スケジュール済み）のキーはそのままにする
+                if entry is not None and entry['seq'] is None:
+                    self._push(key, now + self._jittered(delay))
+
+    def pop_due(self, now=None, limit=None):
+        """チェック時刻を過ぎたキーを期限の早い順に取り出す"""
+        now = time.time() if now is None else now
+        keys = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(keys) < limit):
+                due, seq, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                # 削除済み、または再スケジュール済みの古いエントリは捨てる
+                if entry is None or entry['seq'] != seq:
+                    continue
+                entry['seq'] = None
+                keys.append(key)
+        return keys
+
+    def _interval(self, entry):
+        if entry['status'] == 'unreachable' and entry['failures'] > 1:
+            interval = self.base_interval * self.backoff_factor ** (entry['failures'] - 1)
+            return min(interval, self.max_interval)
+        if entry['favorite']:
+            return max(self.base_interval * self.favorite_factor, self.min_interval)
+        return self.base_interval
+
+    def report(self, key, status, now=None):
+        """チェック結果を反映して次回のチェック時刻を決める"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            changed = entry['status'] is not None and entry['status'] != status
+            entry['status'] = status
+            entry['failures'] = entry['failures'] + 1 if status == 'unreachable' else 0
+            if changed:
+                interval = self.min_interval
+            else:
+                interval = self._interval(entry)
+            self._push(key, now + self._jittered(interval))
+
+    def seconds_until_next(self, now=None):
+        """次のチェック予定までの秒数（予定がなければNone）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._heap:
+                due, seq, key = self._heap[0]
+                entry = self._entries.get(key)
+                if entry is None or entry['seq'] != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                return max(0.0, due - now)
+        return None
@@ -0,0 +1,138 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+
+
+class RequestProfiler:
+    """リクエスト単位の処理時間の計測（有効にした場合のみ）
+
+    phase() で囲んだ区間の時間を記録し、Server-Timing ヘッダーで返す。
+    合計が slow_threshold_ms を超えたリクエストは区間ごとの内訳を slow_log に1行JSONで書く。
+    """
+
+    def __init__(self, enabled=False, slow_threshold_ms=500, slow_log=None):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_log = slow_log
+        self._log_lock = threading.Lock()
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.profile_start = time.perf_counter()
+        g.profile_phases = []
+
+    @contextlib.contextmanager
+    def _measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            g.profile_phases.append((name, (time.perf_counter() - start) * 1000))
+
+    def phase(self, name):
+        """計測区間のコンテキストマネージャーを返す（無効時・リクエスト外では何もしない）"""
+        if not self.enabled or not has_request_context() or 'profile_phases' not in g:
+            return contextlib.nullcontext()
+        return self._measure(name)
+
+    def _after_request(self, response):
+        if 'profile_start' not in g:
+            return response
+        total = (time.perf_counter() - g.profile_start) * 1000
+        # 同じ名前の区間（1リクエストで複数回の保存など）は合算する
+        phases = {}
+        for name, duration in g.profile_phases:
+            phases[name] = phases.get(name, 0.0) + duration
+        entries = [f'{name};dur={duration:.2f}' for name, duration in phases.items()]
+        entries.append(f'total;dur={total:.2f}')
+        response.headers.add('Server-Timing', ', '.join(entries))
+        if total >= self.slow_threshold_ms:
+            self._log_slow(total, phases, response.status_code)
+        return response
+
+    def _log_slow(self, total, phases, status):
+        record = json.dumps({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pid': os.getpid(),
+            'method': request.method,
+            'path': request.full_path,
+            'status': status,
+            'total_ms': round(total, 2),
+            'phases_ms': {name: round(duration, 2) for name, duration in phases.items()}
+        }, ensure_ascii=False)
+        with self._log_lock:
+            if self.slow_log:
+                with open(self.slow_log, 'a') as f:
+                    f.write(record + '\n')
+            else:
+                print(f"[slow request] {record}", file=sys.stderr)
+
+
+class SamplingProfiler:
+    """全スレッドのスタックを一定間隔で採取し、フレームグラフ用の collapsed 形式で出力する"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._stacks = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks = Counter()
+            self._stop.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """採取を止め、collapsed 形式（"関数;関数;... 回数" の行）の文字列を返す"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return self.collapsed()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common())
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[';'.join(reversed(stack))] += 1
@@ -3,7 +3,7 @@ from datetime import datetime
 
 from config import Config
 from models import load_data, save_data
-from utils.network import ping_host
+from utils.network import ping_hosts
 
 
 def check_all_devices_status(app=None):
@@ -12,6 +12,11 @@ def check_all_devices_status(app=None):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 自動状態確認を開始します。")
     updated = False  # データが更新されたかどうかを追跡
 
+    # 全デバイスのIPへまとめてPingを送り、応答を待つのは1回分のタイムアウトだけにする
+    ping_results = ping_hosts(
+        [ip for device in data['devices'] for ip in (device['local_ip'], device['tailscale_ip']) if ip]
+    )
+
     for device in data['devices']:
         # オリジナルの状態を保存し、変更があったかチェックするため
         original_local_status = device.get('local_ip_status', 'unknown')
@@ -25,7 +30,7 @@ def check_all_devices_status(app=None):
         tailscale_ip_reachable, tailscale_latency = False, None
 
         if device['local_ip']:
-            local_ip_reachable, local_latency = ping_host(device['local_ip'])
+            local_ip_reachable, local_latency = ping_results[device['local_ip']]
             device['local_ip_status'] = 'reachable' if local_ip_reachable else 'unreachable'
             device['local_ping_latency'] = local_latency
         else:
@@ -33,7 +38,7 @@ def check_all_devices_status(app=None):
             device['local_ping_latency'] = None
 
         if device['tailscale_ip']:
-            tailscale_ip_reachable, tailscale_latency = ping_host(device['tailscale_ip'])
+            tailscale_ip_reachable, tailscale_latency = ping_results[device['tailscale_ip']]
             device['tailscale_ip_status'] = 'reachable' if tailscale_ip_reachable else 'unreachable'
             device['tailscale_ping_latency'] = tailscale_latency
         else:
@@ -0,0 +1,142 @@
+import bisect
+import threading
+
+# 名前の索引に使うn-gramの最大長（これ以下の長さの検索語はそのまま索引を引く）
+NGRAM_SIZE = 3
+
+# 変更件数がこれを超えたら接尾辞配列を個別に挿入・削除せず作り直す
+BULK_THRESHOLD = 64
+
+
+def _ngrams(text):
+    """1〜NGRAM_SIZE文字の部分文字列をすべて返す"""
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        for i in range(len(text) - size + 1):
+            grams.add(text[i:i + size])
+    return grams
+
+
+def _suffixes(text):
+    return {text[i:] for i in range(len(text))}
+
+
+class SearchIndex:
+    """検索ボックス用の索引（データの変更時に差分だけ更新する）
+
+    - text_func: 大文字小文字を区別しない部分一致（名前など）。n-gramの転置索引で候補を絞る
+    - address_func: 大文字小文字を区別する部分一致（IPアドレスなど）。接尾辞のソート済み配列を前方一致で引く
+    - exact_func: 完全一致（ポート番号など）。値 -> レコードの辞書で引く
+
+    各関数はレコードから検索対象の文字列のリストを返す。レコードは検索対象の
+    内容から作るキーで識別するため、IDの振り直しでは索引を作り直さない。
+    """
+
+    def __init__(self, text_func=None, address_func=None, exact_func=None):
+        self.text_func = text_func or (lambda record: [])
+        self.address_func = address_func or (lambda record: [])
+        self.exact_func = exact_func or (lambda record: [])
+        self._grams = {}        # n-gram -> キーの集合
+        self._suffixes = []     # (接尾辞, キー) のソート済みリスト
+        self._exact = {}        # 値 -> キーの集合
+        self._ids = {}          # キー -> レコードIDのリスト
+        self._source = None
+        self._lock = threading.Lock()
+
+    def _key(self, record):
+        return (
+            tuple(text.lower() for text in self.text_func(record)),
+            tuple(self.address_func(record)),
+            tuple(self.exact_func(record))
+        )
+
+    def sync(self, source, records):
+        """レコード群との差分だけを索引に反映する（同じデータなら何もしない）"""
+        with self._lock:
+            if source is self._source:
+                return
+            current = {}
+            for rec in records:
+                current.setdefault(self._key(rec), []).append(rec['id'])
+
+            removed = self._ids.keys() - current.keys()
+            added = current.keys() - self._ids.keys()
+            for key in removed:
+                self._remove(key)
+            for key in added:
+                self._add(key)
+            self._update_suffixes(removed, added)
+            self._ids = current
+            self._source = source
+
+    def _add(self, key):
+        texts, _, exacts = key
+        for gram in set().union(*map(_ngrams, texts)):
+            self._grams.setdefault(gram, set()).add(key)
+        for value in set(exacts):
+            self._exact.setdefault(value, set()).add(key)
+
+    def _remove(self, key):
+        texts, _, exacts = key
+        for gram in set().union(*map(_ngrams, texts)):
+            self._discard(self._grams, gram, key)
+        for value in set(exacts):
+            self._discard(self._exact, value, key)
+
+    def _update_suffixes(self, removed, added):
+        if len(removed) + len(added) > BULK_THRESHOLD:
+            # 初回の構築や一括登録は、挿入を繰り返さずまとめて並べ直す
+            self._suffixes = [entry for entry in self._suffixes if entry[1] not in removed]
+            self._suffixes.extend((suffix, key) for key in added for suffix in self._key_suffixes(key))
+            self._suffixes.sort()
+            return
+        for key in removed:
+            for suffix in self._key_suffixes(key):
+                index = bisect.bisect_left(self._suffixes, (suffix, key))
+                if index < len(self._suffixes) and self._suffixes[index] == (suffix, key):
+                    del self._suffixes[index]
+        for key in added:
+            for suffix in self._key_suffixes(key):
+                bisect.insort(self._suffixes, (suffix, key))
+
+    @staticmethod
+    def _key_suffixes(key):
+        return set().union(*map(_suffixes, key[1]))
+
+    @staticmethod
+    def _discard(postings, value, key):
+        keys = postings.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del postings[value]
+
+    def _match_text(self, query):
+        query = query.lower()
+        if len(query) <= NGRAM_SIZE:
+            return set(self._grams.get(query, ()))
+        # 検索語に含まれるn-gramの積集合を候補にして、実際の部分一致で確かめる
+        postings = []
+        for i in range(len(query) - NGRAM_SIZE + 1):
+            keys = self._grams.get(query[i:i + NGRAM_SIZE])
+            if not keys:
+                return set()
+            postings.append(keys)
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return {key for key in candidates if any(query in text for text in key[0])}
+
+    def _match_address(self, query):
+        # 部分一致 = いずれかの接尾辞への前方一致
+        matches = set()
+        index = bisect.bisect_left(self._suffixes, (query,))
+        while index < len(self._suffixes) and self._suffixes[index][0].startswith(query):
+            matches.add(self._suffixes[index][1])
+            index += 1
+        return matches
+
+    def search(self, query):
+        """いずれかの項目が一致するレコードIDを昇順で返す"""
+        with self._lock:
+            keys = self._match_text(query) | self._match_address(query) | self._exact.get(query, set())
+            return sorted(record_id for key in keys for record_id in self._ids[key])
@@ -0,0 +1,560 @@
+import fcntl
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class JSONFileBackend:
+    """JSONファイルにデータ全体を保存するバックエンド
+
+    状態更新は追記専用のジャーナル（<path>.journal、1行1レコード）に書き、
+    一定サイズを超えたらスナップショットに統合（コンパクション）する。
+    ジャーナルの先頭行は世代番号で、スナップショットと世代が一致する場合のみ再生する。
+    """
+
+    def __init__(self, path, compact_bytes=1024 * 1024):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.lock_path = path + '.lock'
+        self.compact_bytes = compact_bytes
+        self._generation = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    @contextmanager
+    def locked(self):
+        """プロセス間の書き込みロック（同一プロセス内では再入可能）"""
+        with self._lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def fingerprint(self):
+        """変更検知用の値（スナップショットとジャーナルの mtime, size, inode）を返す"""
+        return (self._stat(self.path), self._stat(self.journal_path))
+
+    def _read_journal(self, offset=0):
+        """ジャーナルを読み、(世代番号, 更新レコード, 読み終えた位置, inode) を返す"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if offset == 0:
+                    header = f.readline()
+                    if not header.endswith(b'\n'):
+                        return None, [], 0, inode
+                    generation = json.loads(header)['generation']
+                    offset = f.tell()
+                else:
+                    generation = None
+                    f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return None, [], 0, None
+
+        # 追記途中の行は次回に読む
+        end = chunk.rfind(b'\n') + 1
+        updates = [json.loads(line) for line in chunk[:end].splitlines() if line.strip()]
+        return generation, updates, offset + end, inode
+
+    def _write_journal_header(self, generation):
+        directory = os.path.dirname(os.path.abspath(self.journal_path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.journal-', suffix='.tmp', dir=directory)
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps({'generation': generation}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def load(self):
+        """スナップショットと同世代のジャーナルを読み、(データ, 更新レコード, カーソル) を返す"""
+        snapshot_stat = self._stat(self.path)
+        data = None
+        if snapshot_stat is not None:
+            with open(self.path, 'r') as f:
+                try:
+                    data = json.load(f)
+                except json.JSONDecodeError:
+                    data = None
+
+        generation = data.pop('journal_generation', 0) if data is not None else 0
+        self._generation = generation
+        journal_generation, updates, offset, inode = self._read_journal()
+        if journal_generation != generation:
+            # スナップショット書き込み後、ジャーナル切り替え前に中断した場合など
+            updates = []
+        return data, updates, (snapshot_stat, inode, offset)
+
+    def read_journal(self, cursor):
+        """カーソル以降に追記された更新を返す。スナップショットが変わっていればNone"""
+        snapshot_stat, inode, offset = cursor
+        if self._stat(self.path) != snapshot_stat or inode is None or offset == 0:
+            return None
+        _, updates, new_offset, new_inode = self._read_journal(offset)
+        if new_inode != inode:
+            return None
+        return updates, (snapshot_stat, inode, new_offset)
+
+    def save(self, data):
+        """スナップショットを一時ファイル経由で置き換え、ジャーナルを新しい世代で空にする"""
+        with self.locked():
+            current = self._read_journal()[0]
+            generation = max(current or 0, self._generation or 0) + 1
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.data-', suffix='.tmp', dir=directory)
+            try:
+                # mkstempは0600で作成するため、既存ファイルの権限を引き継ぐ
+                try:
+                    os.fchmod(fd, os.stat(self.path).st_mode & 0o777)
+                except FileNotFoundError:
+                    os.fchmod(fd, 0o644)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(dict(data, journal_generation=generation), f, ensure_ascii=False, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._write_journal_header(generation)
+
+            # rename自体を永続化するためディレクトリもfsyncする
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+            self._generation = generation
+            _, _, offset, inode = self._read_journal()
+            return self.fingerprint(), (self._stat(self.path), inode, offset)
+
+    def append(self, updates):
+        """更新レコードをジャーナルに追記し、コンパクションが必要かどうかを返す"""
+        with self.locked():
+            current = self._read_journal()[0]
+            if current is None or (self._generation is not None and current < self._generation):
+                self._write_journal_header(self._generation or 0)
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(json.dumps(update, ensure_ascii=False) + '\n' for update in updates))
+                f.flush()
+                os.fsync(f.fileno())
+                return f.tell() >= self.compact_bytes
+
+
+class SQLiteBackend:
+    """SQLiteにレコード単位で保存するバックエンド（id・ip_address・portにインデックス）
+
+    状態更新は journal テーブルに追記し、一定件数を超えたら records に統合する。
+    """
+
+    def __init__(self, path, collection='services', compact_rows=10000):
+        self.path = path
+        self.collection = collection
+        self.compact_rows = compact_rows
+        self._local = threading.local()
+        self._init_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # fork後のプロセスでは親の接続を使い回さない
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'id INTEGER PRIMARY KEY, ip_address TEXT, port INTEGER, data TEXT NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_records_ip_address ON records (ip_address)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_records_port ON records (port)')
+        conn.execute('CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)')
+
+    @contextmanager
+    def locked(self):
+        """書き込みトランザクションを開始する（入れ子の場合は外側のトランザクションを使う）"""
+        conn = self._connect()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @contextmanager
+    def _reading(self):
+        """一貫した読み取りのためのトランザクション（書き込み中なら外側をそのまま使う）"""
+        conn = self._connect()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.execute('COMMIT')
+
+    def fingerprint(self):
+        """保存のたびに増えるリビジョン番号と最新のジャーナル番号を返す"""
+        return self._connect().execute(
+            "SELECT (SELECT value FROM meta WHERE key = 'revision'), (SELECT MAX(seq) FROM journal)"
+        ).fetchone()
+
+    def _read_journal(self, conn, after_seq):
+        rows = conn.execute('SELECT seq, data FROM journal WHERE seq > ? ORDER BY seq', (after_seq,)).fetchall()
+        last_seq = rows[-1][0] if rows else after_seq
+        return [json.loads(row[1]) for row in rows], last_seq
+
+    def load(self):
+        with self._reading() as conn:
+            meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+            if 'revision' not in meta:
+                return None, [], (None, 0)
+            data = {key: json.loads(value) for key, value in meta.items() if key != 'revision'}
+            data[self.collection] = [
+                json.loads(row[0]) for row in conn.execute('SELECT data FROM records ORDER BY id')
+            ]
+            updates, last_seq = self._read_journal(conn, 0)
+        return data, updates, (meta['revision'], last_seq)
+
+    def read_journal(self, cursor):
+        """カーソル以降に追記された更新を返す。リビジョンが変わっていればNone"""
+        revision, last_seq = cursor
+        with self._reading() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+            if row is None or row[0] != revision:
+                return None
+            updates, last_seq = self._read_journal(conn, last_seq)
+        return updates, (revision, last_seq)
+
+    def save(self, data):
+        conn = self._connect()
+        with self.locked():
+            row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+            revision = str(int(row[0]) + 1 if row else 1)
+            conn.execute('DELETE FROM records')
+            conn.executemany(
+                'INSERT INTO records (id, ip_address, port, data) VALUES (?, ?, ?, ?)',
+                [
+                    (rec.get('id'), rec.get('ip_address'), rec.get('port'), json.dumps(rec, ensure_ascii=False))
+                    for rec in data[self.collection]
+                ]
+            )
+            conn.execute('DELETE FROM meta')
+            conn.executemany(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in data.items() if key != self.collection]
+            )
+            conn.execute("INSERT INTO meta (key, value) VALUES ('revision', ?)", (revision,))
+            conn.execute('DELETE FROM journal')
+            last_seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+            last_seq = last_seq[0] if last_seq else 0
+            return self.fingerprint(), (revision, last_seq)
+
+    def append(self, updates):
+        """更新レコードをジャーナルに追記し、コンパクションが必要かどうかを返す"""
+        conn = self._connect()
+        with self.locked():
+            conn.executemany(
+                'INSERT INTO journal (data) VALUES (?)',
+                [(json.dumps(update, ensure_ascii=False),) for update in updates]
+            )
+            count = conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+        return count >= self.compact_rows
+
+
+class _WorkingCopy(dict):
+    """load() が返す作業コピー（取得時点の各レコードを base に持ち、save() で最新の状態に合わせる）"""
+    __slots__ = ('base',)
+
+
+class DataStore:
+    """パース済みデータをメモリ上に保持し、読み込みをメモリから返すデータストア
+
+    snapshot() が返すデータは全リクエストで共有されるため変更してはならない。
+    変更する場合は load() で作業コピーを取得し、save() で丸ごと置き換える。
+    レコード単位の状態更新は record_updates() でジャーナルに追記する。
+
+    track_changes=True の場合、各レコードに不変の uid と最後に変更された時点の
+    変更番号 seq を持たせ、削除は tombstones に残す。changes_since() で差分を取り出せる。
+    """
+
+    def __init__(self, backend, migrate=None, default=None, collection='services',
+                 track_changes=False, tombstone_limit=1000, observer=None):
+        self.backend = backend
+        # 処理時間の計測用: observer(操作名, 秒) を reload/replay/load/save/append ごとに呼ぶ
+        self.observer = observer
+        self.migrate = migrate
+        self.default = default or dict
+        self.collection = collection
+        self.track_changes = track_changes
+        self.tombstone_limit = tombstone_limit
+        self._data = None
+        self._fingerprint = None
+        self._version = None
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._compacting = False
+        # キャッシュの効果確認用カウンター
+        self._stats = {'hits': 0, 'misses': 0, 'journal_replays': 0, 'reloads': 0}
+
+    def _apply_updates(self, data, updates):
+        """ジャーナルの更新レコードをデータに適用する（レコードは差し替えで更新）"""
+        records = data[self.collection]
+        for update in updates:
+            index = update['id'] - 1
+            if not (0 <= index < len(records) and records[index].get('id') == update['id']):
+                index = next((i for i, rec in enumerate(records) if rec.get('id') == update['id']), None)
+                if index is None:
+                    continue
+            record = records[index]
+            # 記録後に削除・並び替えされたレコードには適用しない
+            if any(record.get(key) != value for key, value in update.get('match', {}).items()):
+                continue
+            records[index] = dict(record, **update.get('fields', {}))
+            if self.track_changes:
+                # 全プロセスが同じ順序でジャーナルを適用するので、変更番号も一致する
+                data['change_seq'] += 1
+                records[index]['seq'] = data['change_seq']
+            data.update(update.get('dataset', {}))
+
+    @contextmanager
+    def _timed(self, operation):
+        if self.observer is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observer(operation, time.perf_counter() - start)
+
+    def _reload(self):
+        data, updates, cursor = self.backend.load()
+        if data is None:
+            data = self.default()
+        if self.migrate is not None:
+            data = self.migrate(data)
+        if self.track_changes:
+            self._ensure_change_fields(data)
+        self._apply_updates(data, updates)
+        self._data = data
+        self._cursor = cursor
+
+    def _refresh(self):
+        fingerprint = self.backend.fingerprint()
+        if self._data is not None and fingerprint == self._fingerprint:
+            self._stats['hits'] += 1
+            return
+        self._stats['misses'] += 1
+        tail = None if self._data is None else self.backend.read_journal(self._cursor)
+        if tail is None:
+            self._stats['reloads'] += 1
+            with self._timed('reload'):
+                self._reload()
+        else:
+            self._stats['journal_replays'] += 1
+            with self._timed('replay'):
+                updates, self._cursor = tail
+                self._apply_updates(self._data, updates)
+        self._set_fingerprint(fingerprint)
+
+    def _set_fingerprint(self, fingerprint):
+        self._fingerprint = fingerprint
+        self._version = hashlib.sha1(repr(fingerprint).encode('utf-8')).hexdigest()[:20]
+
+    def snapshot(self):
+        """読み取り専用の共有データを返す（他プロセスの書き込みはfingerprintで検知）"""
+        with self._lock:
+            self._refresh()
+            return self._data
+
+    def versioned_snapshot(self):
+        """(共有データ, バージョン文字列) を返す
+
+        バージョンはデータが変わるたび（ジャーナルの差分適用を含む）に変わり、
+        同じ状態なら全プロセスで同じ値になる。ETagやキャッシュのキーに使う。
+        """
+        with self._lock:
+            self._refresh()
+            return self._data, self._version
+
+    def stats(self):
+        """キャッシュのヒット・ミス回数を返す（reloads: 全体の再読み込み、journal_replays: 差分適用）"""
+        with self._lock:
+            return dict(self._stats)
+
+    def load(self):
+        """変更用の作業コピーを返す（レコード単位の浅いコピー）"""
+        with self._timed('load'):
+            data = self.snapshot()
+            working = _WorkingCopy(data)
+            working[self.collection] = [dict(rec) for rec in data[self.collection]]
+            # 取得時点のレコード（ジャーナルの適用ではレコードごと差し替えるので、参照で変更を検知できる）
+            working.base = {rec['uid']: rec for rec in data[self.collection] if 'uid' in rec}
+            return working
+
+    def _ensure_change_fields(self, data):
+        data.setdefault('change_seq', 0)
+        data.setdefault('tombstones', [])
+        data.setdefault('tombstone_floor', 0)
+        for index, rec in enumerate(data[self.collection]):
+            if 'uid' not in rec:
+                # 保存前の既存データでも全プロセスで同じuidになるよう内容から決める
+                raw = json.dumps([index, rec], sort_keys=True, ensure_ascii=False, default=str)
+                rec['uid'] = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+            rec.setdefault('seq', 0)
+
+    def _stamp_changes(self, data, previous):
+        """直前のスナップショットと比べて、追加・変更されたレコードと削除に変更番号を振る"""
+        seq = previous.get('change_seq', 0)
+        old = {rec['uid']: rec for rec in previous[self.collection]}
+        seen = set()
+        for rec in data[self.collection]:
+            if not rec.get('uid') or rec['uid'] in seen:
+                rec['uid'] = uuid.uuid4().hex[:16]
+            seen.add(rec['uid'])
+            before = old.get(rec['uid'])
+            if before is not None and rec == before:
+                continue
+            seq += 1
+            rec['seq'] = seq
+
+        tombstones = list(previous.get('tombstones', []))
+        floor = previous.get('tombstone_floor', 0)
+        for uid in old:
+            if uid not in seen:
+                seq += 1
+                tombstones.append({'uid': uid, 'seq': seq})
+        if len(tombstones) > self.tombstone_limit:
+            # 捨てた削除記録より前からの差分は返せないので、その位置を記録しておく
+            floor = tombstones[-self.tombstone_limit - 1]['seq']
+            tombstones = tombstones[-self.tombstone_limit:]
+        data['change_seq'] = seq
+        data['tombstones'] = tombstones
+        data['tombstone_floor'] = floor
+
+    def change_seq(self):
+        """現在の変更番号を返す"""
+        return self.snapshot().get('change_seq', 0)
+
+    def changes_since(self, since):
+        """変更番号 since より後に追加・変更されたレコードと削除されたuidを返す
+
+        since が無い、または古すぎて削除記録が残っていない場合は全件を返す（full=True）。
+        """
+        data = self.snapshot()
+        seq = data.get('change_seq', 0)
+        if since is None or since < data.get('tombstone_floor', 0) or since > seq:
+            return {'seq': seq, 'full': True, 'records': list(data[self.collection]), 'deleted': []}
+        return {
+            'seq': seq,
+            'full': False,
+            'records': [rec for rec in data[self.collection] if rec.get('seq', 0) > since],
+            'deleted': [t['uid'] for t in data.get('tombstones', []) if t['seq'] > since]
+        }
+
+    def _rebase(self, data, base):
+        """作業コピーの取得後に他で変更されたレコードに、作業コピーで変えていないフィールドの最新値を取り込む
+
+        load() から save() までの間にジャーナルへ追記された状態更新を、保存で消してしまわないようにする。
+        """
+        latest = {rec['uid']: rec for rec in self._data[self.collection] if 'uid' in rec}
+        records = data[self.collection]
+        for index, rec in enumerate(records):
+            before = base.get(rec.get('uid'))
+            current = latest.get(rec.get('uid'))
+            if before is None or current is None or current is before:
+                continue
+            merged = dict(rec)
+            for key, value in current.items():
+                # IDは保存時に振り直すので作業コピーの値を使う
+                if key != 'id' and rec.get(key) == before.get(key):
+                    merged[key] = value
+            records[index] = merged
+
+    def save(self, data):
+        """データを永続化し、メモリ上のスナップショットを置き換える"""
+        with self._timed('save'), self.backend.locked():
+            with self._lock:
+                # 他プロセスの保存やジャーナルへの追記を含む最新の状態を読み込んでおく
+                self._refresh()
+                if isinstance(data, _WorkingCopy):
+                    if data.base:
+                        self._rebase(data, data.base)
+                    data = dict(data)
+                if self.track_changes:
+                    # 最新の状態を基準に変更番号を振る
+                    self._stamp_changes(data, self._data)
+                fingerprint, self._cursor = self.backend.save(data)
+                self._set_fingerprint(fingerprint)
+                self._data = data
+
+    def record_updates(self, updates):
+        """レコード単位の更新をジャーナルに追記する（データ全体は書き直さない）
+
+        各更新は {'id': レコードID, 'match': 一致を確認するフィールド,
+        'fields': 更新するフィールド, 'dataset': 更新するトップレベルのフィールド}。
+        """
+        if not updates:
+            return
+        # 追記先の世代を確定させるため、先に最新の状態を読み込んでおく
+        self.snapshot()
+        with self._timed('append'):
+            needs_compaction = self.backend.append(updates)
+        if needs_compaction:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, name='store-compaction', daemon=True).start()
+
+    def compact(self):
+        """ジャーナルの内容をスナップショットに統合する"""
+        try:
+            with self.backend.locked():
+                with self._lock:
+                    self._refresh()
+                    fingerprint, self._cursor = self.backend.save(self._data)
+                    self._set_fingerprint(fingerprint)
+        finally:
+            self._compacting = False